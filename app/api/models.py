@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from pydantic import BaseModel, Field, field_validator
 
@@ -37,6 +37,9 @@ class Diagnostics(BaseModel):
     tokens_prompt: Optional[int] = None
     tokens_output: Optional[int] = None
     retrieval_k: Optional[int] = None
+    cache: Optional[str] = Field(default=None, description="semantic|response when the answer was served from cache")
+    degradations: List[str] = Field(default_factory=list, description="budget-driven cut-backs, e.g. reduced_k, skipped_rerank")
+    stages: Optional[Dict[str, float]] = Field(default=None, description="per-stage wall time in ms, when DIAGNOSTICS_STAGE_TIMINGS=1")
 
 
 class QueryRequest(BaseModel):
@@ -60,6 +63,7 @@ class ReindexRequest(BaseModel):
     region: Optional[str] = None
     crop: Optional[str] = None
     source_url: Optional[str] = None
+    doc_key: Optional[str] = None  # re-ingesting under the same key replaces that document's chunks
     max_chars: Optional[int] = 800
     overlap: Optional[int] = 100
 
@@ -1,8 +1,10 @@
+import asyncio
+import hmac
 import os
 import time
 import uuid
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from typing import Dict
 
 from app.api.models import (
@@ -12,25 +14,37 @@ from app.api.models import (
     TemplateSetRequest,
     TemplateRollbackRequest,
 )
+from app.api.sse import sse_frames
 from app.services.lang import detect_language, choose_response_language
 from app.services.ingestion import UpsertStore, ingest_text
 from app.services.retrieval import (
     InMemoryRetriever,
     EmbeddingRetriever,
-    index_store_chunks,
-    FreshnessWeightedRetriever,
-    RerankerWrapper,
+    HybridRetriever,
+    IncrementalIndexer,
+    CachingRetriever,
+    RetrievalCache,
+    ScoringPipeline,
+    FreshnessDecay,
+    AuthorityBoost,
 )
+from app.services.budget import Deadline
+from app.services.caching import SemanticCache
 from app.services.orchestrator import QueryOrchestrator
 from app.services.llm import (
     GraniteAdapter,
     GraniteWatsonXAdapter,
     GraniteReplicateAdapter,
     FakeAdapter,
+    CachedLLMAdapter,
+    TokenStream,
 )
-from app.services.embeddings import SimpleTokenizerEmbeddings
+from app.services.embeddings import embeddings_from_env, query_embeddings_from_env
 from app.services.vectorstore import vector_store_from_env
-from app.services.observability import set_trace_id, get_logger, redact_payload
+from app.services.metrics import CONTENT_TYPE, REGISTRY, cache_stats_callback, observe_stages
+from app.services.observability import set_trace_id, get_logger, redact_payload, start_stage_timings
+from app.services.slowlog import slow_query_log_from_env
+from app.services.profiling import profile_call, profile_ring_from_env, summarize
 from app.services.templates import TemplateRegistry
 
 api_router = APIRouter()
@@ -39,6 +53,10 @@ api_router = APIRouter()
 def is_orchestrator_enabled() -> bool:
     return os.getenv("FEATURE_ORCHESTRATOR", "0").lower() in {"1", "true", "yes"}
 
+# Stage timings are always logged; this flag also returns them in response diagnostics
+def stage_timings_exposed() -> bool:
+    return os.getenv("DIAGNOSTICS_STAGE_TIMINGS", "0").lower() in {"1", "true", "yes"}
+
 # Lightweight singletons for dev
 _STORE = UpsertStore()
 _TPL = TemplateRegistry()
@@ -49,41 +67,149 @@ elif LLM_PROVIDER == "fake":
     _LLM = FakeAdapter(response="RAG stub answer")
 else:
     _LLM = GraniteWatsonXAdapter()
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "0"))
+if LLM_CACHE_SIZE > 0:
+    _LLM = CachedLLMAdapter(
+        _LLM,
+        max_entries=LLM_CACHE_SIZE,
+        ttl_s=float(os.getenv("LLM_CACHE_TTL_SEC", "3600")),
+        spill_path=os.getenv("LLM_CACHE_SPILL_PATH") or None,
+    )
 
 # Retrieval provider selection
-RETRIEVAL_PROVIDER = os.getenv("RETRIEVAL_PROVIDER", "keyword").lower()  # keyword | embedding
-VECTOR_PROVIDER = os.getenv("VECTOR_PROVIDER", "memory").lower()  # memory | opensearch
+RETRIEVAL_PROVIDER = os.getenv("RETRIEVAL_PROVIDER", "keyword").lower()  # keyword | embedding | hybrid
+VECTOR_PROVIDER = os.getenv("VECTOR_PROVIDER", "memory").lower()  # memory | ivf | opensearch
 RETRIEVAL_FRESHNESS = os.getenv("RETRIEVAL_FRESHNESS", "0").lower() in {"1", "true", "yes"}
 RETRIEVAL_RERANKER = os.getenv("RETRIEVAL_RERANKER", "0").lower() in {"1", "true", "yes"}
+RETRIEVAL_CANDIDATE_MULTIPLIER = int(os.getenv("RETRIEVAL_CANDIDATE_MULTIPLIER", "0")) or None  # default: product of term multipliers
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf").lower()  # rrf | weighted
+HYBRID_BRANCH_TIMEOUT_MS = float(os.getenv("HYBRID_BRANCH_TIMEOUT_MS", "0")) or None
 
-_EMB = SimpleTokenizerEmbeddings(dim=256)
+_EMB = embeddings_from_env(dim=256)  # cached when EMBEDDING_CACHE_PATH is set
+_QEMB = query_embeddings_from_env(_EMB)  # micro-batched when EMBEDDING_BATCH_WINDOW_MS > 0
 _VS = vector_store_from_env()  # memory by default; OpenSearch requires injected client in app wiring
-_INDEXED_ONCE = False
+_INDEXER = IncrementalIndexer(_STORE, _EMB, _VS)
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "0"))
+_RETRIEVAL_CACHE = (
+    RetrievalCache(
+        lambda: (_STORE.generation, getattr(_VS, "generation", 0)),
+        max_entries=RETRIEVAL_CACHE_SIZE,
+        ttl_s=float(os.getenv("RETRIEVAL_CACHE_TTL_SEC", "300")),
+    )
+    if RETRIEVAL_CACHE_SIZE > 0
+    else None
+)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "0"))
+_ANSWER_CACHE = (
+    SemanticCache(
+        _QEMB,
+        threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+        max_entries=ANSWER_CACHE_SIZE,
+    )
+    if ANSWER_CACHE_SIZE > 0
+    else None
+)
+
+def _caches() -> Dict[str, object]:
+    return {
+        "retrieval": _RETRIEVAL_CACHE,
+        "answer": _ANSWER_CACHE,
+        "llm": _LLM if isinstance(_LLM, CachedLLMAdapter) else None,
+    }
+
+
+# Hit rate = rate(cache_hits_total) / (rate(cache_hits_total) + rate(cache_misses_total))
+REGISTRY.callback("cache_hits_total", "Cache hits by cache", "counter", cache_stats_callback(_caches, "hits"), ["cache"])
+REGISTRY.callback("cache_misses_total", "Cache misses by cache", "counter", cache_stats_callback(_caches, "misses"), ["cache"])
+REGISTRY.callback("cache_entries", "Live entries by cache", "gauge", cache_stats_callback(_caches, "size"), ["cache"])
+
+# Per-stage budgets for the async orchestrator paths (0 = wait indefinitely)
+_SIGNAL_TIMEOUT_S = float(os.getenv("ORCH_SIGNAL_TIMEOUT_MS", "0")) / 1000.0 or None
+_RETRIEVAL_TIMEOUT_S = float(os.getenv("ORCH_RETRIEVAL_TIMEOUT_MS", "0")) / 1000.0 or None
+STAGE_TIMEOUTS = {
+    name: timeout
+    for name, timeout in {"weather": _SIGNAL_TIMEOUT_S, "mandi_prices": _SIGNAL_TIMEOUT_S, "retrieval": _RETRIEVAL_TIMEOUT_S}.items()
+    if timeout
+}
+
+
+# Per-request latency budget (SLA); stages degrade as it runs down. Opt-in: 0 (default) disables.
+REQUEST_BUDGET_MS = float(os.getenv("REQUEST_BUDGET_MS", "0"))
+
+_PROFILES = profile_ring_from_env()
+_SLOW_QUERIES = slow_query_log_from_env()
+
+
+def _is_admin(request: Request) -> bool:
+    """True when ADMIN_TOKEN is set and the request carries it in X-Admin-Token."""
+    token = os.getenv("ADMIN_TOKEN")
+    return bool(token) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+
+
+def _record_if_slow(route: str, trace_id: str, elapsed_ms: int, timings, req: QueryRequest, **fields) -> None:
+    """Slow-query snapshot: stage timings, pipeline notes (retriever, k, candidates, caches) and the redacted request."""
+    if _SLOW_QUERIES is None or elapsed_ms < _SLOW_QUERIES.threshold_ms:
+        return
+    record = {"route": route, "trace_id": trace_id, "elapsed_ms": elapsed_ms, **fields, **timings.notes, "stages": timings.as_dict()}
+    record["request"] = redact_payload(req.model_dump() if hasattr(req, "model_dump") else {})
+    _SLOW_QUERIES.maybe_record(record)
+
+
+def _profiling_requested(request: Request) -> bool:
+    flag = request.headers.get("X-Profile") or request.query_params.get("profile")
+    return flag in {"1", "true", "yes"} and _is_admin(request)
+
+
+def _orchestrator() -> QueryOrchestrator:
+    return QueryOrchestrator(_get_retriever(), _LLM, answer_cache=_ANSWER_CACHE, stage_timeouts=STAGE_TIMEOUTS)
+
 
 def _get_retriever():
-    global _INDEXED_ONCE
+    # The vector index is kept in step by the ingest paths (admin_reindex), not per request
     if RETRIEVAL_PROVIDER == "embedding":
-        # Lazy one-time indexing of current store contents
-        if not _INDEXED_ONCE:
-            index_store_chunks(_STORE, _EMB, _VS)
-            _INDEXED_ONCE = True
-        base = EmbeddingRetriever(_STORE, _EMB, _VS)
+        base = EmbeddingRetriever(_STORE, _QEMB, _VS)
+    elif RETRIEVAL_PROVIDER == "hybrid":
+        base = HybridRetriever(
+            InMemoryRetriever(_STORE),
+            EmbeddingRetriever(_STORE, _QEMB, _VS),
+            fusion=HYBRID_FUSION,
+            keyword_timeout_ms=HYBRID_BRANCH_TIMEOUT_MS,
+            vector_timeout_ms=HYBRID_BRANCH_TIMEOUT_MS,
+        )
     else:
         base = InMemoryRetriever(_STORE)
 
+    # Freshness and reranking are score terms over a single candidate pass
+    terms = []
     if RETRIEVAL_FRESHNESS:
-        base = FreshnessWeightedRetriever(base)
+        terms.append(FreshnessDecay(store=_STORE))
     if RETRIEVAL_RERANKER:
-        base = RerankerWrapper(base)
+        terms.append(AuthorityBoost())
+    if terms:
+        base = ScoringPipeline(base, terms, candidate_multiplier=RETRIEVAL_CANDIDATE_MULTIPLIER)
+    if _RETRIEVAL_CACHE is not None:
+        base = CachingRetriever(base, _RETRIEVAL_CACHE)
     return base
 
 
+def _api_citations(raw) -> list:
+    """Map internal citations (doc_id/chunk_index/source_url) to API model shape."""
+    citations = []
+    for c in raw:
+        title = f"{c.get('doc_id', '')}#{c.get('chunk_index', '')}".strip('#') or "source"
+        url = c.get("source_url") or None
+        citations.append({"title": title, "url": url})
+    return citations
+
+
 @api_router.post("/query", response_model=AnswerResponse)
-async def query(req: QueryRequest):
+async def query(req: QueryRequest, request: Request):
     """Query endpoint using feature-flagged orchestrator pipeline."""
     trace_id = str(uuid.uuid4())
     set_trace_id(trace_id)
     t0 = time.perf_counter()
+    timings = start_stage_timings()
+    deadline = Deadline.from_ms(REQUEST_BUDGET_MS)
     log = get_logger("api.query")
 
     # Determine response language using prefs > locale > detected
@@ -95,36 +221,48 @@ async def query(req: QueryRequest):
     answer_text = f"[{language}] This is a placeholder response. Enable FEATURE_ORCHESTRATOR=1 for RAG."
     tokens_prompt = None
     tokens_output = None
+    answer_cache = None
+    warnings = []
+    degradations = []
+    profiled = False
 
     if is_orchestrator_enabled():
-        retriever = _get_retriever()
-        orch = QueryOrchestrator(retriever, _LLM)
+        orch = _orchestrator()
         max_gen = int(os.getenv("MAX_GENERATE_TOKENS", "256"))
-        out = orch.run(req.text, language=language, filters={}, max_generate_tokens=max_gen)
-        # Map internal citations (doc_id/chunk_index/source_url) to API model shape
-        citations = []
-        for c in out.citations:
-            title = f"{c.get('doc_id', '')}#{c.get('chunk_index', '')}".strip('#') or "source"
-            url = c.get("source_url") or None
-            citations.append({"title": title, "url": url})
+        if _profiling_requested(request):
+            out = await asyncio.to_thread(_profiled_run, orch, trace_id, req.text, language=language, filters={}, max_generate_tokens=max_gen)
+            profiled = True
+        else:
+            out = await orch.arun(req.text, language=language, filters={}, max_generate_tokens=max_gen, deadline=deadline)
+        citations = _api_citations(out.citations)
         answer_text = out.answer
+        answer_cache = out.cache
+        warnings = out.warnings
+        degradations = out.degradations
         tokens_prompt = out.tokens_prompt
         tokens_output = out.tokens_output
 
     elapsed_ms = int((time.perf_counter() - t0) * 1000)
+    stages = timings.as_dict()
+    observe_stages(stages)
     resp = AnswerResponse(
         answer=answer_text,
         language=language,
         citations=citations,
-        warnings=[],
+        warnings=warnings,
         diagnostics={
             "latency_ms": elapsed_ms,
             "tokens_prompt": tokens_prompt,
             "tokens_output": tokens_output,
             "retrieval_k": len(citations) if citations else 0,
+            "cache": answer_cache,
+            "degradations": degradations,
+            "stages": stages if stage_timings_exposed() else None,
         },
     )
     headers = {"X-Trace-Id": trace_id, "X-Elapsed-Ms": str(elapsed_ms)}
+    if profiled:
+        headers["X-Profile-Id"] = trace_id
     try:
         log.info(
             "handled query",
@@ -132,6 +270,9 @@ async def query(req: QueryRequest):
                 "extra": {
                     "elapsed_ms": elapsed_ms,
                     "feature_orchestrator": is_orchestrator_enabled(),
+                    "answer_cache": answer_cache,
+                    "degradations": degradations,
+                    "stages": stages,
                     "language": language,
                     "request": redact_payload(req.model_dump() if hasattr(req, "model_dump") else {}),
                 }
@@ -139,21 +280,41 @@ async def query(req: QueryRequest):
         )
     except Exception:
         pass
+    _record_if_slow(
+        "/v1/query",
+        trace_id,
+        elapsed_ms,
+        timings,
+        req,
+        language=language,
+        cache=answer_cache,
+        degradations=degradations,
+        warnings=warnings,
+        tokens_prompt=tokens_prompt,
+        tokens_output=tokens_output,
+    )
     return JSONResponse(resp.model_dump(), headers=headers)
 
 
+def _profiled_run(orch: QueryOrchestrator, trace_id: str, question: str, **kwargs):
+    """
+    Run one query under cProfile. The sequential `run` path keeps every stage on this thread so the
+    profile covers retrieval and generation; no deadline applies, since profiler overhead would
+    otherwise trigger budget degradations and hide the stages being investigated.
+    """
+    out, profiler = profile_call(orch.run, question, **kwargs)
+    path = _PROFILES.save(profiler, trace_id) if _PROFILES is not None else None
+    get_logger("api.profile").info("query profile", extra={"extra": {"profile_path": path, "pstats": summarize(profiler)}})
+    return out
+
+
 @api_router.get("/sources")
 async def list_sources() -> Dict[str, str]:
     """List indexed sources (placeholder)."""
     return {"status": "ok", "sources": []}
 
 
-@api_router.post("/admin/reindex")
-async def admin_reindex(req: ReindexRequest):
-    """Ingest provided text into the store and refresh embedding index if enabled."""
-    text = (req.text or "").strip()
-    if not text:
-        raise HTTPException(status_code=400, detail="text must be non-empty")
+def _ingest_and_index(req: ReindexRequest, text: str) -> Dict[str, int]:
     ingest_text(
         _STORE,
         text,
@@ -162,12 +323,38 @@ async def admin_reindex(req: ReindexRequest):
         source_url=req.source_url,
         max_chars=req.max_chars or 800,
         overlap=req.overlap or 100,
+        doc_key=req.doc_key,
     )
-    # If embedding retriever is active, refresh index
-    if RETRIEVAL_PROVIDER == "embedding":
-        index_store_chunks(_STORE, _EMB, _VS)
-    get_logger("api.admin").info("reindex", extra={"extra": {"has_text": True, "region": req.region or "", "crop": req.crop or ""}})
-    return {"status": "ok", "message": "ingested"}
+    # If embedding retriever is active, embed only what changed since the last sync
+    if RETRIEVAL_PROVIDER not in {"embedding", "hybrid"}:
+        return {"upserted": 0, "removed": 0, "retagged": 0}
+    delta = _INDEXER.sync()
+    return {"upserted": delta.upserted, "removed": delta.removed, "retagged": delta.retagged}
+
+
+@api_router.post("/admin/reindex")
+async def admin_reindex(req: ReindexRequest):
+    """Ingest provided text into the store and refresh embedding index if enabled."""
+    text = (req.text or "").strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="text must be non-empty")
+    # Chunking, index updates and embedding run in a worker thread, off the event loop
+    indexed = await asyncio.to_thread(_ingest_and_index, req, text)
+    get_logger("api.admin").info(
+        "reindex",
+        extra={"extra": {"has_text": True, "region": req.region or "", "crop": req.crop or "", **indexed}},
+    )
+    return {"status": "ok", "message": "ingested", "indexed": indexed}
+
+
+@api_router.get("/admin/slow-queries")
+async def admin_slow_queries(request: Request, limit: int = 50):
+    """Newest slow-query records (admin token required)."""
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="admin token required")
+    if _SLOW_QUERIES is None:
+        raise HTTPException(status_code=404, detail="slow query log not enabled")
+    return {"threshold_ms": _SLOW_QUERIES.threshold_ms, "queries": _SLOW_QUERIES.recent(limit)}
 
 
 @api_router.post("/admin/templates/{name}")
@@ -216,6 +403,7 @@ async def query_stream(req: QueryRequest):
     trace_id = str(uuid.uuid4())
     set_trace_id(trace_id)
     t0 = time.perf_counter()
+    timings = start_stage_timings()
 
     detected = detect_language(req.text)
     prefs_lang = req.preferences.language if req.preferences else None
@@ -226,9 +414,75 @@ async def query_stream(req: QueryRequest):
             yield f"[{language}] Streaming not enabled. Set FEATURE_ORCHESTRATOR=1."
         return StreamingResponse(_placeholder(), media_type="text/plain", headers={"X-Trace-Id": trace_id})
 
-    retriever = _get_retriever()
-    orch = QueryOrchestrator(retriever, _LLM)
-    gen = orch.run_stream(req.text, language=language, filters={})
-    headers = {"X-Trace-Id": trace_id, "X-Elapsed-Ms": str(int((time.perf_counter()-t0)*1000))}
-    get_logger("api.query").info("handled query stream", extra={"extra": {"language": language}})
-    return StreamingResponse(gen, media_type="text/plain", headers=headers)
+    orch = _orchestrator()
+
+    def _log_stream(stream: TokenStream) -> None:
+        # Total stream time is only known here; the response headers go out before any work is done
+        elapsed_ms = int((time.perf_counter() - t0) * 1000)
+        stats = {"language": language, "elapsed_ms": elapsed_ms, **stream.stats(), "stages": timings.as_dict()}
+        observe_stages(stats["stages"])
+        get_logger("api.query").info("handled query stream", extra={"extra": stats})
+        _record_if_slow("/v1/query/stream", trace_id, elapsed_ms, timings, req, language=language, ttft_ms=stats["ttft_ms"], tokens_output=stats["tokens"])
+
+    # Chunks are forwarded as the provider emits them; TTFT is measured from request start
+    gen = TokenStream(orch.run_stream(req.text, language=language, filters={}), started=t0, on_complete=_log_stream)
+    return StreamingResponse(gen, media_type="text/plain", headers={"X-Trace-Id": trace_id})
+
+
+SSE_HEARTBEAT_SEC = float(os.getenv("SSE_HEARTBEAT_SEC", "15"))
+SSE_MAX_BUFFER = int(os.getenv("SSE_MAX_BUFFER", "64"))
+
+
+@api_router.post("/query/sse")
+async def query_sse(req: QueryRequest, request: Request):
+    """Server-Sent Events stream: `citations`, then `token` events, then `done` with diagnostics."""
+    trace_id = str(uuid.uuid4())
+    set_trace_id(trace_id)
+    t0 = time.perf_counter()
+    timings = start_stage_timings()
+    deadline = Deadline.from_ms(REQUEST_BUDGET_MS)
+
+    detected = detect_language(req.text)
+    prefs_lang = req.preferences.language if req.preferences else None
+    language = choose_response_language(detected, prefs_language=prefs_lang, locale=req.locale)
+
+    async def events():
+        if not is_orchestrator_enabled():
+            yield "citations", {"citations": []}
+            yield "token", {"text": f"[{language}] Streaming not enabled. Set FEATURE_ORCHESTRATOR=1."}
+            yield "done", {"trace_id": trace_id, "language": language, "diagnostics": {"latency_ms": int((time.perf_counter() - t0) * 1000)}}
+            return
+        orch = _orchestrator()
+        retrieval_k = 0
+        async for ev in orch.astream(req.text, language=language, filters={}, deadline=deadline):
+            if ev.type == "citations":
+                citations = _api_citations(ev.data["citations"])
+                retrieval_k = len(citations)
+                yield "citations", {"citations": citations}
+            elif ev.type == "done":
+                data = dict(ev.data)
+                warnings = data.pop("warnings", [])
+                diagnostics = {**data, "latency_ms": int((time.perf_counter() - t0) * 1000), "retrieval_k": retrieval_k}
+                stages = timings.as_dict()
+                observe_stages(stages)
+                get_logger("api.query").info("handled query sse", extra={"extra": {"language": language, "warnings": warnings, **diagnostics, "stages": stages}})
+                if stage_timings_exposed():
+                    diagnostics["stages"] = stages
+                yield "done", {"trace_id": trace_id, "language": language, "warnings": warnings, "diagnostics": diagnostics}
+            else:
+                yield ev.type, ev.data
+
+    frames = sse_frames(
+        events(),
+        heartbeat_s=SSE_HEARTBEAT_SEC,
+        max_buffer=SSE_MAX_BUFFER,
+        is_disconnected=request.is_disconnected,
+    )
+    headers = {"X-Trace-Id": trace_id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(frames, media_type="text/event-stream", headers=headers)
+
+
+@api_router.get("/metrics")
+def metrics() -> PlainTextResponse:
+    """Prometheus text exposition (merged across workers when METRICS_MULTIPROC_DIR is set)."""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
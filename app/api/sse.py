@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from contextlib import suppress
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+HEARTBEAT = ": keep-alive\n\n"
+
+_DONE = object()
+
+
+def format_sse(event: str, data: Any) -> str:
+    """One Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def sse_frames(
+    events: AsyncIterator[Tuple[str, Any]],
+    *,
+    heartbeat_s: float = 15.0,
+    max_buffer: int = 64,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> AsyncIterator[str]:
+    """
+    Frame an async (event, data) stream as SSE.
+    - The producer runs as a task feeding a bounded queue: a slow client blocks it once `max_buffer`
+      frames are pending, which in turn stops pulling tokens from the LLM.
+    - While the producer is idle longer than `heartbeat_s`, a comment frame keeps proxies from timing out.
+    - On client disconnect or when this generator is closed, the producer task is cancelled so the
+      upstream LLM stream is closed rather than left running.
+    - A producer error becomes a final `error` event.
+    """
+    queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=max(1, max_buffer))
+
+    async def produce() -> None:
+        try:
+            async for event, data in events:
+                await queue.put(format_sse(event, data))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(format_sse("error", {"error": str(e)}))
+        finally:
+            aclose = getattr(events, "aclose", None)
+            if aclose is not None:
+                with suppress(Exception):
+                    await aclose()
+        await queue.put(_DONE)
+
+    task = asyncio.create_task(produce())
+    try:
+        while True:
+            try:
+                frame = await asyncio.wait_for(queue.get(), timeout=heartbeat_s)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    return
+                yield HEARTBEAT
+                continue
+            if frame is _DONE:
+                return
+            yield frame
+    finally:
+        task.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await task
@@ -1,57 +1,52 @@
 import time
-import os
-from collections import deque, defaultdict
-from typing import Deque
 
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 
 from app.api.routes import api_router
+from app.services.metrics import HTTP_REQUEST_SECONDS, RATE_LIMIT_REJECTIONS, REGISTRY
+from app.services.ratelimit import rate_limiter_from_env
 
 app = FastAPI(title="Smart Farming Advice API", version="0.1.0")
 
 
-# Simple in-memory sliding-window rate limiter (per-IP)
-_REQS: dict[str, Deque[float]] = defaultdict(deque)
+# GCRA rate limiter: one float per key, config loaded once (hot-reloaded from RATE_LIMIT_CONFIG_PATH)
+_LIMITER = rate_limiter_from_env()
 
 
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
+    _LIMITER.maybe_reload()
     # Enabled check (default off to avoid interfering with tests)
-    enabled = os.getenv("RATE_LIMIT_ENABLED", "0").lower() in {"1", "true", "yes"}
-    if not enabled:
+    if not _LIMITER.config.enabled:
         return await call_next(request)
 
-    window_seconds = int(os.getenv("RATE_LIMIT_WINDOW_SEC", "60"))
-    max_requests = int(os.getenv("RATE_LIMIT_MAX_REQUESTS", "60"))
-    client_ip = request.client.host if request.client else "unknown"
-    now = time.time()
-    dq = _REQS[client_ip]
-    # purge old
-    cutoff = now - window_seconds
-    while dq and dq[0] < cutoff:
-        dq.popleft()
-    remaining = max_requests - len(dq)
-    reset_in = 0 if not dq else max(0, int(dq[0] + window_seconds - now))
-    if remaining <= 0:
-        headers = {
-            "X-RateLimit-Limit": str(max_requests),
-            "X-RateLimit-Remaining": "0",
-            "X-RateLimit-Reset": str(reset_in),
-        }
-        return JSONResponse({"detail": "rate_limited"}, status_code=429, headers=headers)
-    dq.append(now)
+    decision = _LIMITER.check_request(request)
+    if not decision.allowed:
+        RATE_LIMIT_REJECTIONS.inc()
+        return JSONResponse({"detail": "rate_limited"}, status_code=429, headers=decision.headers())
     response = await call_next(request)
-    # update headers
-    headers = {
-        "X-RateLimit-Limit": str(max_requests),
-        "X-RateLimit-Remaining": str(max(0, remaining - 1)),
-        "X-RateLimit-Reset": str(reset_in),
-    }
-    for k, v in headers.items():
+    for k, v in decision.headers().items():
         response.headers[k] = v
     return response
 
+
+# Registered after the rate limiter so it wraps it and also times rejected requests
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    # Route templates (not raw paths) keep label cardinality bounded
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - t0,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code,
+    )
+    REGISTRY.maybe_flush()
+    return response
+
 # Mount versioned API routes
 app.include_router(api_router, prefix="/v1")
 
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import time
+from typing import Callable, Dict, List, Optional
+
+# Degradation -> fraction of the budget that must still be left to avoid it.
+# Checked when the stage starts, so later stages degrade first as the clock runs down.
+DEGRADE_BELOW: Dict[str, float] = {
+    "reduced_k": 0.75,  # retrieve fewer chunks
+    "skipped_rerank": 0.6,  # drop optional score terms (authority reranking)
+    "reduced_context": 0.5,  # shorter max_context_tokens
+    "reduced_generate_tokens": 0.4,  # lower max_generate_tokens
+}
+
+
+class Deadline:
+    """
+    Per-request time budget threaded through orchestration, retrieval and generation.
+    - `degrade(name)` answers "should this stage cut back?" from the fraction of budget left
+      and records each degradation once, in order, for diagnostics; `record(name)` adds one directly.
+    - `timeout(limit, floor=...)` caps a stage/LLM timeout by the time remaining (but not below `floor`).
+    """
+
+    def __init__(
+        self,
+        budget_s: float,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+        thresholds: Optional[Dict[str, float]] = None,
+    ) -> None:
+        if budget_s <= 0:
+            raise ValueError("budget_s must be > 0")
+        self.budget_s = budget_s
+        self._clock = clock
+        self.started = clock()
+        self.thresholds = dict(DEGRADE_BELOW if thresholds is None else thresholds)
+        self.degradations: List[str] = []
+
+    @classmethod
+    def from_ms(cls, budget_ms: float, **kwargs) -> Optional["Deadline"]:
+        """Deadline for a budget in milliseconds; None when the budget is disabled (<= 0)."""
+        return cls(budget_ms / 1000.0, **kwargs) if budget_ms > 0 else None
+
+    def elapsed_s(self) -> float:
+        return self._clock() - self.started
+
+    def remaining_s(self) -> float:
+        return max(0.0, self.budget_s - self.elapsed_s())
+
+    def fraction_left(self) -> float:
+        return self.remaining_s() / self.budget_s
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining_s() <= 0.0
+
+    def degrade(self, name: str) -> bool:
+        threshold = self.thresholds.get(name)
+        if threshold is None or self.fraction_left() >= threshold:
+            return False
+        if name not in self.degradations:
+            self.degradations.append(name)
+        return True
+
+    def record(self, name: str) -> None:
+        """Record a cut-back forced by something other than the budget (e.g. a dropped retrieval branch)."""
+        if name not in self.degradations:
+            self.degradations.append(name)
+
+    def timeout(self, limit: Optional[float] = None, *, floor: float = 0.0) -> float:
+        remaining = max(floor, self.remaining_s())
+        return remaining if limit is None else min(limit, remaining)
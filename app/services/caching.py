@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class LRUCache(Generic[V]):
+    """
+    Thread-safe bounded LRU cache with optional per-entry TTL.
+    - `ttl_s` is the default lifetime; `set(..., ttl_s=...)` overrides it per entry (None = no expiry).
+    - Expired entries are dropped lazily on access.
+    """
+
+    def __init__(self, max_entries: int = 1024, *, ttl_s: Optional[float] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[V, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry  # type: ignore[misc]
+                if expires is None or expires > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Live value for `key` without counting a hit or miss or refreshing its LRU position."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires = entry  # type: ignore[misc]
+            return value if expires is None or expires > self._clock() else default
+
+    def set(self, key: Hashable, value: V, *, ttl_s: Any = _MISSING) -> None:
+        ttl = self.ttl_s if ttl_s is _MISSING else ttl_s
+        expires = None if ttl is None else self._clock() + ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._data),
+            "evictions": self.evictions,
+        }
+
+
+class _ScopeRows:
+    """Entry ids and their normalized question vectors in a preallocated buffer that grows by doubling."""
+
+    def __init__(self, dim: int, capacity: int = 16) -> None:
+        self.ids: List[int] = []
+        self._buf = np.empty((capacity, dim), dtype=np.float32)
+
+    @property
+    def dim(self) -> int:
+        return self._buf.shape[1]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._buf[: len(self.ids)]
+
+    def append(self, entry_id: int, vec: np.ndarray) -> None:
+        n = len(self.ids)
+        if n == len(self._buf):
+            grown = np.empty((2 * n, self.dim), dtype=np.float32)
+            grown[:n] = self._buf
+            self._buf = grown
+        self._buf[n] = vec
+        self.ids.append(entry_id)
+
+    def remove(self, entry_id: int) -> None:
+        i = self.ids.index(entry_id)
+        n = len(self.ids)
+        self._buf[i : n - 1] = self._buf[i + 1 : n]
+        self.ids.pop(i)
+
+
+class SemanticCache(Generic[V]):
+    """
+    Near-duplicate lookup: returns a stored value whose question embedding has cosine
+    similarity >= `threshold` with the incoming question, within the same scope
+    (e.g. language/region/crop). Entries carry their own TTL; total size is bounded
+    with LRU eviction across scopes.
+    """
+
+    def __init__(
+        self,
+        embeddings: Any,
+        *,
+        threshold: float = 0.92,
+        max_entries: int = 2048,
+        default_ttl_s: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.default_ttl_s = default_ttl_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next_id = 0
+        # scope -> entry ids and normalized question vectors
+        self._scopes: Dict[Hashable, _ScopeRows] = {}
+        # entry id -> (scope, value, expires_at), in LRU order
+        self._entries: "OrderedDict[int, Tuple[Hashable, V, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _embed(self, question: str) -> np.ndarray:
+        vec = np.asarray(self.embeddings.embed([question])[0], dtype=np.float32)
+        return vec / (float(np.linalg.norm(vec)) or 1.0)
+
+    def _drop(self, entry_id: int) -> None:
+        scope, _, _ = self._entries.pop(entry_id)
+        rows = self._scopes[scope]
+        rows.remove(entry_id)
+        if not rows.ids:
+            del self._scopes[scope]
+
+    def get(self, question: str, scope: Hashable) -> Optional[V]:
+        with self._lock:
+            has_scope = scope in self._scopes
+        if not has_scope:
+            self.misses += 1
+            return None
+        q = self._embed(question)
+        now = self._clock()
+        with self._lock:
+            if scope not in self._scopes:
+                self.misses += 1
+                return None
+            rows = self._scopes[scope]
+            if rows.dim != q.shape[0]:
+                self.misses += 1
+                return None
+            ids = rows.ids
+            sims = rows.matrix @ q
+            found: Optional[int] = None
+            expired: List[int] = []
+            for i in np.argsort(-sims):
+                if sims[i] < self.threshold:
+                    break
+                entry_id = ids[int(i)]
+                if self._entries[entry_id][2] <= now:
+                    expired.append(entry_id)
+                    continue
+                found = entry_id
+                break
+            for entry_id in expired:
+                self._drop(entry_id)
+            if found is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(found)
+            self.hits += 1
+            return self._entries[found][1]
+
+    def set(self, question: str, scope: Hashable, value: V, *, ttl_s: Optional[float] = None) -> None:
+        q = self._embed(question)
+        expires = self._clock() + (self.default_ttl_s if ttl_s is None else ttl_s)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            rows = self._scopes.setdefault(scope, _ScopeRows(q.shape[0]))
+            if rows.dim != q.shape[0]:
+                return
+            rows.append(entry_id, q)
+            self._entries[entry_id] = (scope, value, expires)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._entries),
+        }
@@ -1,9 +1,21 @@
 from __future__ import annotations
 
-import math
+import asyncio
+import hashlib
 import os
+import queue
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import Future
 from dataclasses import dataclass
-from typing import List, Protocol
+from functools import lru_cache
+from typing import Dict, List, Optional, Protocol, Tuple
+
+import numpy as np
+
+from app.services.observability import get_logger
 
 
 class Embeddings(Protocol):
@@ -20,11 +32,15 @@ class SimpleTokenizerEmbeddings:
     """
     Very lightweight embedding: bag-of-words hash into fixed-size vectors.
     - Not production-ready. Replace with Granite embeddings later.
+    - Token buckets are memoized in a bounded LRU; a batch is counted with one bincount.
+    - `embed_sparse` returns (indices, values) pairs with the same values as the dense rows.
     """
 
-    def __init__(self, dim: int = 256, seed: int = 1337) -> None:
+    def __init__(self, dim: int = 256, seed: int = 1337, *, token_cache_size: int = 65536) -> None:
         self.dim = dim
         self.seed = seed
+        self.model_id = f"simple-hash-v1:{seed}"
+        self._bucket = lru_cache(maxsize=token_cache_size)(self._hash)
 
     def _hash(self, token: str) -> int:
         # Simple deterministic hash bounded by dim
@@ -35,14 +51,293 @@ class SimpleTokenizerEmbeddings:
             h &= 0xFFFFFFFF
         return (h ^ self.seed) % self.dim
 
+    def _counts(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), dim) float64 bucket counts for the batch."""
+        bucket = self._bucket
+        flat: List[int] = []
+        for row, t in enumerate(texts):
+            base = row * self.dim
+            flat.extend(base + bucket(tok) for tok in t.lower().split())
+        counts = np.bincount(np.asarray(flat, dtype=np.int64), minlength=len(texts) * self.dim)
+        return counts.astype(np.float64).reshape(len(texts), self.dim)
+
+    @staticmethod
+    def _norms(counts: np.ndarray) -> np.ndarray:
+        # Counts are small integers, so the squared sum is exact in any order (bit-compatible)
+        norms = np.sqrt((counts * counts).sum(axis=1))
+        norms[norms == 0.0] = 1.0
+        return norms
+
     def embed(self, texts: List[str]) -> List[List[float]]:
-        out: List[List[float]] = []
+        if not texts:
+            return []
+        counts = self._counts(texts)
+        # L2 normalize
+        return (counts / self._norms(counts)[:, None]).tolist()
+
+    def embed_sparse(self, texts: List[str]) -> List[Tuple[List[int], List[float]]]:
+        """L2-normalized (sorted bucket indices, values) per text, without dense rows."""
+        out: List[Tuple[List[int], List[float]]] = []
+        bucket = self._bucket
         for t in texts:
-            vec = [0.0] * self.dim
-            for tok in t.lower().split():
-                idx = self._hash(tok)
-                vec[idx] += 1.0
-            # L2 normalize
-            norm = math.sqrt(sum(v * v for v in vec)) or 1.0
-            out.append([v / norm for v in vec])
+            idx, cnt = np.unique(
+                np.fromiter((bucket(tok) for tok in t.lower().split()), dtype=np.int64), return_counts=True
+            )
+            vals = cnt.astype(np.float64)
+            norm = float(np.sqrt((vals * vals).sum())) or 1.0
+            out.append((idx.tolist(), (vals / norm).tolist()))
         return out
+
+
+class CachedEmbeddings:
+    """
+    Content-addressed embedding cache wrapping any Embeddings implementation.
+    - Keyed by (model id, dim, sha256(text)); vectors are stored as float64 so hits are bit-identical.
+    - Backed by SQLite (`path` may be a file or ":memory:"), so entries survive restarts.
+    - One bulk lookup and one bulk insert per `embed()` batch; LRU eviction beyond `max_entries`.
+    - Hits only record their recency in memory. The touches are written in one UPDATE batch when
+      `touch_batch` of them pile up, before an eviction sweep, or on `flush()`. The row count is
+      tracked in memory, so an insert needs no COUNT(*) and a batch commits once.
+    """
+
+    _SQL_CHUNK = 500  # stay under SQLite's bound-parameter limit
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        *,
+        path: str = ":memory:",
+        max_entries: int = 100_000,
+        model_id: Optional[str] = None,
+        touch_batch: int = 1024,
+    ) -> None:
+        self.inner = inner
+        self.dim = getattr(inner, "dim", None)
+        self.model_id = model_id or getattr(inner, "model_id", None) or type(inner).__name__
+        self.max_entries = max(1, max_entries)
+        self.touch_batch = max(1, touch_batch)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._clock = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache (key TEXT PRIMARY KEY, vec BLOB NOT NULL, used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embedding_cache_used ON embedding_cache (used)")
+        row = self._conn.execute("SELECT COALESCE(MAX(used), 0), COUNT(*) FROM embedding_cache").fetchone()
+        self._clock, self._count = int(row[0]), int(row[1])
+        # key -> clock of its latest hit, not yet written
+        self._touched: Dict[str, int] = {}
+
+    def _key(self, text: str) -> str:
+        h = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_id}:{self.dim}:{h}"
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        for i in range(0, len(keys), self._SQL_CHUNK):
+            part = keys[i : i + self._SQL_CHUNK]
+            marks = ",".join("?" * len(part))
+            for key, blob in self._conn.execute(f"SELECT key, vec FROM embedding_cache WHERE key IN ({marks})", part):
+                found[key] = array("d", blob).tolist()
+        if found:
+            self._clock += 1
+            for key in found:
+                self._touched[key] = self._clock
+        return found
+
+    def _write_touches(self) -> bool:
+        if not self._touched:
+            return False
+        self._conn.executemany("UPDATE embedding_cache SET used = ? WHERE key = ?", [(c, k) for k, c in self._touched.items()])
+        self._touched.clear()
+        return True
+
+    def _insert(self, entries: Dict[str, List[float]]) -> None:
+        self._clock += 1
+        # OR IGNORE: a concurrent miss may have stored the same key; only new rows are counted
+        cur = self._conn.executemany(
+            "INSERT OR IGNORE INTO embedding_cache (key, vec, used) VALUES (?, ?, ?)",
+            [(k, array("d", v).tobytes(), self._clock) for k, v in entries.items()],
+        )
+        self._count += max(0, cur.rowcount)
+        if self._count > self.max_entries:
+            # Recency must be on disk before the sweep picks the least recently used rows
+            self._write_touches()
+            cur = self._conn.execute(
+                "DELETE FROM embedding_cache WHERE key IN (SELECT key FROM embedding_cache ORDER BY used LIMIT ?)",
+                (self._count - self.max_entries,),
+            )
+            self._count -= max(0, cur.rowcount)
+
+    def flush(self) -> None:
+        """Write pending hit recency to disk."""
+        with self._lock:
+            if self._write_touches():
+                self._conn.commit()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        keys = [self._key(t) for t in texts]
+        with self._lock:
+            cached = self._lookup(list(dict.fromkeys(keys)))
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        if missing:
+            vecs = self.inner.embed(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vecs))
+            with self._lock:
+                self._insert(fresh)
+                if len(self._touched) >= self.touch_batch:
+                    self._write_touches()
+                self._conn.commit()
+            cached.update(fresh)
+        elif len(self._touched) >= self.touch_batch:
+            self.flush()
+        self.hits += sum(1 for k in keys if k not in missing)
+        self.misses += len(missing)
+        return [list(cached[k]) for k in keys]
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": self._count,
+        }
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches concurrent `embed()` calls into one call on the wrapped Embeddings.
+    - A worker thread collects requests for up to `max_wait_ms` or until `max_batch` texts are queued.
+    - Calls already holding `max_batch` texts or more bypass the queue.
+    - `stats()` reports batch sizes and queueing delay.
+    """
+
+    def __init__(self, inner: Embeddings, *, max_batch: int = 32, max_wait_ms: float = 3.0) -> None:
+        self.inner = inner
+        self.dim = getattr(inner, "dim", None)
+        self.model_id = getattr(inner, "model_id", None)
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[List[str], Future, float]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.batched_texts = 0
+        self.max_batch_seen = 0
+        self.queue_delay_total_ms = 0.0
+        self.queue_delay_max_ms = 0.0
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, texts: List[str]) -> "Future[List[List[float]]]":
+        fut: "Future[List[List[float]]]" = Future()
+        self._ensure_worker()
+        self._queue.put((list(texts), fut, time.perf_counter()))
+        return fut
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if len(texts) >= self.max_batch:
+            return self.inner.embed(texts)
+        return self.submit(texts).result()
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if len(texts) >= self.max_batch:
+            return self.inner.embed(texts)
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            pending = [first]
+            size = len(first[0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            # One bad batch must never kill the worker: every later caller would block forever
+            try:
+                self._flush(pending, size)
+            except Exception as exc:
+                get_logger("embeddings.batcher").error("batch failed", extra={"extra": {"error": repr(exc), "texts": size}})
+                for _, fut, _ in pending:
+                    if not fut.done():
+                        fut.set_exception(exc)
+
+    def _flush(self, pending: List[Tuple[List[str], Future, float]], size: int) -> None:
+        # Callers that gave up (e.g. a cancelled aembed) are dropped before their texts are embedded
+        pending = [item for item in pending if item[1].set_running_or_notify_cancel()]
+        if not pending:
+            return
+        size = sum(len(item[0]) for item in pending)
+        started = time.perf_counter()
+        texts = [t for item in pending for t in item[0]]
+        try:
+            vecs = self.inner.embed(texts)
+        except Exception as exc:  # propagate to every waiting caller
+            for _, fut, _ in pending:
+                fut.set_exception(exc)
+            return
+        offset = 0
+        for item_texts, fut, enqueued in pending:
+            fut.set_result(vecs[offset : offset + len(item_texts)])
+            offset += len(item_texts)
+            delay_ms = (started - enqueued) * 1000.0
+            self.queue_delay_total_ms += delay_ms
+            self.queue_delay_max_ms = max(self.queue_delay_max_ms, delay_ms)
+        self.batches += 1
+        self.batched_texts += size
+        self.max_batch_seen = max(self.max_batch_seen, size)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "texts": self.batched_texts,
+            "avg_batch_size": round(self.batched_texts / self.batches, 3) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "avg_queue_delay_ms": round(self.queue_delay_total_ms / self.batched_texts, 3) if self.batched_texts else 0.0,
+            "max_queue_delay_ms": round(self.queue_delay_max_ms, 3),
+        }
+
+
+def query_embeddings_from_env(base: Embeddings) -> Embeddings:
+    """Wrap `base` in an EmbeddingBatcher for query-time embedding when EMBEDDING_BATCH_WINDOW_MS > 0."""
+    window_ms = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "0"))
+    if window_ms <= 0:
+        return base
+    max_batch = int(os.getenv("EMBEDDING_BATCH_MAX", "32"))
+    return EmbeddingBatcher(base, max_batch=max_batch, max_wait_ms=window_ms)
+
+
+def embeddings_from_env(*, dim: int = 256) -> Embeddings:
+    """Default embeddings, wrapped in a persistent cache when EMBEDDING_CACHE_PATH is set."""
+    base = SimpleTokenizerEmbeddings(dim=dim)
+    path = os.getenv("EMBEDDING_CACHE_PATH", "").strip()
+    if not path:
+        return base
+    max_entries = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+    return CachedEmbeddings(base, path=path, max_entries=max_entries)
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Coroutine, Dict, Iterator, Optional, Tuple, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+# Statuses worth retrying: throttling and transient upstream failures
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# Provider error strings follow the existing `llm_error:<reason>` convention
+_STATUS_ERRORS = {402: "llm_error:insufficient_credit", 429: "llm_error:quota_exceeded"}
+
+
+def _status_error(status: int) -> RuntimeError:
+    return RuntimeError(_STATUS_ERRORS.get(status, f"llm_error:http_{status}"))
+
+
+class AsyncHTTPPool:
+    """
+    Keep-alive HTTP connection pool for provider calls.
+    - One `httpx.AsyncClient` per event loop, so the pool is shared by every request served on that loop.
+    - Per-call timeouts; retries on transport errors and RETRYABLE_STATUS with full-jitter exponential
+      backoff (a numeric Retry-After is honoured up to `max_backoff_s`).
+    - The timeout bounds the whole call: each attempt gets the time left, and no retry is made once
+      the backoff would use up what remains.
+    - Streams are retried only until the response headers arrive; a started stream is never replayed.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        headers: Optional[Dict[str, str]] = None,
+        timeout_s: float = 30.0,
+        connect_timeout_s: float = 5.0,
+        max_retries: int = 2,
+        backoff_s: float = 0.25,
+        max_backoff_s: float = 4.0,
+        max_connections: int = 32,
+        max_keepalive: int = 16,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.headers = dict(headers or {})
+        self.timeout_s = timeout_s
+        self.connect_timeout_s = connect_timeout_s
+        self.max_retries = max(0, max_retries)
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self.retries = 0
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(base_url=self.base_url, headers=self.headers, limits=self._limits)
+            self._clients[loop] = client
+        return client
+
+    def _timeout(self, timeout_s: Optional[float]) -> httpx.Timeout:
+        total = self.timeout_s if timeout_s is None else timeout_s
+        return httpx.Timeout(total, connect=min(total, self.connect_timeout_s))
+
+    def _delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(self.max_backoff_s, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        return random.uniform(0.0, min(self.max_backoff_s, self.backoff_s * (2 ** attempt)))
+
+    async def _send(self, method: str, path: str, *, json: Any, timeout_s: Optional[float], stream: bool) -> httpx.Response:
+        client = self._client()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.timeout_s if timeout_s is None else timeout_s)
+        attempt = 0
+        while True:
+            retry_after = None
+            cause: Optional[BaseException] = None
+            remaining = max(0.0, deadline - loop.time())
+            try:
+                request = client.build_request(method, path, json=json, timeout=self._timeout(remaining))
+                # httpx timeouts are per phase (connect, each read), so the attempt as a whole is bounded too
+                response = await asyncio.wait_for(client.send(request, stream=stream), remaining)
+            except (httpx.TimeoutException, asyncio.TimeoutError) as e:
+                error, cause = RuntimeError("llm_error:timeout"), e
+            except httpx.TransportError as e:
+                error, cause = RuntimeError("llm_error:connection"), e
+            else:
+                if response.status_code < 400:
+                    return response
+                if stream:
+                    await response.aread()
+                    await response.aclose()
+                error = _status_error(response.status_code)
+                if response.status_code not in RETRYABLE_STATUS:
+                    raise error
+                retry_after = response.headers.get("retry-after")
+            delay = self._delay(attempt, retry_after)
+            if attempt >= self.max_retries or deadline - loop.time() <= delay:
+                raise error from cause
+            await asyncio.sleep(delay)
+            attempt += 1
+            self.retries += 1
+
+    async def request_json(self, method: str, path: str, *, json: Any = None, timeout_s: Optional[float] = None) -> Any:
+        response = await self._send(method, path, json=json, timeout_s=timeout_s, stream=False)
+        return response.json()
+
+    @asynccontextmanager
+    async def stream(self, method: str, path: str, *, json: Any = None, timeout_s: Optional[float] = None) -> AsyncIterator[httpx.Response]:
+        response = await self._send(method, path, json=json, timeout_s=timeout_s, stream=True)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+
+async def iter_sse(response: httpx.Response) -> AsyncIterator[Tuple[str, str]]:
+    """Yield (event, data) pairs from a text/event-stream response; `event` defaults to "message"."""
+    event, data = "message", []
+    async for line in response.aiter_lines():
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
+    if data:
+        yield event, "\n".join(data)
+
+
+_SYNC_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_SYNC_LOCK = threading.Lock()
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Run `coro` on a long-lived background event loop and wait for the result.
+    Lets synchronous callers share the same pooled connections instead of opening a loop per call.
+    """
+    global _SYNC_LOOP
+    with _SYNC_LOCK:
+        if _SYNC_LOOP is None or _SYNC_LOOP.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="http-sync-loop", daemon=True).start()
+            _SYNC_LOOP = loop
+        loop = _SYNC_LOOP
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def iter_sync(agen: AsyncIterator[T]) -> Iterator[T]:
+    """Drive an async iterator from synchronous code via `run_sync`, one item at a time."""
+    try:
+        while True:
+            try:
+                yield run_sync(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        aclose = getattr(agen, "aclose", None)
+        if aclose is not None:
+            run_sync(aclose())
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import bisect
+import heapq
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Collection, Dict, Generic, Hashable, Iterable, List, Mapping, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+
+K = TypeVar("K", bound=Hashable)
+
+
+class MetadataIndex(Generic[K]):
+    """
+    Inverted index from (field, value) to the keys whose metadata carries that value.
+    - Keys are whatever the owner addresses items by (chunk ids, vector-store rows).
+    - Postings are insertion-ordered dicts used as sets, so results keep a stable order.
+    - Fields listed in `casefold_fields` also get a lower-cased posting for
+      case-insensitive lookups (e.g. the `region_tag` retrieval filter).
+    """
+
+    def __init__(self, *, casefold_fields: Iterable[str] = ("region",)) -> None:
+        self.casefold_fields = frozenset(casefold_fields)
+        self._postings: Dict[Tuple[str, str], Dict[K, None]] = {}
+        self._folded: Dict[Tuple[str, str], Dict[K, None]] = {}
+
+    @staticmethod
+    def _discard(table: Dict[Tuple[str, str], Dict[K, None]], pk: Tuple[str, str], key: K) -> None:
+        posting = table.get(pk)
+        if posting is None:
+            return
+        posting.pop(key, None)
+        if not posting:
+            del table[pk]
+
+    def add(self, key: K, metadata: Mapping[str, str]) -> None:
+        for field, value in metadata.items():
+            if not isinstance(value, str):
+                continue
+            self._postings.setdefault((field, value), {})[key] = None
+            if field in self.casefold_fields:
+                self._folded.setdefault((field, value.lower()), {})[key] = None
+
+    def remove(self, key: K, metadata: Mapping[str, str]) -> None:
+        for field, value in metadata.items():
+            if not isinstance(value, str):
+                continue
+            self._discard(self._postings, (field, value), key)
+            if field in self.casefold_fields:
+                self._discard(self._folded, (field, value.lower()), key)
+
+    def replace(self, key: K, old: Optional[Mapping[str, str]], new: Mapping[str, str]) -> None:
+        if old is not None:
+            self.remove(key, old)
+        self.add(key, new)
+
+    def candidates(
+        self,
+        equals: Optional[Mapping[str, str]] = None,
+        *,
+        casefold: Optional[Mapping[str, str]] = None,
+    ) -> Optional[List[K]]:
+        """
+        Keys matching every exact (`equals`) and case-insensitive (`casefold`) condition.
+        Returns None when the filter cannot be answered from the index (non-string value,
+        or a case-insensitive field that is not folded); callers then fall back to a scan.
+        """
+        postings: List[Dict[K, None]] = []
+        for field, value in (equals or {}).items():
+            if not isinstance(value, str):
+                return None
+            postings.append(self._postings.get((field, value), {}))
+        for field, value in (casefold or {}).items():
+            if not isinstance(value, str) or field not in self.casefold_fields:
+                return None
+            postings.append(self._folded.get((field, value.lower()), {}))
+        if not postings:
+            return None
+        postings.sort(key=len)
+        smallest, rest = postings[0], postings[1:]
+        return [key for key in smallest if all(key in p for p in rest)]
+
+
+# Split on whitespace, ASCII punctuation and the Devanagari danda; keeps Indic combining marks intact
+_TOKEN_RE = re.compile(r"[^\s!\"#$%&'()*+,\-./:;<=>?@\[\\\]^_`{|}~।॥]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens used by the keyword index and its queries."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index(Generic[K]):
+    """
+    Incremental token-level inverted index with Okapi BM25 scoring.
+    - Postings map term -> {key: term frequency}; lengths and distinct terms are kept per key
+      so replacing a document only touches its own postings.
+    - `search` only walks the postings of the query's own terms and selects top-k with a heap.
+    """
+
+    def __init__(self, *, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[K, int]] = {}
+        self._doc_len: Dict[K, int] = {}
+        self._doc_terms: Dict[K, Tuple[str, ...]] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, key: K, text: str) -> None:
+        if key in self._doc_len:
+            self.remove(key)
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[key] = tf
+        self._doc_terms[key] = tuple(counts)
+        self._doc_len[key] = len(tokens)
+        self._total_len += len(tokens)
+
+    def remove(self, key: K) -> None:
+        dl = self._doc_len.pop(key, None)
+        if dl is None:
+            return
+        self._total_len -= dl
+        for term in self._doc_terms.pop(key, ()):
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self._postings[term]
+
+    def search(
+        self,
+        query_tokens: Iterable[str],
+        *,
+        k: int = 5,
+        candidates: Optional[Collection[K]] = None,
+    ) -> List[Tuple[K, float]]:
+        """Top-k (key, score) for the query terms, optionally restricted to `candidates`."""
+        n = len(self._doc_len)
+        if k <= 0 or n == 0:
+            return []
+        allowed = None if candidates is None else (candidates if isinstance(candidates, (set, frozenset, dict)) else set(candidates))
+        if allowed is not None and not allowed:
+            return []
+        avgdl = self._total_len / n or 1.0
+        k1, b = self.k1, self.b
+        doc_len = self._doc_len
+        scores: Dict[K, float] = {}
+        for term in dict.fromkeys(query_tokens):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            if allowed is not None and len(allowed) < df:
+                items = ((key, posting[key]) for key in allowed if key in posting)
+            else:
+                items = posting.items()
+            for key, tf in items:
+                if allowed is not None and key not in allowed:
+                    continue
+                norm = k1 * (1.0 - b + b * doc_len[key] / avgdl)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+
+
+class TimestampIndex(Generic[K]):
+    """
+    Epoch-seconds timestamps per key in a compact float64 side array, plus a sorted view
+    for range queries ("ingested in the last 14 days") without parsing date strings.
+    Unknown timestamps are stored as NaN and never match a range.
+    """
+
+    def __init__(self) -> None:
+        self._values = array("d")
+        self._slots: Dict[K, int] = {}
+        self._free: List[int] = []
+        self._sorted_ts: List[float] = []
+        self._sorted_keys: List[K] = []
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def get(self, key: K) -> float:
+        slot = self._slots.get(key)
+        return self._values[slot] if slot is not None else math.nan
+
+    def add(self, key: K, ts: float) -> None:
+        if key in self._slots:
+            self.remove(key)
+        slot = self._free.pop() if self._free else len(self._values)
+        if slot == len(self._values):
+            self._values.append(ts)
+        else:
+            self._values[slot] = ts
+        self._slots[key] = slot
+        if not math.isnan(ts):
+            i = bisect.bisect_right(self._sorted_ts, ts)
+            self._sorted_ts.insert(i, ts)
+            self._sorted_keys.insert(i, key)
+
+    def remove(self, key: K) -> None:
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        ts = self._values[slot]
+        self._values[slot] = math.nan
+        self._free.append(slot)
+        if math.isnan(ts):
+            return
+        lo = bisect.bisect_left(self._sorted_ts, ts)
+        hi = bisect.bisect_right(self._sorted_ts, ts)
+        for i in range(lo, hi):
+            if self._sorted_keys[i] == key:
+                del self._sorted_ts[i]
+                del self._sorted_keys[i]
+                break
+
+    def values(self, keys: Sequence[K]) -> np.ndarray:
+        """Timestamps for `keys` as a float64 array (NaN where unknown)."""
+        buf = np.frombuffer(self._values, dtype=np.float64) if self._values else np.empty(0)
+        slots = np.fromiter((self._slots.get(k, -1) for k in keys), dtype=np.int64, count=len(keys))
+        out = np.full(len(keys), np.nan)
+        known = slots >= 0
+        out[known] = buf[slots[known]]
+        return out
+
+    def between(self, start: Optional[float] = None, end: Optional[float] = None) -> List[K]:
+        """Keys with start <= ts <= end (either bound optional), oldest first."""
+        lo = 0 if start is None else bisect.bisect_left(self._sorted_ts, start)
+        hi = len(self._sorted_ts) if end is None else bisect.bisect_right(self._sorted_ts, end)
+        return self._sorted_keys[lo:hi]
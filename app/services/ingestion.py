@@ -4,6 +4,10 @@ from dataclasses import dataclass
 from datetime import datetime, UTC
 from typing import Dict, Iterable, List, Optional, Tuple
 import hashlib
+import math
+import threading
+
+from app.services.indexes import BM25Index, MetadataIndex, TimestampIndex
 
 
 @dataclass
@@ -75,29 +79,123 @@ def enrich_metadata(
     return meta
 
 
+def iso_epoch(value: str) -> float:
+    """Epoch seconds of an ISO date(time); naive values are UTC. Raises ValueError if invalid."""
+    dt = datetime.fromisoformat(value)
+    return (dt if dt.tzinfo else dt.replace(tzinfo=UTC)).timestamp()
+
+
+def ingested_epoch(meta: Dict[str, str]) -> float:
+    """Epoch seconds of meta['ingested_at'] (naive values are UTC); NaN if missing/invalid."""
+    ts = meta.get("ingested_at")
+    if not ts:
+        return math.nan
+    try:
+        return iso_epoch(ts)
+    except (TypeError, ValueError):
+        return math.nan
+
+
 class UpsertStore:
-    """In-memory upsert interface (stub) to simulate vector/db persistence."""
+    """
+    In-memory upsert interface (stub) to simulate vector/db persistence.
+    - `generation` increases on every chunk change; `changes_since(g)` returns what changed after g
+      so downstream indexes can apply deltas instead of rebuilding.
+    - `time_index` holds each chunk's ingested_at as epoch seconds, parsed once at upsert.
+    - A document is identified by its content and source_url, unless the caller supplies a `doc_key`:
+      re-ingesting under the same key replaces that document's chunks (e.g. an updated bulletin).
+    - Chunks whose text is unchanged but whose metadata changed are logged as metadata-only
+      (`text_changed_after`), so indexes can retag them instead of re-embedding.
+    - Writers hold `lock` (reentrant); retrievers take it while reading the indexes, so a query
+      running in a worker thread never sees an ingest half-applied.
+    """
 
     def __init__(self) -> None:
         self.docs: Dict[str, Document] = {}
         self.chunks: Dict[str, Chunk] = {}
-
-    def upsert_document(self, text: str, metadata: Dict[str, str]) -> Document:
-        doc_id = _hash_id(text, metadata.get("source_url", ""))
-        doc = Document(id=doc_id, text=text, metadata=metadata)
-        self.docs[doc_id] = doc
-        return doc
+        self.meta_index: MetadataIndex[str] = MetadataIndex()
+        self.text_index: BM25Index[str] = BM25Index()
+        self.time_index: TimestampIndex[str] = TimestampIndex()
+        self.generation = 0
+        # chunk_id -> generation of its last upsert/removal, kept in change order
+        self._changelog: Dict[str, int] = {}
+        self._doc_chunks: Dict[str, List[str]] = {}
+        # chunk_id -> generation of its last text change (metadata-only changes leave it alone)
+        self._text_gen: Dict[str, int] = {}
+        self.lock = threading.RLock()
+
+    def _log_change(self, chunk_id: str, *, text_changed: bool = True) -> None:
+        self.generation += 1
+        self._changelog.pop(chunk_id, None)
+        self._changelog[chunk_id] = self.generation
+        if text_changed:
+            self._text_gen[chunk_id] = self.generation
+
+    def text_changed_after(self, chunk_id: str, generation: int) -> bool:
+        """Whether the chunk's text (not just its metadata) changed after `generation`."""
+        return self._text_gen.get(chunk_id, 0) > generation
+
+    def upsert_document(self, text: str, metadata: Dict[str, str], *, doc_key: Optional[str] = None) -> Document:
+        with self.lock:
+            doc_id = _hash_id("key", doc_key) if doc_key else _hash_id(text, metadata.get("source_url", ""))
+            doc = Document(id=doc_id, text=text, metadata=metadata)
+            self.docs[doc_id] = doc
+            return doc
 
     def upsert_chunks(self, doc: Document, parts: Iterable[str]) -> List[Chunk]:
-        out: List[Chunk] = []
-        for idx, part in enumerate(parts):
-            chunk_id = _hash_id(doc.id, str(idx), part[:32])
-            meta = dict(doc.metadata)
-            meta["chunk_index"] = str(idx)
-            ch = Chunk(id=chunk_id, doc_id=doc.id, text=part, metadata=meta)
-            self.chunks[chunk_id] = ch
-            out.append(ch)
-        return out
+        """Upsert a document's chunks; chunks of the same document not produced again are removed."""
+        with self.lock:
+            out: List[Chunk] = []
+            ts = ingested_epoch(doc.metadata)
+            for idx, part in enumerate(parts):
+                chunk_id = _hash_id(doc.id, str(idx), part[:32])
+                meta = dict(doc.metadata)
+                meta["chunk_index"] = str(idx)
+                ch = Chunk(id=chunk_id, doc_id=doc.id, text=part, metadata=meta)
+                out.append(ch)
+                prev = self.chunks.get(chunk_id)
+                same_text = prev is not None and prev.text == part
+                if same_text and prev.metadata == meta:
+                    continue
+                self.meta_index.replace(chunk_id, prev.metadata if prev else None, meta)
+                if not same_text:
+                    self.text_index.add(chunk_id, part)
+                self.time_index.add(chunk_id, ts)
+                self.chunks[chunk_id] = ch
+                self._log_change(chunk_id, text_changed=not same_text)
+            new_ids = [ch.id for ch in out]
+            keep = set(new_ids)
+            self.remove_chunks([cid for cid in self._doc_chunks.get(doc.id, []) if cid not in keep])
+            self._doc_chunks[doc.id] = new_ids
+            return out
+
+    def remove_chunks(self, chunk_ids: Iterable[str]) -> int:
+        with self.lock:
+            removed = 0
+            for cid in chunk_ids:
+                ch = self.chunks.pop(cid, None)
+                if ch is None:
+                    continue
+                self.meta_index.remove(cid, ch.metadata)
+                self.text_index.remove(cid)
+                self.time_index.remove(cid)
+                self._text_gen.pop(cid, None)
+                self._log_change(cid, text_changed=False)
+                removed += 1
+            return removed
+
+    def changes_since(self, generation: int) -> Tuple[List[Chunk], List[str]]:
+        """(upserted chunks, removed chunk ids) changed after `generation`, oldest first."""
+        with self.lock:
+            changed: List[str] = []
+            for cid, gen in reversed(self._changelog.items()):
+                if gen <= generation:
+                    break
+                changed.append(cid)
+            changed.reverse()
+            upserted = [self.chunks[cid] for cid in changed if cid in self.chunks]
+            removed = [cid for cid in changed if cid not in self.chunks]
+            return upserted, removed
 
 
 def ingest_text(
@@ -111,6 +209,7 @@ def ingest_text(
     effective_date: Optional[datetime] = None,
     max_chars: int = 800,
     overlap: int = 100,
+    doc_key: Optional[str] = None,
 ) -> Tuple[Document, List[Chunk]]:
     meta = enrich_metadata(
         region=region,
@@ -119,7 +218,8 @@ def ingest_text(
         source_url=source_url,
         effective_date=effective_date,
     )
-    doc = store.upsert_document(text=text, metadata=meta)
     parts = chunk_text(text, max_chars=max_chars, overlap=overlap)
-    chs = store.upsert_chunks(doc, parts)
+    with store.lock:
+        doc = store.upsert_document(text=text, metadata=meta, doc_key=doc_key)
+        chs = store.upsert_chunks(doc, parts)
     return doc, chs
@@ -1,8 +1,19 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
 import os
-from dataclasses import dataclass
-from typing import Protocol, Iterable, List, Optional
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from typing import Any, AsyncIterator, Callable, Dict, Protocol, Iterable, Iterator, List, Optional, Tuple
+
+from app.services.caching import LRUCache
+from app.services.http import AsyncHTTPPool, iter_sse, iter_sync, run_sync
 
 
 @dataclass
@@ -11,6 +22,7 @@ class LLMResponse:
     tokens_prompt: int
     tokens_output: int
     model: str
+    cached: bool = False
 
 
 class LLMAdapter(Protocol):
@@ -34,18 +46,269 @@ class LLMAdapter(Protocol):
         ...
 
 
+class AsyncLLMAdapter(Protocol):
+    async def agenerate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        timeout_s: Optional[float] = None,
+    ) -> LLMResponse:  # pragma: no cover (interface)
+        ...
+    def astream_generate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        timeout_s: Optional[float] = None,
+    ) -> AsyncIterator[str]:  # pragma: no cover (interface)
+        ...
+
+
+async def agenerate(llm: Any, prompt: str, **kwargs: Any) -> LLMResponse:
+    """Call `llm.agenerate` when the adapter is async-native, else run `generate` in a worker thread."""
+    if hasattr(llm, "agenerate"):
+        return await llm.agenerate(prompt, **kwargs)
+    kwargs.pop("timeout_s", None)
+    return await asyncio.to_thread(llm.generate, prompt, **kwargs)
+
+
+async def astream_generate(llm: Any, prompt: str, **kwargs: Any) -> AsyncIterator[str]:
+    """Iterate `llm.astream_generate` when available, else the sync stream (one chunk per loop step)."""
+    if hasattr(llm, "astream_generate"):
+        async for part in llm.astream_generate(prompt, **kwargs):
+            yield part
+        return
+    kwargs.pop("timeout_s", None)
+    for part in llm.stream_generate(prompt, **kwargs):
+        yield part
+
+
+_WORD_RE = re.compile(r"\s*\S+\s*")
+
+
+class StopSequenceFilter:
+    """
+    Incremental stop-sequence and length enforcement for streamed text.
+    - `feed()` returns the text that is safe to emit; a tail that could be the start of a stop
+      sequence is held back until the next chunk disambiguates it, so stops spanning chunks are caught.
+    - The cut is the earliest start of any stop, as in the non-streaming path: a complete stop is only
+      acted on once no longer stop could still begin before it.
+    - After a stop or the `max_chars` budget is hit, `done` is set and further input is ignored.
+    """
+
+    def __init__(self, stop: Optional[List[str]] = None, *, max_chars: Optional[int] = None) -> None:
+        self.stops = [s for s in (stop or []) if s]
+        self.max_chars = max_chars
+        self.emitted = 0
+        self.done = False
+        self._held = ""
+
+    def _partial(self, text: str) -> int:
+        """Length of the longest suffix of `text` that is a proper prefix of some stop sequence."""
+        best = 0
+        for stop in self.stops:
+            for n in range(min(len(stop) - 1, len(text)), best, -1):
+                if text.endswith(stop[:n]):
+                    best = n
+                    break
+        return best
+
+    def _cap(self, text: str) -> str:
+        if self.max_chars is not None and self.emitted + len(text) >= self.max_chars:
+            text = text[: self.max_chars - self.emitted]
+            self.done = True
+        self.emitted += len(text)
+        return text
+
+    def feed(self, chunk: str) -> str:
+        if self.done:
+            return ""
+        text = self._held + chunk
+        cut = self._cut(text)
+        start = len(text) - self._partial(text)  # earliest position a stop might still begin at
+        if cut is not None and cut <= start:
+            self._held = ""
+            out = self._cap(text[:cut])
+            self.done = True
+            return out
+        self._held = text[start:]
+        return self._cap(text[:start])
+
+    def _cut(self, text: str) -> Optional[int]:
+        cuts = [i for i in (text.find(s) for s in self.stops) if i >= 0]
+        return min(cuts) if cuts else None
+
+    def flush(self) -> str:
+        text, self._held = self._held, ""
+        if self.done:
+            return ""
+        cut = self._cut(text)
+        self.done = cut is not None
+        return self._cap(text if cut is None else text[:cut])
+
+
+def limit_stream(parts: Iterable[str], *, stop: Optional[List[str]] = None, max_chars: Optional[int] = None) -> Iterator[str]:
+    """Apply StopSequenceFilter to a chunk stream; stops pulling from the provider once done."""
+    flt = StopSequenceFilter(stop, max_chars=max_chars)
+    for part in parts:
+        out = flt.feed(part)
+        if out:
+            yield out
+        if flt.done:
+            # Release the provider stream (and its connection) instead of draining it
+            close = getattr(parts, "close", None)
+            if close is not None:
+                close()
+            return
+    tail = flt.flush()
+    if tail:
+        yield tail
+
+
+async def alimit_stream(parts: AsyncIterator[str], *, stop: Optional[List[str]] = None, max_chars: Optional[int] = None) -> AsyncIterator[str]:
+    flt = StopSequenceFilter(stop, max_chars=max_chars)
+    async for part in parts:
+        out = flt.feed(part)
+        if out:
+            yield out
+        if flt.done:
+            aclose = getattr(parts, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            return
+    tail = flt.flush()
+    if tail:
+        yield tail
+
+
+async def _aiter(parts: Iterable[str]) -> AsyncIterator[str]:
+    for part in parts:
+        yield part
+
+
+class _StreamStats:
+    """Time-to-first-token and throughput bookkeeping shared by the sync and async token streams."""
+
+    def __init__(self, started: Optional[float], on_complete: Optional[Callable[[Any], None]]) -> None:
+        self.started = time.perf_counter() if started is None else started
+        self.first_at: Optional[float] = None
+        self.ended_at: Optional[float] = None
+        self.chunks = 0
+        self._parts: List[str] = []
+        self._on_complete = on_complete
+
+    def _record(self, part: str) -> str:
+        if self.first_at is None:
+            self.first_at = time.perf_counter()
+        self.chunks += 1
+        self._parts.append(part)
+        return part
+
+    def _finish(self) -> None:
+        if self.ended_at is None:
+            self.ended_at = time.perf_counter()
+            if self._on_complete is not None:
+                self._on_complete(self)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def tokens(self) -> int:
+        # Same rough word-based estimate the adapters use for token counts
+        return len(self.text.split())
+
+    @property
+    def ttft_ms(self) -> Optional[float]:
+        return None if self.first_at is None else round((self.first_at - self.started) * 1000, 2)
+
+    @property
+    def tokens_per_s(self) -> Optional[float]:
+        if self.first_at is None or self.ended_at is None:
+            return None
+        elapsed = self.ended_at - self.first_at
+        return round(self.tokens / elapsed, 2) if elapsed > 0 else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ttft_ms": self.ttft_ms, "tokens": self.tokens, "chunks": self.chunks, "tokens_per_s": self.tokens_per_s}
+
+
+class TokenStream(_StreamStats):
+    """Iterator over streamed chunks that records TTFT and tokens/sec; `on_complete(stream)` fires at the end."""
+
+    def __init__(self, parts: Iterable[str], *, started: Optional[float] = None, on_complete: Optional[Callable[[Any], None]] = None) -> None:
+        super().__init__(started, on_complete)
+        self._it = iter(parts)
+
+    def __iter__(self) -> "TokenStream":
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return self._record(next(self._it))
+        except StopIteration:
+            self._finish()
+            raise
+
+
+class AsyncTokenStream(_StreamStats):
+    """Async counterpart of TokenStream."""
+
+    def __init__(self, parts: AsyncIterator[str], *, started: Optional[float] = None, on_complete: Optional[Callable[[Any], None]] = None) -> None:
+        super().__init__(started, on_complete)
+        self._it = parts.__aiter__()
+
+    def __aiter__(self) -> "AsyncTokenStream":
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return self._record(await self._it.__anext__())
+        except StopAsyncIteration:
+            self._finish()
+            raise
+
+
 class GraniteAdapter:
     """
-    Placeholder adapter for IBM Granite models.
-    - Reads API key/config from environment but does NOT make network calls in this scaffold.
-    - Produces a deterministic stubbed response for tests and local dev.
+    Adapter for IBM Granite models.
+    - Without `base_url` it makes no network calls and produces a deterministic stubbed response
+      for tests and local dev.
+    - With `base_url`, provider subclasses (which define `_http_generate`/`_http_stream`) call the
+      HTTP API through a shared keep-alive AsyncHTTPPool (per-call timeouts, jittered retries); sync
+      methods reuse the same pool. The base class has no HTTP API and rejects `base_url`.
     """
 
-    def __init__(self, *, model: str = "granite-13b-chat", api_key_env: str = "GRANITE_API_KEY") -> None:
+    def __init__(
+        self,
+        *,
+        model: str = "granite-13b-chat",
+        api_key_env: str = "GRANITE_API_KEY",
+        base_url: Optional[str] = None,
+        timeout_s: float = 30.0,
+        max_retries: int = 2,
+    ) -> None:
+        if base_url and not hasattr(self, "_http_generate"):
+            raise ValueError(f"{type(self).__name__} has no HTTP API; use GraniteWatsonXAdapter or GraniteReplicateAdapter for base_url")
         self.model = model
         self.api_key_env = api_key_env
         self.api_key = os.getenv(api_key_env)  # Not required for stubbed mode
         self._fail_mode = os.getenv("LLM_SIMULATE_ERROR", "").lower()  # e.g., "quota" | "credit"
+        self.base_url = base_url
+        self.pool = (
+            AsyncHTTPPool(base_url, headers=self._headers(), timeout_s=timeout_s, max_retries=max_retries)
+            if base_url
+            else None
+        )
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
 
     def _estimate_tokens(self, text: str) -> int:
         # Rough approximation: 1 token ~= 0.75 words
@@ -60,15 +323,13 @@ class GraniteAdapter:
         temperature: float = 0.2,
         stop: Optional[List[str]] = None,
     ) -> LLMResponse:
+        if self.pool is not None:
+            return run_sync(self._http_generate(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop, timeout_s=None))
         if self._fail_mode == "quota":
             raise RuntimeError("llm_error:quota_exceeded")
         if self._fail_mode == "credit":
             raise RuntimeError("llm_error:insufficient_credit")
-        stub_text = (
-            f"[granite-stub:{self.model}] "
-            f"{prompt[:120]}" + ("…" if len(prompt) > 120 else "")
-        )
-        out_text = stub_text[:max_tokens * 4]  # very rough cap
+        out_text = self._stub_text(prompt)[:max_tokens * 4]  # very rough cap
         # Apply naive stop sequence truncation for stub
         if stop:
             for s in stop:
@@ -79,6 +340,17 @@ class GraniteAdapter:
         to = self._estimate_tokens(out_text)
         return LLMResponse(text=out_text, tokens_prompt=tp, tokens_output=to, model=self.model)
 
+    def _stub_text(self, prompt: str) -> str:
+        return f"[granite-stub:{self.model}] " f"{prompt[:120]}" + ("…" if len(prompt) > 120 else "")
+
+    def _stub_tokens(self, prompt: str) -> Iterator[str]:
+        if self._fail_mode == "quota":
+            raise RuntimeError("llm_error:quota_exceeded")
+        if self._fail_mode == "credit":
+            raise RuntimeError("llm_error:insufficient_credit")
+        # Word-sized tokens, emitted one at a time like a provider stream
+        yield from _WORD_RE.findall(self._stub_text(prompt))
+
     def stream_generate(
         self,
         prompt: str,
@@ -86,26 +358,162 @@ class GraniteAdapter:
         max_tokens: int = 256,
         temperature: float = 0.2,
         stop: Optional[List[str]] = None,
-    ) -> Iterable[str]:
-        if self._fail_mode == "quota":
-            raise RuntimeError("llm_error:quota_exceeded")
-        if self._fail_mode == "credit":
-            raise RuntimeError("llm_error:insufficient_credit")
-        # Simple 3-chunk stream stub
-        full = self.generate(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop).text
-        n = max(1, len(full) // 3)
-        for i in range(0, len(full), n):
-            yield full[i : i + n]
+    ) -> "TokenStream":
+        if self.pool is not None:
+            raw = iter_sync(self._http_stream(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop, timeout_s=None))
+        else:
+            raw = self._stub_tokens(prompt)
+        return TokenStream(limit_stream(raw, stop=stop, max_chars=max_tokens * 4))
+
+    async def agenerate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        timeout_s: Optional[float] = None,
+    ) -> LLMResponse:
+        if self.pool is None:
+            return self.generate(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop)
+        return await self._http_generate(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop, timeout_s=timeout_s)
+
+    async def astream_generate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        timeout_s: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        if self.pool is None:
+            raw = _aiter(self._stub_tokens(prompt))
+        else:
+            raw = self._http_stream(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop, timeout_s=timeout_s)
+        async for part in AsyncTokenStream(alimit_stream(raw, stop=stop, max_chars=max_tokens * 4)):
+            yield part
 
 
 class GraniteWatsonXAdapter(GraniteAdapter):
-    def __init__(self, *, model: str = "granite-13b-chat-wx", api_key_env: str = "GRANITE_API_KEY") -> None:
-        super().__init__(model=model, api_key_env=api_key_env)
+    """watsonx.ai text generation API (`GRANITE_WX_URL`); the API key is sent as a bearer token."""
+
+    API_VERSION = "2023-05-29"
+
+    def __init__(
+        self,
+        *,
+        model: str = "granite-13b-chat-wx",
+        api_key_env: str = "GRANITE_API_KEY",
+        base_url: Optional[str] = None,
+        project_id: Optional[str] = None,
+        timeout_s: float = 30.0,
+        max_retries: int = 2,
+    ) -> None:
+        super().__init__(
+            model=model,
+            api_key_env=api_key_env,
+            base_url=base_url or os.getenv("GRANITE_WX_URL") or None,
+            timeout_s=timeout_s,
+            max_retries=max_retries,
+        )
+        self.project_id = project_id or os.getenv("GRANITE_WX_PROJECT_ID")
+
+    def _body(self, prompt: str, max_tokens: int, temperature: float, stop: Optional[List[str]]) -> Dict[str, Any]:
+        body: Dict[str, Any] = {
+            "model_id": self.model,
+            "input": prompt,
+            "parameters": {"max_new_tokens": max_tokens, "temperature": temperature, "stop_sequences": list(stop or [])},
+        }
+        if self.project_id:
+            body["project_id"] = self.project_id
+        return body
+
+    async def _http_generate(self, prompt: str, *, max_tokens: int, temperature: float, stop: Optional[List[str]], timeout_s: Optional[float]) -> LLMResponse:
+        data = await self.pool.request_json(
+            "POST",
+            f"/ml/v1/text/generation?version={self.API_VERSION}",
+            json=self._body(prompt, max_tokens, temperature, stop),
+            timeout_s=timeout_s,
+        )
+        result = (data.get("results") or [{}])[0]
+        text = result.get("generated_text", "")
+        return LLMResponse(
+            text=text,
+            tokens_prompt=result.get("input_token_count") or self._estimate_tokens(prompt),
+            tokens_output=result.get("generated_token_count") or self._estimate_tokens(text),
+            model=self.model,
+        )
+
+    async def _http_stream(self, prompt: str, *, max_tokens: int, temperature: float, stop: Optional[List[str]], timeout_s: Optional[float]) -> AsyncIterator[str]:
+        path = f"/ml/v1/text/generation_stream?version={self.API_VERSION}"
+        async with self.pool.stream("POST", path, json=self._body(prompt, max_tokens, temperature, stop), timeout_s=timeout_s) as resp:
+            async for _, data in iter_sse(resp):
+                for result in json.loads(data).get("results", []):
+                    if result.get("generated_text"):
+                        yield result["generated_text"]
 
 
 class GraniteReplicateAdapter(GraniteAdapter):
-    def __init__(self, *, model: str = "granite-13b-chat-replicate", api_key_env: str = "REPLICATE_API_TOKEN") -> None:
-        super().__init__(model=model, api_key_env=api_key_env)
+    """Replicate predictions API (`REPLICATE_API_URL`); waits synchronously, streams via the prediction's SSE URL."""
+
+    def __init__(
+        self,
+        *,
+        model: str = "granite-13b-chat-replicate",
+        api_key_env: str = "REPLICATE_API_TOKEN",
+        base_url: Optional[str] = None,
+        timeout_s: float = 60.0,
+        max_retries: int = 2,
+    ) -> None:
+        super().__init__(
+            model=model,
+            api_key_env=api_key_env,
+            base_url=base_url or os.getenv("REPLICATE_API_URL") or None,
+            timeout_s=timeout_s,
+            max_retries=max_retries,
+        )
+
+    def _headers(self) -> Dict[str, str]:
+        return {**super()._headers(), "Prefer": "wait"}
+
+    def _input(self, prompt: str, max_tokens: int, temperature: float, stop: Optional[List[str]]) -> Dict[str, Any]:
+        inp: Dict[str, Any] = {"prompt": prompt, "max_new_tokens": max_tokens, "temperature": temperature}
+        if stop:
+            inp["stop_sequences"] = ",".join(stop)
+        return inp
+
+    async def _http_generate(self, prompt: str, *, max_tokens: int, temperature: float, stop: Optional[List[str]], timeout_s: Optional[float]) -> LLMResponse:
+        data = await self.pool.request_json(
+            "POST",
+            f"/v1/models/{self.model}/predictions",
+            json={"input": self._input(prompt, max_tokens, temperature, stop)},
+            timeout_s=timeout_s,
+        )
+        if data.get("status") != "succeeded":
+            raise RuntimeError(f"llm_error:prediction_{data.get('status') or 'unknown'}")
+        output = data.get("output")
+        text = "".join(output) if isinstance(output, list) else str(output or "")
+        return LLMResponse(text=text, tokens_prompt=self._estimate_tokens(prompt), tokens_output=self._estimate_tokens(text), model=self.model)
+
+    async def _http_stream(self, prompt: str, *, max_tokens: int, temperature: float, stop: Optional[List[str]], timeout_s: Optional[float]) -> AsyncIterator[str]:
+        data = await self.pool.request_json(
+            "POST",
+            f"/v1/models/{self.model}/predictions",
+            json={"input": self._input(prompt, max_tokens, temperature, stop), "stream": True},
+            timeout_s=timeout_s,
+        )
+        stream_url = (data.get("urls") or {}).get("stream")
+        if not stream_url:
+            raise RuntimeError("llm_error:stream_unavailable")
+        async with self.pool.stream("GET", stream_url, timeout_s=timeout_s) as resp:
+            async for event, payload in iter_sse(resp):
+                if event == "output":
+                    yield payload
+                elif event == "error":
+                    raise RuntimeError("llm_error:prediction_failed")
+                elif event == "done":
+                    return
 
 
 class FakeAdapter:
@@ -145,3 +553,281 @@ class FakeAdapter:
         split = max(1, len(text) // 2)
         yield text[:split]
         yield text[split:]
+
+    async def agenerate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        timeout_s: Optional[float] = None,
+    ) -> LLMResponse:
+        return self.generate(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop)
+
+    async def astream_generate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        timeout_s: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        for part in self.stream_generate(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop):
+            yield part
+
+
+class _LeaderGone(Exception):
+    """Set on a single-flight future whose leader was cancelled; followers retry instead of failing."""
+
+
+class CachedLLMAdapter:
+    """
+    Response cache in front of any LLMAdapter.
+    - Keyed by sha256 of (model, max_tokens, temperature, stop, prompt).
+    - In-memory LRU with per-entry TTL (`generate(..., ttl_s=...)` overrides the default);
+      with `spill_path`, entries are also written to SQLite and survive memory eviction/restarts.
+    - Single-flight: concurrent identical requests share one provider call.
+    - Streams are served whole from cache on a hit and cached only once fully consumed.
+    - The async paths do their SQLite reads and writes in a worker thread, never on the event loop.
+    """
+
+    def __init__(
+        self,
+        inner: LLMAdapter,
+        *,
+        max_entries: int = 1024,
+        ttl_s: float = 3600.0,
+        spill_path: Optional[str] = None,
+        spill_max_entries: int = 50_000,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.inner = inner
+        self.model = getattr(inner, "model", type(inner).__name__)
+        self.ttl_s = ttl_s
+        self._clock = clock
+        self._mem: LRUCache[LLMResponse] = LRUCache(max_entries, ttl_s=ttl_s, clock=clock)
+        self._inflight: Dict[str, "Future[LLMResponse]"] = {}
+        self._lock = threading.Lock()
+        self.spill_max_entries = max(1, spill_max_entries)
+        self._conn: Optional[sqlite3.Connection] = None
+        if spill_path:
+            self._conn = sqlite3.connect(spill_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_expires ON llm_cache (expires)")
+        self.provider_calls = 0
+        self.spill_hits = 0
+        self.coalesced = 0
+
+    def _key(self, prompt: str, max_tokens: int, temperature: float, stop: Optional[List[str]]) -> str:
+        head = json.dumps([self.model, max_tokens, round(temperature, 4), list(stop or [])], ensure_ascii=False)
+        return hashlib.sha256(f"{head}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[LLMResponse]:
+        hit = self._mem.get(key)
+        if hit is not None or self._conn is None:
+            return hit
+        return self._spill_lookup(key)
+
+    async def _alookup(self, key: str) -> Optional[LLMResponse]:
+        hit = self._mem.get(key)
+        if hit is not None or self._conn is None:
+            return hit
+        return await asyncio.to_thread(self._spill_lookup, key)
+
+    def _spill_lookup(self, key: str) -> Optional[LLMResponse]:
+        assert self._conn is not None
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute("SELECT payload, expires FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        resp = LLMResponse(**json.loads(row[0]))
+        self._mem.set(key, resp, ttl_s=row[1] - now)
+        self.spill_hits += 1
+        return resp
+
+    def _remember(self, key: str, resp: LLMResponse, ttl_s: Optional[float]) -> Optional[float]:
+        """Store in memory; returns the TTL to spill with, or None when nothing goes to disk."""
+        ttl = self.ttl_s if ttl_s is None else ttl_s
+        if ttl <= 0:
+            return None
+        self._mem.set(key, resp, ttl_s=ttl)
+        return ttl if self._conn is not None else None
+
+    def _store(self, key: str, resp: LLMResponse, ttl_s: Optional[float]) -> None:
+        ttl = self._remember(key, resp, ttl_s)
+        if ttl is not None:
+            self._spill(key, resp, ttl)
+
+    async def _astore(self, key: str, resp: LLMResponse, ttl_s: Optional[float]) -> None:
+        ttl = self._remember(key, resp, ttl_s)
+        if ttl is not None:
+            await asyncio.to_thread(self._spill, key, resp, ttl)
+
+    def _spill(self, key: str, resp: LLMResponse, ttl: float) -> None:
+        assert self._conn is not None
+        payload = json.dumps({"text": resp.text, "tokens_prompt": resp.tokens_prompt, "tokens_output": resp.tokens_output, "model": resp.model})
+        now = self._clock()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache (key, payload, expires) VALUES (?, ?, ?)", (key, payload, now + ttl))
+            self._conn.execute("DELETE FROM llm_cache WHERE expires <= ?", (now,))
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+            if count > self.spill_max_entries:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY expires LIMIT ?)",
+                    (count - self.spill_max_entries,),
+                )
+            self._conn.commit()
+
+    def generate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        ttl_s: Optional[float] = None,
+    ) -> LLMResponse:
+        key = self._key(prompt, max_tokens, temperature, stop)
+        while True:
+            hit, pending, leader = self._claim(key)
+            if hit is not None:
+                return hit
+            if leader:
+                return self._lead(key, pending, ttl_s, lambda: self.inner.generate(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop))
+            try:
+                return replace(pending.result(), cached=True)
+            except _LeaderGone:
+                continue  # claim again; this caller may become the leader
+
+    async def agenerate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        ttl_s: Optional[float] = None,
+        timeout_s: Optional[float] = None,
+    ) -> LLMResponse:
+        key = self._key(prompt, max_tokens, temperature, stop)
+        hit, pending, leader = self._join(key, await self._alookup(key))
+        while not leader:
+            if hit is not None:
+                return hit
+            try:
+                # Shielded: a cancelled follower must not cancel the future the leader and other followers share
+                return replace(await asyncio.shield(asyncio.wrap_future(pending)), cached=True)
+            except _LeaderGone:
+                hit, pending, leader = self._join(key, None)
+        try:
+            self.provider_calls += 1
+            resp = await agenerate(self.inner, prompt, max_tokens=max_tokens, temperature=temperature, stop=stop, timeout_s=timeout_s)
+        except BaseException as e:
+            self._settle(key, pending, error=e)
+            raise
+        # Followers are released from memory; the spill write does not hold them up
+        ttl = self._remember(key, resp, ttl_s)
+        self._settle(key, pending, result=resp)
+        if ttl is not None:
+            await asyncio.to_thread(self._spill, key, resp, ttl)
+        return resp
+
+    def _claim(self, key: str) -> "Tuple[Optional[LLMResponse], Optional[Future[LLMResponse]], bool]":
+        return self._join(key, self._lookup(key))
+
+    def _join(self, key: str, hit: Optional[LLMResponse]) -> "Tuple[Optional[LLMResponse], Optional[Future[LLMResponse]], bool]":
+        """Cached response, or the in-flight future for `key` and whether this caller must produce it."""
+        if hit is not None:
+            return replace(hit, cached=True), None, False
+        with self._lock:
+            pending = self._inflight.get(key)
+            if pending is not None:
+                self.coalesced += 1
+                return None, pending, False
+            # A concurrent leader may have stored the answer since the lookup above (already counted as a miss)
+            hit = self._mem.peek(key)
+            if hit is not None:
+                return replace(hit, cached=True), None, False
+            pending = self._inflight[key] = Future()
+            return None, pending, True
+
+    def _settle(self, key: str, pending: "Future[LLMResponse]", *, result: Optional[LLMResponse] = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        # Nobody is left waiting on a cancelled future; the leader's own result is unaffected
+        if not pending.set_running_or_notify_cancel():
+            return
+        if error is not None and not isinstance(error, Exception):
+            # The leader was cancelled or interrupted, not the call: followers claim the key again
+            pending.set_exception(_LeaderGone())
+        elif error is not None:
+            pending.set_exception(error)
+        else:
+            pending.set_result(result)
+
+    def _lead(self, key: str, pending: "Future[LLMResponse]", ttl_s: Optional[float], call: Callable[[], LLMResponse]) -> LLMResponse:
+        try:
+            self.provider_calls += 1
+            resp = call()
+        except BaseException as e:
+            self._settle(key, pending, error=e)
+            raise
+        self._store(key, resp, ttl_s)
+        self._settle(key, pending, result=resp)
+        return resp
+
+    def stream_generate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        ttl_s: Optional[float] = None,
+    ) -> Iterable[str]:
+        key = self._key(prompt, max_tokens, temperature, stop)
+        hit = self._lookup(key)
+        if hit is not None:
+            yield hit.text
+            return
+        self.provider_calls += 1
+        parts: List[str] = []
+        for part in self.inner.stream_generate(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop):
+            parts.append(part)
+            yield part
+        self._store(key, self._stream_response(prompt, "".join(parts)), ttl_s)
+
+    async def astream_generate(
+        self,
+        prompt: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.2,
+        stop: Optional[List[str]] = None,
+        ttl_s: Optional[float] = None,
+        timeout_s: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        key = self._key(prompt, max_tokens, temperature, stop)
+        hit = await self._alookup(key)
+        if hit is not None:
+            yield hit.text
+            return
+        self.provider_calls += 1
+        parts: List[str] = []
+        async for part in astream_generate(self.inner, prompt, max_tokens=max_tokens, temperature=temperature, stop=stop, timeout_s=timeout_s):
+            parts.append(part)
+            yield part
+        await self._astore(key, self._stream_response(prompt, "".join(parts)), ttl_s)
+
+    def _stream_response(self, prompt: str, text: str) -> LLMResponse:
+        return LLMResponse(text=text, tokens_prompt=max(1, len(prompt.split())), tokens_output=max(1, len(text.split())), model=self.model)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self._mem.stats())
+        out.update({"provider_calls": self.provider_calls, "spill_hits": self.spill_hits, "coalesced": self.coalesced})
+        return out
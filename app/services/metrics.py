@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Seconds; spans sub-10ms cache hits up to slow provider calls
+LATENCY_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS: Tuple[float, ...] = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames: Tuple[str, ...] = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        try:
+            return tuple(str(labels[n]) for n in self.labelnames)
+        except KeyError:
+            raise ValueError(f"{self.name} expects labels {self.labelnames}") from None
+
+    def samples(self) -> List[Tuple[LabelValues, Any]]:
+        with self._lock:
+            return [(k, list(v) if isinstance(v, list) else v) for k, v in self._values.items()]
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.type, "help": self.help, "labels": list(self.labelnames)}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if amount < 0:
+            raise ValueError("counters only go up")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; each series is [per-bucket counts..., +Inf count, sum, count]."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), *, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        if not buckets or list(buckets) != sorted(buckets):
+            raise ValueError("buckets must be a non-empty increasing sequence")
+        self.buckets: Tuple[float, ...] = tuple(float(b) for b in buckets)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        # Bucket index is found outside the lock; the critical section is three additions
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def describe(self) -> Dict[str, Any]:
+        return super().describe() | {"buckets": list(self.buckets)}
+
+
+class CallbackMetric(_Metric):
+    """Values read from `fn()` at collection time, e.g. hit/miss counters kept by a cache."""
+
+    def __init__(self, name: str, help: str, type: str, fn: Callable[[], Iterable[Tuple[LabelValues, float]]], labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self.type = type
+        self.fn = fn
+
+    def samples(self) -> List[Tuple[LabelValues, Any]]:
+        try:
+            return [(tuple(str(v) for v in k), float(v)) for k, v in self.fn()]
+        except Exception:
+            return []
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """
+    In-process metrics with Prometheus text exposition.
+    - Updates take a short per-metric lock; rendering copies values under the same lock.
+    - With `multiproc_dir` set (one directory shared by all uvicorn workers), each process writes its
+      snapshot to `metrics_<pid>.json` at most every `flush_interval_s` (see `maybe_flush`), and `render`
+      merges every file: counters and histograms are summed across all processes that ever wrote
+      (so totals never go backwards), gauges only across processes still alive.
+    """
+
+    def __init__(self, *, multiproc_dir: Optional[str] = None, flush_interval_s: float = 1.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval_s = flush_interval_s
+        self._clock = clock
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._last_flush = float("-inf")
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, CallbackMetric):
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"metric {metric.name} already registered with a different type or labels")
+                return existing
+            # Callbacks are rebound, so re-created singletons replace stale ones
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), *, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets=buckets))  # type: ignore[return-value]
+
+    def callback(self, name: str, help: str, type: str, fn: Callable[[], Iterable[Tuple[LabelValues, float]]], labels: Sequence[str] = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, type, fn, labels))  # type: ignore[return-value]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.describe() | {"samples": [[list(k), v] for k, v in m.samples()]} for m in metrics}
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.multiproc_dir or "", f"metrics_{pid}.json")
+
+    def flush(self) -> None:
+        if not self.multiproc_dir:
+            return
+        self._last_flush = self._clock()
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        path = self._path(os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def maybe_flush(self) -> None:
+        if self.multiproc_dir and self._clock() - self._last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def collect(self) -> Dict[str, Dict[str, Any]]:
+        """This process's metrics, merged with the other workers' snapshots in multi-process mode."""
+        merged = self.snapshot()
+        if not self.multiproc_dir:
+            return merged
+        self.flush()
+        own = os.path.basename(self._path(os.getpid()))
+        try:
+            names = sorted(os.listdir(self.multiproc_dir))
+        except FileNotFoundError:
+            return merged
+        for fname in names:
+            if not (fname.startswith("metrics_") and fname.endswith(".json")) or fname == own:
+                continue
+            try:
+                pid = int(fname[len("metrics_"):-len(".json")])
+                with open(os.path.join(self.multiproc_dir, fname), encoding="utf-8") as f:
+                    other = json.load(f)
+            except (ValueError, OSError):
+                continue
+            alive = _pid_alive(pid)
+            for name, desc in other.items():
+                if desc["type"] == "gauge" and not alive:
+                    continue
+                _merge_into(merged.setdefault(name, desc | {"samples": []}), desc)
+        return merged
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name, desc in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {_escape_help(desc['help'])}")
+            lines.append(f"# TYPE {name} {desc['type']}")
+            labelnames = desc["labels"]
+            for labels, value in desc["samples"]:
+                pairs = list(zip(labelnames, labels))
+                if desc["type"] != "histogram":
+                    lines.append(f"{name}{_labels(pairs)} {_num(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(desc["buckets"]) + [math.inf], value[:-2]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', _num(bound))])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_num(value[-2])}")
+                lines.append(f"{name}_count{_labels(pairs)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge_into(target: Dict[str, Any], other: Dict[str, Any]) -> None:
+    index = {tuple(labels): i for i, (labels, _) in enumerate(target["samples"])}
+    for labels, value in other["samples"]:
+        i = index.get(tuple(labels))
+        if i is None:
+            index[tuple(labels)] = len(target["samples"])
+            target["samples"].append([labels, list(value) if isinstance(value, list) else value])
+        elif isinstance(value, list):
+            current = target["samples"][i][1]
+            target["samples"][i][1] = [a + b for a, b in zip(current, value)]
+        else:
+            target["samples"][i][1] += value
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(str(v))}"' for k, v in pairs) + "}"
+
+
+def _num(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# Process-wide registry; METRICS_MULTIPROC_DIR enables cross-worker aggregation
+REGISTRY = MetricsRegistry(
+    multiproc_dir=os.getenv("METRICS_MULTIPROC_DIR") or None,
+    flush_interval_s=float(os.getenv("METRICS_FLUSH_SEC", "1")),
+)
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ["method", "route", "status"]
+)
+STAGE_SECONDS = REGISTRY.histogram("orchestrator_stage_duration_seconds", "Query pipeline stage latency", ["stage"])
+RETRIEVAL_CANDIDATES = REGISTRY.histogram(
+    "retrieval_candidates", "Chunks per retrieval: scoring candidate pool or results reaching the prompt", ["pool"], buckets=COUNT_BUCKETS
+)
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "LLM tokens by direction (prompt|output), excluding cached responses", ["direction"])
+RATE_LIMIT_REJECTIONS = REGISTRY.counter("rate_limit_rejections_total", "Requests rejected with 429 by the rate limiter")
+LOG_RECORDS_DROPPED = REGISTRY.counter("log_records_dropped_total", "Log records dropped because the async log queue was full")
+LOG_RECORDS_SAMPLED_OUT = REGISTRY.counter("log_records_sampled_out_total", "Log records skipped by per-logger sampling", ["logger"])
+
+
+def observe_stages(stages: Dict[str, float]) -> None:
+    """Record a request's StageTimings (ms) into STAGE_SECONDS."""
+    for stage, ms in stages.items():
+        STAGE_SECONDS.observe(ms / 1000.0, stage=stage)
+
+
+def cache_stats_callback(caches: Callable[[], Dict[str, Any]], field: str) -> Callable[[], List[Tuple[LabelValues, float]]]:
+    """Callback reading `stats()[field]` from each named cache returned by `caches()` (None entries skipped)."""
+
+    def read() -> List[Tuple[LabelValues, float]]:
+        return [((name,), float(cache.stats().get(field, 0))) for name, cache in caches().items() if cache is not None]
+
+    return read
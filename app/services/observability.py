@@ -1,12 +1,22 @@
 from __future__ import annotations
 
+import atexit
 import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import zlib
+from contextlib import contextmanager
 from logging import Logger
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, Optional
 import time
 from contextvars import ContextVar
 
+from app.services.metrics import LOG_RECORDS_DROPPED, LOG_RECORDS_SAMPLED_OUT
+
 # Context variable for per-request trace id
 trace_id_var: ContextVar[str | None] = ContextVar("trace_id", default=None)
 
@@ -17,10 +27,10 @@ class JsonFormatter(logging.Formatter):
             "level": record.levelname,
             "message": record.getMessage(),
             "logger": record.name,
-            "time": int(time.time() * 1000),
+            "time": int(record.created * 1000),
         }
-        # Attach trace id from context if present
-        tid = trace_id_var.get()
+        # Attach trace id: stamped on the record when it was queued, else from context
+        tid = getattr(record, "trace_id", None) or trace_id_var.get()
         if tid:
             payload["trace_id"] = tid
         # Include extra dict if provided
@@ -29,14 +39,115 @@ class JsonFormatter(logging.Formatter):
         return json.dumps(payload, ensure_ascii=False)
 
 
+def _parse_sample_rates(spec: str) -> Dict[str, float]:
+    """"api.query=0.01,retrieval.hybrid=0.5" -> {"api.query": 0.01, ...}; rates are clamped to [0, 1]."""
+    rates: Dict[str, float] = {}
+    for item in spec.split(","):
+        name, sep, rate = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            raise ValueError(f"invalid LOG_SAMPLE_RATES entry: {item!r}") from None
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction `rate` of records below WARNING; warnings and errors always pass.
+    The draw is a hash of the trace id when there is one, so all lines of a request are kept or dropped together.
+    """
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:  # type: ignore[override]
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        tid = trace_id_var.get()
+        draw = zlib.crc32(tid.encode("utf-8")) / 2**32 if tid else random.random()
+        if draw < self.rate:
+            return True
+        LOG_RECORDS_SAMPLED_OUT.inc(logger=record.name)
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a bounded queue without formatting them; a full queue drops the record
+    (counted in `dropped` and `log_records_dropped_total`) instead of blocking the request.
+    """
+
+    def __init__(self, q: "queue.Queue[Any]") -> None:
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only what depends on the calling context is captured here; JSON formatting runs on the listener thread
+        record.trace_id = trace_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+class _BlockingSentinelListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # The queue may be full at shutdown; wait for room rather than lose the stop signal
+        self.queue.put(self._sentinel)
+
+
+_ASYNC_HANDLER: Optional[DroppingQueueHandler] = None
+_ASYNC_LISTENER: Optional[logging.handlers.QueueListener] = None
+_ASYNC_LOCK = threading.Lock()
+
+
+def _async_handler() -> DroppingQueueHandler:
+    """Process-wide queue handler; one background thread formats and writes for every logger."""
+    global _ASYNC_HANDLER, _ASYNC_LISTENER
+    with _ASYNC_LOCK:
+        if _ASYNC_HANDLER is None:
+            q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+            stream = logging.StreamHandler()
+            stream.setFormatter(JsonFormatter())
+            _ASYNC_HANDLER = DroppingQueueHandler(q)
+            _ASYNC_LISTENER = _BlockingSentinelListener(q, stream)
+            _ASYNC_LISTENER.start()
+            atexit.register(_ASYNC_LISTENER.stop)
+        return _ASYNC_HANDLER
+
+
+def flush_logs() -> None:
+    """Block until every queued record has been written (no-op in synchronous mode)."""
+    if _ASYNC_HANDLER is not None:
+        _ASYNC_HANDLER.queue.join()  # type: ignore[attr-defined]
+
+
 def get_logger(name: str = "app") -> Logger:
+    """
+    JSON logger, configured on first use from the environment:
+    - LOG_ASYNC=1: records go through a bounded queue to a background writer thread.
+    - LOG_SAMPLE_RATES="api.query=0.01,...": per-logger sampling of records below WARNING.
+    """
     logger = logging.getLogger(name)
     if not logger.handlers:
-        handler = logging.StreamHandler()
-        handler.setFormatter(JsonFormatter())
+        if os.getenv("LOG_ASYNC", "0").lower() in {"1", "true", "yes"}:
+            handler: logging.Handler = _async_handler()
+        else:
+            handler = logging.StreamHandler()
+            handler.setFormatter(JsonFormatter())
         logger.addHandler(handler)
         logger.setLevel(logging.INFO)
         logger.propagate = False
+        rate = _parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "")).get(name)
+        if rate is not None and rate < 1.0:
+            logger.addFilter(SamplingFilter(rate))
     return logger
 
 
@@ -48,9 +159,67 @@ def get_trace_id() -> str | None:
     return trace_id_var.get()
 
 
+class StageTimings:
+    """
+    Per-request wall time by stage (ms). Spans of the same name accumulate; nested spans are inclusive.
+    `notes` holds pipeline facts recorded alongside (retriever, k, candidate counts, cache outcomes).
+    """
+
+    def __init__(self) -> None:
+        self._ms: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.notes: Dict[str, Any] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._ms[stage] = self._ms.get(stage, 0.0) + seconds * 1000.0
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {stage: round(ms, 3) for stage, ms in self._ms.items()}
+
+
+# Timings collector for the current request; None outside instrumented requests (spans are no-ops)
+stage_timings_var: ContextVar[Optional[StageTimings]] = ContextVar("stage_timings", default=None)
+
+
+def start_stage_timings() -> StageTimings:
+    timings = StageTimings()
+    stage_timings_var.set(timings)
+    return timings
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a block into the current request's StageTimings (two perf_counter calls when active)."""
+    timings = stage_timings_var.get()
+    if timings is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(stage, time.perf_counter() - t0)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Add an externally measured duration (e.g. time to first token) to the current request's timings."""
+    timings = stage_timings_var.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+def annotate(**notes: Any) -> None:
+    """Attach pipeline facts to the current request's StageTimings (no-op outside instrumented requests)."""
+    timings = stage_timings_var.get()
+    if timings is not None:
+        timings.notes.update(notes)
+
+
 def redact_payload(data: Dict[str, Any]) -> Dict[str, Any]:
-    # Best-effort redaction for potentially sensitive fields
-    redacted = dict(data)
+    # Best-effort redaction for potentially sensitive fields, including nested ones (e.g. location.gps)
+    redacted = {k: redact_payload(v) if isinstance(v, dict) else v for k, v in data.items()}
     if "gps" in redacted and redacted["gps"]:
         redacted["gps"] = "[REDACTED]"
     if "pincode" in redacted and redacted["pincode"]:
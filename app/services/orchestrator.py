@@ -1,13 +1,21 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars
 import os
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Any, Iterable
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, List, Optional, Any, AsyncIterator, Iterable, Tuple
 
-from app.services.prompting import PromptBuilder
-from app.services.retrieval import Retriever
-from app.services.llm import LLMAdapter
+from app.services.budget import Deadline
+from app.services.caching import SemanticCache
+from app.services.prompting import PromptBuilder, estimate_tokens
+from app.services.retrieval import Retriever, retrieve_within, retriever_chain
+from app.services.llm import AsyncTokenStream, CachedLLMAdapter, LLMAdapter, agenerate, astream_generate
 from app.services.connectors import WeatherClient, MandiClient
+from app.services.metrics import LLM_TOKENS, RETRIEVAL_CANDIDATES
+from app.services.observability import annotate, record_stage, span
 
 
 @dataclass
@@ -18,6 +26,73 @@ class OrchestratorResult:
     language: str
     tokens_prompt: Optional[int] = None
     tokens_output: Optional[int] = None
+    cache: Optional[str] = None  # which cache served the answer, if any
+    warnings: List[str] = field(default_factory=list)  # e.g. "stage_timeout:weather" / "stage_saturated:weather" when a stage was dropped
+    degradations: List[str] = field(default_factory=list)  # budget-driven cut-backs, e.g. "reduced_k"
+
+
+@dataclass
+class StreamEvent:
+    """Typed streaming event: `citations` first, then `token`s, then a final `done` with diagnostics."""
+
+    type: str
+    data: Dict[str, Any]
+
+
+# Answer-cache lifetime by the external signal an answer depended on (seconds).
+# Prices move within the day; weather within hours; plain agronomy advice is stable.
+ANSWER_TTL_BY_SIGNAL: Dict[str, float] = {"mandi_prices": 900.0, "weather": 3600.0}
+ANSWER_TTL_DEFAULT = 86400.0
+
+# Context budget used when a hurried request had no explicit max_context_tokens
+REDUCED_CONTEXT_TOKENS = 512
+MIN_LLM_TIMEOUT_S = 0.5
+
+
+def _count_tokens(prompt: Optional[int], output: Optional[int]) -> None:
+    if prompt:
+        LLM_TOKENS.inc(prompt, direction="prompt")
+    if output:
+        LLM_TOKENS.inc(output, direction="output")
+
+
+_CONNECTOR_WORKERS = 8
+_CONNECTOR_POOL: Optional[ThreadPoolExecutor] = None
+# One slot per pool worker, held until the connector call returns (even after its stage timed out)
+_CONNECTOR_SLOTS = threading.BoundedSemaphore(_CONNECTOR_WORKERS)
+
+
+def _connector_pool() -> ThreadPoolExecutor:
+    global _CONNECTOR_POOL
+    if _CONNECTOR_POOL is None:
+        _CONNECTOR_POOL = ThreadPoolExecutor(max_workers=_CONNECTOR_WORKERS, thread_name_prefix="signal-stage")
+    return _CONNECTOR_POOL
+
+
+def _submit_connector(fn: Callable[[], Any]) -> Optional["asyncio.Future[Any]"]:
+    """
+    Run a signal fetch on the connector pool, kept apart from the default executor that retrieval
+    and cache I/O use, so hung connectors cannot starve them. None when every worker is taken.
+    """
+    if not _CONNECTOR_SLOTS.acquire(blocking=False):
+        return None
+    try:
+        fut = _connector_pool().submit(contextvars.copy_context().run, fn)
+    except BaseException:
+        _CONNECTOR_SLOTS.release()
+        raise
+    fut.add_done_callback(lambda _: _CONNECTOR_SLOTS.release())
+    return asyncio.wrap_future(fut)
+
+
+def _timed(stage: str, fn: Callable[[], Any]) -> Callable[[], Any]:
+    """Wrap a stage callable in a span; the span is recorded in whichever thread runs it."""
+
+    def run() -> Any:
+        with span(stage):
+            return fn()
+
+    return run
 
 
 class QueryOrchestrator:
@@ -26,14 +101,63 @@ class QueryOrchestrator:
     - Uses provided Retriever to fetch chunks
     - Builds a prompt via PromptBuilder
     - Calls LLMAdapter to generate an answer
+    - Optionally serves near-duplicate questions from a SemanticCache scoped by
+      language/region/crop, with TTLs following the signals the answer used
+    - The async paths fetch signals and retrieve concurrently; a stage that exceeds its
+      `stage_timeouts` entry (seconds, keyed by "retrieval" or signal name) is dropped with a warning
+      (signal fetches use their own bounded pool, so hung connectors never starve retrieval)
+    - An optional request Deadline caps stage/LLM timeouts and, as it runs down, reduces k, skips
+      reranking, shortens the context and lowers the generation cap (see budget.DEGRADE_BELOW)
+    - Stages are timed with observability.span ("semantic_cache", "signals.<name>", "retrieval",
+      "prompt", "llm", "llm_ttft") into the request's StageTimings, when one is active
     """
 
-    def __init__(self, retriever: Retriever, llm: LLMAdapter):
+    def __init__(
+        self,
+        retriever: Retriever,
+        llm: LLMAdapter,
+        *,
+        answer_cache: Optional[SemanticCache] = None,
+        stage_timeouts: Optional[Dict[str, float]] = None,
+    ):
         self.retriever = retriever
         self.llm = llm
+        self.answer_cache = answer_cache
+        self.stage_timeouts = dict(stage_timeouts or {})
         self._weather = WeatherClient()
         self._mandi = MandiClient()
 
+    @staticmethod
+    def _cache_scope(language: str, filters: Dict[str, str]) -> Tuple[str, str, str]:
+        return (language, (filters.get("region") or "").lower(), (filters.get("crop") or "").lower())
+
+    @staticmethod
+    def _answer_ttl(signals: Dict[str, Any]) -> float:
+        ttls = [ANSWER_TTL_BY_SIGNAL[name] for name in signals if name in ANSWER_TTL_BY_SIGNAL]
+        return min(ttls, default=ANSWER_TTL_DEFAULT)
+
+    def _cached_answer(self, question: str, language: str, filters: Dict[str, str]) -> Optional[OrchestratorResult]:
+        if self.answer_cache is None:
+            return None
+        with span("semantic_cache"):
+            hit = self.answer_cache.get(question, self._cache_scope(language, filters))
+        annotate(answer_cache="miss" if hit is None else "hit")
+        if hit is None:
+            return None
+        # Cached answers hold the raw LLM text; safety checks apply to the incoming question
+        answer = self._safety_intercept(question, hit.answer) or hit.answer
+        return replace(hit, answer=answer, cache="semantic")
+
+    def _generate_opts(self, signals: Dict[str, Any]) -> Dict[str, Any]:
+        # Response-cache entries expire with the freshest signal baked into the prompt
+        return {"ttl_s": self._answer_ttl(signals)} if isinstance(self.llm, CachedLLMAdapter) else {}
+
+    def _store_answer(self, question: str, language: str, filters: Dict[str, str], result: OrchestratorResult, signals: Dict[str, Any]) -> None:
+        # Degraded answers (a stage was dropped or cut back) are not reused
+        if self.answer_cache is not None and not result.warnings and not result.degradations:
+            scope = self._cache_scope(language, filters)
+            self.answer_cache.set(question, scope, result, ttl_s=self._answer_ttl(signals))
+
     def _classify_intent(self, question: str) -> str:
         q = question.lower()
         if any(k in q for k in ["price", "rate", "mandi", "market"]):
@@ -42,13 +166,16 @@ class QueryOrchestrator:
             return "weather_advice"
         return "general_agri"
 
-    def _fetch_signals(self, intent: str, *, crop: Optional[str], region: Optional[str]) -> Dict[str, Any]:
-        signals: Dict[str, Any] = {}
+    def _signal_sources(self, intent: str, *, crop: Optional[str], region: Optional[str]) -> Dict[str, Callable[[], Any]]:
+        sources: Dict[str, Callable[[], Any]] = {}
         if intent == "mandi_prices" and crop and region:
-            signals["mandi_prices"] = self._mandi.latest_prices(crop, region)
+            sources["mandi_prices"] = _timed("signals.mandi_prices", lambda: self._mandi.latest_prices(crop, region))
         if intent in {"weather_advice", "general_agri"} and region:
-            signals["weather"] = self._weather.current_and_forecast({"region": region})
-        return signals
+            sources["weather"] = _timed("signals.weather", lambda: self._weather.current_and_forecast({"region": region}))
+        return sources
+
+    def _fetch_signals(self, intent: str, *, crop: Optional[str], region: Optional[str]) -> Dict[str, Any]:
+        return {name: fetch() for name, fetch in self._signal_sources(intent, crop=crop, region=region).items()}
 
     def _safety_intercept(self, question: str, draft_answer: str) -> Optional[str]:
         q = question.lower()
@@ -60,18 +187,17 @@ class QueryOrchestrator:
             )
         return None
 
-    def run(
+    def _prepare(
         self,
         question: str,
-        *,
-        language: str = "auto",
-        filters: Optional[Dict[str, str]] = None,
-        k: int = 4,
-        max_context_tokens: Optional[int] = None,
-        max_generate_tokens: Optional[int] = None,
-        external_signals: Optional[Dict[str, Any]] = None,
-    ) -> OrchestratorResult:
-        filters = filters or {}
+        language: str,
+        filters: Dict[str, str],
+        k: int,
+        max_context_tokens: Optional[int],
+        external_signals: Optional[Dict[str, Any]],
+        deadline: Optional[Deadline] = None,
+    ) -> Tuple[Any, Dict[str, Any]]:
+        """Intent, signals, retrieval and prompt assembly for the sync paths (stages run in sequence)."""
         intent = self._classify_intent(question)
         # derive region/crop from filters if available
         region = filters.get("region")
@@ -79,23 +205,196 @@ class QueryOrchestrator:
         signals = dict(external_signals or {})
         signals.update(self._fetch_signals(intent, crop=crop, region=region))
 
-        results = self.retriever.retrieve(question, filters=filters, k=k)
+        k = self._budgeted_k(k, deadline)
+        with span("retrieval"):
+            results = retrieve_within(self.retriever, question, filters=filters, k=k, deadline=deadline)
         chunks = [r.chunk for r in results]
+        RETRIEVAL_CANDIDATES.observe(len(chunks), pool="retrieved")
+        pb = PromptBuilder(language=language)
+        max_context_tokens = self._budgeted_context(max_context_tokens, deadline)
+        with span("prompt"):
+            built = pb.build(question, chunks, max_context_tokens=max_context_tokens, external_signals=signals)
+        self._annotate_pipeline(k, chunks, built)
+        return built, signals
+
+    def _annotate_pipeline(self, k: int, chunks: List[Any], built: Any) -> None:
+        annotate(
+            retriever=retriever_chain(self.retriever),
+            k=k,
+            retrieved=len(chunks),
+            prompt_tokens_est=estimate_tokens(built.prompt),
+        )
+
+    @staticmethod
+    def _budgeted_k(k: int, deadline: Optional[Deadline]) -> int:
+        return max(1, k // 2) if deadline is not None and k > 1 and deadline.degrade("reduced_k") else k
+
+    @staticmethod
+    def _budgeted_context(max_context_tokens: Optional[int], deadline: Optional[Deadline]) -> Optional[int]:
+        if deadline is None or not deadline.degrade("reduced_context"):
+            return max_context_tokens
+        return REDUCED_CONTEXT_TOKENS if max_context_tokens is None else max(1, max_context_tokens // 2)
+
+    async def _stage(
+        self, name: str, fn: Callable[[], Any], deadline: Optional[Deadline] = None, *, connector: bool = False
+    ) -> Tuple[Any, Optional[str]]:
+        """
+        Run a blocking stage in a worker thread under its timeout; returns (value, warning).
+        Connector stages run on their own bounded pool and are dropped when it is saturated.
+        """
+        timeout = self.stage_timeouts.get(name)
+        if deadline is not None:
+            timeout = deadline.timeout(timeout)
+        work = _submit_connector(fn) if connector else asyncio.to_thread(fn)
+        if work is None:
+            return None, f"stage_saturated:{name}"
+        try:
+            return await asyncio.wait_for(work, timeout), None
+        except asyncio.TimeoutError:
+            # The worker thread cannot be interrupted; its late result is discarded
+            return None, f"stage_timeout:{name}"
+
+    async def _aprepare(
+        self,
+        question: str,
+        language: str,
+        filters: Dict[str, str],
+        k: int,
+        max_context_tokens: Optional[int],
+        external_signals: Optional[Dict[str, Any]],
+        deadline: Optional[Deadline] = None,
+    ) -> Tuple[Any, Dict[str, Any], List[str]]:
+        """Async `_prepare`: signal fetches and retrieval fan out concurrently; timed-out stages are dropped."""
+        intent = self._classify_intent(question)
+        sources = self._signal_sources(intent, crop=filters.get("crop"), region=filters.get("region"))
+        stages = {name: self._stage(name, fetch, deadline, connector=True) for name, fetch in sources.items()}
+        k = self._budgeted_k(k, deadline)
+        stages["retrieval"] = self._stage(
+            "retrieval",
+            _timed("retrieval", lambda: retrieve_within(self.retriever, question, filters=filters, k=k, deadline=deadline)),
+            deadline,
+        )
+        outcomes = dict(zip(stages, await asyncio.gather(*stages.values())))
+
+        warnings = [warning for _, warning in outcomes.values() if warning]
+        results, _ = outcomes.pop("retrieval")
+        signals = dict(external_signals or {})
+        signals.update({name: value for name, (value, warning) in outcomes.items() if not warning})
+        chunks = [r.chunk for r in results or []]
+        RETRIEVAL_CANDIDATES.observe(len(chunks), pool="retrieved")
         pb = PromptBuilder(language=language)
-        built = pb.build(question, chunks, max_context_tokens=max_context_tokens, external_signals=signals)
+        max_context_tokens = self._budgeted_context(max_context_tokens, deadline)
+        with span("prompt"):
+            built = pb.build(question, chunks, max_context_tokens=max_context_tokens, external_signals=signals)
+        self._annotate_pipeline(k, chunks, built)
+        return built, signals, warnings
+
+    @staticmethod
+    def _generate_cap(max_generate_tokens: Optional[int], deadline: Optional[Deadline] = None) -> int:
         # Enforce generation token cap
-        gen_cap = max_generate_tokens if max_generate_tokens is not None else int(os.getenv("MAX_GENERATE_TOKENS", "256"))
-        llm_out = self.llm.generate(built.prompt, max_tokens=gen_cap)
-        intercepted = self._safety_intercept(question, llm_out.text)
+        cap = max_generate_tokens if max_generate_tokens is not None else int(os.getenv("MAX_GENERATE_TOKENS", "256"))
+        if deadline is not None and cap > 1 and deadline.degrade("reduced_generate_tokens"):
+            cap = max(1, cap // 2)
+        return cap
+
+    @staticmethod
+    def _llm_timeout(llm_timeout_s: Optional[float], deadline: Optional[Deadline]) -> Optional[float]:
+        # A late request still gets a short generation window: it degrades rather than fails
+        return llm_timeout_s if deadline is None else deadline.timeout(llm_timeout_s, floor=MIN_LLM_TIMEOUT_S)
+
+    def _finish(
+        self,
+        question: str,
+        language: str,
+        filters: Dict[str, str],
+        built: Any,
+        signals: Dict[str, Any],
+        llm_out: Any,
+        warnings: Optional[List[str]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> OrchestratorResult:
+        result = self._result(language, built, llm_out, warnings, deadline)
+        self._store_answer(question, language, filters, result, signals)
+        return self._deliver(question, result, llm_out)
+
+    @staticmethod
+    def _result(language: str, built: Any, llm_out: Any, warnings: Optional[List[str]], deadline: Optional[Deadline]) -> OrchestratorResult:
         return OrchestratorResult(
-            answer=intercepted or llm_out.text,
+            answer=llm_out.text,
             citations=built.citations,
             prompt=built.prompt,
             language=language,
             tokens_prompt=getattr(llm_out, "tokens_prompt", None),
             tokens_output=getattr(llm_out, "tokens_output", None),
+            warnings=list(warnings or []),
+            degradations=list(deadline.degradations) if deadline is not None else [],
         )
 
+    def _deliver(self, question: str, result: OrchestratorResult, llm_out: Any) -> OrchestratorResult:
+        if getattr(llm_out, "cached", False):
+            result = replace(result, cache="response")
+        else:
+            _count_tokens(result.tokens_prompt, result.tokens_output)
+        intercepted = self._safety_intercept(question, llm_out.text)
+        return replace(result, answer=intercepted) if intercepted else result
+
+    def run(
+        self,
+        question: str,
+        *,
+        language: str = "auto",
+        filters: Optional[Dict[str, str]] = None,
+        k: int = 4,
+        max_context_tokens: Optional[int] = None,
+        max_generate_tokens: Optional[int] = None,
+        external_signals: Optional[Dict[str, Any]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> OrchestratorResult:
+        filters = filters or {}
+        cached = self._cached_answer(question, language, filters)
+        if cached is not None:
+            return cached
+        built, signals = self._prepare(question, language, filters, k, max_context_tokens, external_signals, deadline)
+        gen_cap = self._generate_cap(max_generate_tokens, deadline)
+        with span("llm"):
+            llm_out = self.llm.generate(built.prompt, max_tokens=gen_cap, **self._generate_opts(signals))
+        return self._finish(question, language, filters, built, signals, llm_out, deadline=deadline)
+
+    async def arun(
+        self,
+        question: str,
+        *,
+        language: str = "auto",
+        filters: Optional[Dict[str, str]] = None,
+        k: int = 4,
+        max_context_tokens: Optional[int] = None,
+        max_generate_tokens: Optional[int] = None,
+        external_signals: Optional[Dict[str, Any]] = None,
+        llm_timeout_s: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> OrchestratorResult:
+        """
+        Async `run`: the LLM call is awaited (natively for async adapters) so the event loop stays free.
+        Semantic-cache lookups and stores embed the question, so they run in a worker thread too.
+        """
+        filters = filters or {}
+        cached = await asyncio.to_thread(self._cached_answer, question, language, filters)
+        if cached is not None:
+            return cached
+        built, signals, warnings = await self._aprepare(question, language, filters, k, max_context_tokens, external_signals, deadline)
+        gen_cap = self._generate_cap(max_generate_tokens, deadline)
+        with span("llm"):
+            llm_out = await agenerate(
+                self.llm,
+                built.prompt,
+                max_tokens=gen_cap,
+                timeout_s=self._llm_timeout(llm_timeout_s, deadline),
+                **self._generate_opts(signals),
+            )
+        result = self._result(language, built, llm_out, warnings, deadline)
+        await asyncio.to_thread(self._store_answer, question, language, filters, result, signals)
+        return self._deliver(question, result, llm_out)
+
     def run_stream(
         self,
         question: str,
@@ -106,23 +405,95 @@ class QueryOrchestrator:
         max_context_tokens: Optional[int] = None,
         max_generate_tokens: Optional[int] = None,
         external_signals: Optional[Dict[str, Any]] = None,
+        deadline: Optional[Deadline] = None,
     ) -> Iterable[str]:
         """Yield answer tokens in a streaming fashion from the LLM."""
         filters = filters or {}
-        intent = self._classify_intent(question)
-        region = filters.get("region")
-        crop = filters.get("crop")
-        signals = dict(external_signals or {})
-        signals.update(self._fetch_signals(intent, crop=crop, region=region))
-
-        results = self.retriever.retrieve(question, filters=filters, k=k)
-        chunks = [r.chunk for r in results]
-        pb = PromptBuilder(language=language)
-        built = pb.build(question, chunks, max_context_tokens=max_context_tokens, external_signals=signals)
+        cached = self._cached_answer(question, language, filters)
+        if cached is not None:
+            yield cached.answer
+            return
+        built, signals = self._prepare(question, language, filters, k, max_context_tokens, external_signals, deadline)
         # Safety intercept preface if needed
         preface = self._safety_intercept(question, "")
         if preface:
             yield preface
-        gen_cap = max_generate_tokens if max_generate_tokens is not None else int(os.getenv("MAX_GENERATE_TOKENS", "256"))
-        for part in self.llm.stream_generate(built.prompt, max_tokens=gen_cap):
-            yield part
+        gen_cap = self._generate_cap(max_generate_tokens, deadline)
+        parts: List[str] = []
+        # Stream spans are wall time to the last token, so they include time the consumer held each token
+        with span("llm"):
+            for part in self.llm.stream_generate(built.prompt, max_tokens=gen_cap, **self._generate_opts(signals)):
+                parts.append(part)
+                yield part
+        # Only complete streams are cached
+        degradations = list(deadline.degradations) if deadline is not None else []
+        result = OrchestratorResult(answer="".join(parts), citations=built.citations, prompt=built.prompt, language=language, degradations=degradations)
+        self._store_answer(question, language, filters, result, signals)
+
+    async def astream(
+        self,
+        question: str,
+        *,
+        language: str = "auto",
+        filters: Optional[Dict[str, str]] = None,
+        k: int = 4,
+        max_context_tokens: Optional[int] = None,
+        max_generate_tokens: Optional[int] = None,
+        external_signals: Optional[Dict[str, Any]] = None,
+        llm_timeout_s: Optional[float] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> AsyncIterator[StreamEvent]:
+        """
+        Async streaming with typed events. Tokens are forwarded as the adapter yields them;
+        closing this generator (e.g. on client disconnect) closes the upstream LLM stream.
+        """
+        filters = filters or {}
+        cached = await asyncio.to_thread(self._cached_answer, question, language, filters)
+        if cached is not None:
+            yield StreamEvent("citations", {"citations": cached.citations})
+            yield StreamEvent("token", {"text": cached.answer})
+            yield StreamEvent("done", {"cache": cached.cache, "tokens_output": cached.tokens_output, "warnings": [], "degradations": []})
+            return
+        built, signals, warnings = await self._aprepare(question, language, filters, k, max_context_tokens, external_signals, deadline)
+        yield StreamEvent("citations", {"citations": built.citations})
+        preface = self._safety_intercept(question, "")
+        if preface:
+            yield StreamEvent("token", {"text": preface})
+        gen_cap = self._generate_cap(max_generate_tokens, deadline)
+        stream = AsyncTokenStream(
+            astream_generate(
+                self.llm,
+                built.prompt,
+                max_tokens=gen_cap,
+                timeout_s=self._llm_timeout(llm_timeout_s, deadline),
+                **self._generate_opts(signals),
+            )
+        )
+        with span("llm"):
+            async for part in stream:
+                yield StreamEvent("token", {"text": part})
+        degradations = list(deadline.degradations) if deadline is not None else []
+        result = OrchestratorResult(
+            answer=stream.text,
+            citations=built.citations,
+            prompt=built.prompt,
+            language=language,
+            warnings=warnings,
+            degradations=degradations,
+        )
+        await asyncio.to_thread(self._store_answer, question, language, filters, result, signals)
+        stats = stream.stats()
+        _count_tokens(None, stats["tokens"])
+        if stats["ttft_ms"] is not None:
+            record_stage("llm_ttft", stats["ttft_ms"] / 1000.0)
+        yield StreamEvent(
+            "done",
+            {
+                "cache": None,
+                "tokens_output": stats["tokens"],
+                "ttft_ms": stats["ttft_ms"],
+                "tokens_per_s": stats["tokens_per_s"],
+                "warnings": warnings,
+                "degradations": degradations,
+            },
+        )
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def profile_call(fn: Callable[..., T], *args: Any, **kwargs: Any) -> Tuple[T, cProfile.Profile]:
+    """Run `fn` under cProfile in the calling thread; returns (result, profile)."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+    return result, profiler
+
+
+def summarize(profiler: cProfile.Profile, *, limit: int = 25, sort: str = "cumulative") -> str:
+    """pstats text report of the top `limit` functions."""
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class ProfileRing:
+    """
+    Bounded on-disk ring of pstats dumps (`<name>.prof`, loadable with `pstats.Stats(path)`).
+    Once more than `keep` profiles exist, the oldest are deleted.
+    """
+
+    def __init__(self, directory: str, *, keep: int = 20) -> None:
+        self.directory = directory
+        self.keep = max(1, keep)
+        self._lock = threading.Lock()
+
+    def _paths(self) -> List[str]:
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".prof")]
+        except FileNotFoundError:
+            return []
+        paths = [os.path.join(self.directory, n) for n in names]
+        return sorted(paths, key=os.path.getmtime)
+
+    def save(self, profiler: cProfile.Profile, name: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{_SAFE_NAME.sub('_', name)}.prof")
+        with self._lock:
+            profiler.dump_stats(path)
+            for old in self._paths()[: -self.keep]:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+        return path
+
+    def list(self) -> List[str]:
+        return self._paths()
+
+
+def profile_ring_from_env() -> Optional[ProfileRing]:
+    """PROFILE_DIR enables the on-disk ring (PROFILE_KEEP bounds it); otherwise profiles are only logged."""
+    directory = os.getenv("PROFILE_DIR")
+    if not directory:
+        return None
+    return ProfileRing(directory, keep=int(os.getenv("PROFILE_KEEP", "20")))
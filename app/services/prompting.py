@@ -12,7 +12,7 @@ class BuiltPrompt:
     citations: List[Dict[str, str]]
 
 
-def _estimate_tokens(text: str) -> int:
+def estimate_tokens(text: str) -> int:
     # Crude token estimate ~ 4 chars per token
     return max(len(text) // 4, 1)
 
@@ -48,7 +48,7 @@ class PromptBuilder:
             if used_chars + len(part) > max_context_chars:
                 break
             # respect token budget if provided
-            t = _estimate_tokens(part)
+            t = estimate_tokens(part)
             if max_context_tokens is not None and used_tokens + t > max_context_tokens:
                 # Try to truncate the part to fit remaining tokens
                 remaining = max(0, max_context_tokens - used_tokens)
@@ -56,7 +56,7 @@ class PromptBuilder:
                 if approx_chars <= 0:
                     break
                 part = part[:approx_chars].rstrip()
-                t = _estimate_tokens(part)
+                t = estimate_tokens(part)
             context_parts.append(part)
             used_chars += len(part)
             used_tokens += t
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Optional
+
+from app.services.observability import get_logger
+
+
+@dataclass(frozen=True)
+class RateLimitConfig:
+    enabled: bool = False
+    max_requests: int = 60  # allowed per window, also the burst size
+    window_s: float = 60.0
+    key: str = "ip"  # see KEY_FUNCS
+    max_keys: int = 100_000  # memory bound; least recently seen keys are evicted first
+    # Header-keyed modes: per-IP cap across all header values (0 = IP_CAP_FACTOR * max_requests)
+    ip_max_requests: int = 0
+
+    def __post_init__(self) -> None:
+        if self.max_requests < 1:
+            raise ValueError("max_requests must be >= 1")
+        if self.window_s <= 0:
+            raise ValueError("window_s must be > 0")
+        if self.max_keys < 1:
+            raise ValueError("max_keys must be >= 1")
+        if self.ip_max_requests < 0:
+            raise ValueError("ip_max_requests must be >= 0")
+        if self.key not in KEY_FUNCS:
+            raise ValueError(f"unknown rate limit key: {self.key}")
+
+    @property
+    def emission_interval_s(self) -> float:
+        return self.window_s / self.max_requests
+
+    @property
+    def ip_cap(self) -> int:
+        return self.ip_max_requests or IP_CAP_FACTOR * self.max_requests
+
+    @classmethod
+    def from_env(cls) -> "RateLimitConfig":
+        return cls(
+            enabled=os.getenv("RATE_LIMIT_ENABLED", "0").lower() in {"1", "true", "yes"},
+            max_requests=int(os.getenv("RATE_LIMIT_MAX_REQUESTS", "60")),
+            window_s=float(os.getenv("RATE_LIMIT_WINDOW_SEC", "60")),
+            key=os.getenv("RATE_LIMIT_KEY", "ip").lower(),
+            max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")),
+            ip_max_requests=int(os.getenv("RATE_LIMIT_IP_MAX_REQUESTS", "0")),
+        )
+
+    def with_overrides(self, data: Dict[str, Any]) -> "RateLimitConfig":
+        """Apply a config-file mapping (enabled, max_requests, window_sec, key, max_keys, ip_max_requests) on top of this config."""
+        fields: Dict[str, Any] = {}
+        if "enabled" in data:
+            fields["enabled"] = bool(data["enabled"])
+        if "max_requests" in data:
+            fields["max_requests"] = int(data["max_requests"])
+        if "window_sec" in data:
+            fields["window_s"] = float(data["window_sec"])
+        if "key" in data:
+            fields["key"] = str(data["key"]).lower()
+        if "max_keys" in data:
+            fields["max_keys"] = int(data["max_keys"])
+        if "ip_max_requests" in data:
+            fields["ip_max_requests"] = int(data["ip_max_requests"])
+        return replace(self, **fields)
+
+
+# Default per-IP cap in header-keyed modes, as a multiple of the per-key limit (several users may share a NAT)
+IP_CAP_FACTOR = 10
+
+
+def _client_ip(request: Any) -> str:
+    return request.client.host if getattr(request, "client", None) else "unknown"
+
+
+def _api_key(request: Any) -> str:
+    key = request.headers.get("X-API-Key")
+    # Keys are hashed so raw credentials never sit in limiter memory
+    return "key:" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] if key else "ip:" + _client_ip(request)
+
+
+def _phone(request: Any) -> str:
+    phone = "".join(ch for ch in request.headers.get("X-Phone-Number", "") if ch.isdigit())
+    return "phone:" + hashlib.sha256(phone.encode("utf-8")).hexdigest()[:32] if phone else "ip:" + _client_ip(request)
+
+
+# Request -> limiter key. Callers without the identifying header fall back to their IP.
+# Header values are not authenticated here, so RateLimiter.check_request also caps each IP.
+KEY_FUNCS: Dict[str, Callable[[Any], str]] = {"ip": _client_ip, "api_key": _api_key, "phone": _phone}
+
+
+@dataclass
+class RateLimitDecision:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_s: int  # seconds until the full quota is available again
+    retry_after_s: int = 0  # when rejected: seconds until the next request would be allowed
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset_s),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after_s)
+        return headers
+
+
+class RateLimiter:
+    """
+    GCRA (a token bucket stored as one float per key: its theoretical arrival time, TAT).
+    - Each request advances the key's TAT by window/max_requests; a request is rejected when that
+      would put the TAT more than one window ahead of now, so up to `max_requests` may burst.
+    - A key whose TAT has passed holds a full bucket and is dropped; keys are kept in LRU order,
+      so idle keys are evicted from the front on each check and `max_keys` bounds memory.
+    - With a header key (api_key, phone), the headers are unauthenticated, so `check_request` also
+      charges an "ipcap:" bucket per client IP (`ip_cap`). Rotating header values then cannot exceed
+      the IP's cap, and cannot create more limiter keys than that cap allows.
+    - Config is loaded once; with `config_path`, the JSON file is re-checked (one stat) at most every
+      `reload_interval_s` and applied on change, so limits can be tuned without a restart.
+    """
+
+    def __init__(
+        self,
+        config: RateLimitConfig,
+        *,
+        config_path: Optional[str] = None,
+        reload_interval_s: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._base = config
+        self.config = config
+        self.config_path = config_path
+        self.reload_interval_s = reload_interval_s
+        self._clock = clock
+        self._tat: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_reload_check = float("-inf")
+        self._mtime: Optional[float] = None
+        self.evictions = 0
+        self.maybe_reload()
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def key_for(self, request: Any) -> str:
+        return KEY_FUNCS[self.config.key](request)
+
+    def maybe_reload(self) -> bool:
+        """Re-read `config_path` if it changed since the last check; returns whether config was replaced."""
+        if self.config_path is None:
+            return False
+        now = self._clock()
+        if now < self._next_reload_check:
+            return False
+        self._next_reload_check = now + self.reload_interval_s
+        try:
+            mtime = os.stat(self.config_path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        try:
+            if mtime is None:
+                config = self._base
+            else:
+                with open(self.config_path, encoding="utf-8") as f:
+                    config = self._base.with_overrides(json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            # Keep serving with the last good config
+            get_logger("ratelimit").warning("config reload failed", extra={"extra": {"path": self.config_path, "error": str(e)}})
+            return False
+        self._mtime = mtime
+        self.reload(config)
+        return True
+
+    def reload(self, config: RateLimitConfig) -> None:
+        with self._lock:
+            if config.key != self.config.key:
+                self._tat.clear()  # old keys no longer identify anyone
+            self.config = config
+        get_logger("ratelimit").info(
+            "config loaded", extra={"extra": {"enabled": config.enabled, "max_requests": config.max_requests, "window_s": config.window_s, "key": config.key}}
+        )
+
+    def _evict(self, now: float, max_keys: int, incoming: str) -> None:
+        # Leave room for `incoming` so the table never exceeds max_keys
+        limit = max_keys if incoming in self._tat else max_keys - 1
+        while self._tat:
+            key, tat = next(iter(self._tat.items()))
+            if tat > now and len(self._tat) <= limit:
+                return
+            del self._tat[key]
+            self.evictions += 1
+
+    def check_request(self, request: Any) -> RateLimitDecision:
+        config = self.config
+        key = KEY_FUNCS[config.key](request)
+        if config.key != "ip" and not key.startswith("ip:"):
+            # Checked first, so a capped IP cannot create fresh header keys
+            capped = self.check("ipcap:" + _client_ip(request), max_requests=config.ip_cap)
+            if not capped.allowed:
+                return capped
+        return self.check(key)
+
+    def check(self, key: str, *, max_requests: Optional[int] = None) -> RateLimitDecision:
+        config = self.config
+        limit = max_requests or config.max_requests
+        window = config.window_s
+        interval = window / limit
+        now = self._clock()
+        with self._lock:
+            self._evict(now, config.max_keys, key)
+            tat = max(self._tat.get(key, now), now)
+            new_tat = tat + interval
+            allow_at = new_tat - window
+            if now < allow_at:
+                self._tat.move_to_end(key)  # present: the bucket is not full
+                return RateLimitDecision(
+                    allowed=False,
+                    limit=limit,
+                    remaining=0,
+                    reset_s=math.ceil(tat - now),
+                    retry_after_s=max(1, math.ceil(allow_at - now)),
+                )
+            self._tat[key] = new_tat
+            self._tat.move_to_end(key)
+        remaining = int((window - (new_tat - now)) / interval + 1e-9)
+        return RateLimitDecision(allowed=True, limit=limit, remaining=max(0, remaining), reset_s=math.ceil(new_tat - now))
+
+
+def rate_limiter_from_env() -> RateLimiter:
+    """Env config, optionally overlaid and hot-reloaded from RATE_LIMIT_CONFIG_PATH (JSON)."""
+    return RateLimiter(
+        RateLimitConfig.from_env(),
+        config_path=os.getenv("RATE_LIMIT_CONFIG_PATH") or None,
+        reload_interval_s=float(os.getenv("RATE_LIMIT_RELOAD_SEC", "5")),
+    )
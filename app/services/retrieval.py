@@ -1,12 +1,25 @@
 from __future__ import annotations
 
+import contextvars
+import heapq
+import inspect
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from dataclasses import dataclass
-from typing import Iterable, List, Protocol, Sequence, Tuple, Dict
-from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Collection, Hashable, Iterable, List, Optional, Protocol, Sequence, Set, Tuple, Dict
 
-from app.services.ingestion import UpsertStore, Chunk
+import numpy as np
+
+from app.services.budget import Deadline
+from app.services.caching import LRUCache
+from app.services.metrics import RETRIEVAL_CANDIDATES
+from app.services.ingestion import UpsertStore, Chunk, ingested_epoch, iso_epoch
 from app.services.embeddings import Embeddings
-from app.services.vectorstore import InMemoryVectorStore
+from app.services.indexes import tokenize
+from app.services.observability import annotate, get_logger, span
+from app.services.vectorstore import InMemoryVectorStore, VSItem, top_k_indices
 
 
 @dataclass
@@ -20,11 +33,83 @@ class Retriever(Protocol):
         ...
 
 
+def retrieve_within(
+    retriever: Retriever,
+    query: str,
+    *,
+    filters: Dict[str, str] | None = None,
+    k: int = 5,
+    deadline: Optional[Deadline] = None,
+) -> List[RetrievalResult]:
+    """Call `retriever.retrieve`, forwarding `deadline` only to retrievers that accept it."""
+    if deadline is None or not _accepts_deadline(type(retriever)):
+        return retriever.retrieve(query, filters=filters, k=k)
+    return retriever.retrieve(query, filters=filters, k=k, deadline=deadline)
+
+
+def retriever_chain(retriever: Retriever) -> str:
+    """Wrapper chain down to the base retriever (following `.base`/`.retriever`), e.g. "CachingRetriever>ScoringPipeline>HybridRetriever"."""
+    names: List[str] = []
+    seen: Set[int] = set()
+    current: Any = retriever
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        names.append(type(current).__name__)
+        current = getattr(current, "base", None) or getattr(current, "retriever", None)
+    return ">".join(names)
+
+
+@lru_cache(maxsize=None)
+def _accepts_deadline(cls: type) -> bool:
+    try:
+        params = inspect.signature(cls.retrieve).parameters.values()
+    except (AttributeError, TypeError, ValueError):
+        return False
+    return any(p.name == "deadline" or p.kind is inspect.Parameter.VAR_KEYWORD for p in params)
+
+
+DATE_FILTER_KEYS = ("ingested_after", "ingested_before", "ingested_within_days")
+
+
+def _parse_when(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        # Same parsing as stored ingested_at values, so naive bounds and timestamps agree
+        return iso_epoch(value)
+
+
+def split_date_filters(filters: Dict[str, str] | None) -> Tuple[Dict[str, str], Optional[Tuple[Optional[float], Optional[float]]]]:
+    """
+    Separate date-range keys from metadata filters.
+    - ingested_after / ingested_before: ISO date(time) (UTC if naive) or epoch seconds
+    - ingested_within_days: e.g. "14" for advisories from the last 14 days
+    Returns (metadata filters, (start, end) epoch bounds or None).
+    """
+    if not filters or not any(key in filters for key in DATE_FILTER_KEYS):
+        return dict(filters or {}), None
+    rest = {k: v for k, v in filters.items() if k not in DATE_FILTER_KEYS}
+    start: Optional[float] = None
+    end: Optional[float] = None
+    try:
+        if "ingested_after" in filters:
+            start = _parse_when(filters["ingested_after"])
+        if "ingested_before" in filters:
+            end = _parse_when(filters["ingested_before"])
+        if "ingested_within_days" in filters:
+            since = time.time() - float(filters["ingested_within_days"]) * 86400.0
+            start = since if start is None else max(start, since)
+    except (TypeError, ValueError):
+        raise ValueError("invalid date filter value")
+    return rest, (start, end)
+
+
 class InMemoryRetriever:
     """
-    Very simple keyword retriever over UpsertStore.
-    - Scores by term frequency of query tokens present in chunk text.
+    Keyword retriever over UpsertStore's BM25 index.
+    - Scores whole query tokens with BM25 (so "rain" does not match "grain").
     - Applies filters on chunk.metadata (exact match) and region tags if filter key 'region_tag' provided.
+    - Date-range keys (see `split_date_filters`) are answered from the store's timestamp index.
     """
 
     def __init__(self, store: UpsertStore) -> None:
@@ -32,13 +117,7 @@ class InMemoryRetriever:
 
     @staticmethod
     def _tokenize(s: str) -> List[str]:
-        return [t.lower() for t in s.split() if t.strip()]
-
-    def _score(self, query_tokens: Sequence[str], text: str) -> float:
-        if not text:
-            return 0.0
-        tl = text.lower()
-        return sum(tl.count(tok) for tok in query_tokens)
+        return tokenize(s)
 
     def _passes_filters(self, ch: Chunk, filters: Dict[str, str] | None) -> bool:
         if not filters:
@@ -55,43 +134,82 @@ class InMemoryRetriever:
                     return False
         return True
 
-    def retrieve(self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5) -> List[RetrievalResult]:
-        qtokens = self._tokenize(query)
-        scored: List[RetrievalResult] = []
-        for ch in self.store.chunks.values():
-            if not self._passes_filters(ch, filters):
-                continue
-            s = self._score(qtokens, ch.text)
-            if s > 0:
-                scored.append(RetrievalResult(chunk=ch, score=float(s)))
-        scored.sort(key=lambda r: r.score, reverse=True)
-        return scored[:k]
+    def _candidate_ids(self, filters: Dict[str, str] | None) -> Optional[Collection[str]]:
+        """Chunk ids passing filters (None = unfiltered), via the store's indexes when possible."""
+        filters, date_range = split_date_filters(filters)
+        ids: Optional[Collection[str]] = None
+        if filters:
+            equals = {k: v for k, v in filters.items() if k != "region_tag"}
+            casefold = {"region": filters["region_tag"]} if "region_tag" in filters else None
+            ids = self.store.meta_index.candidates(equals, casefold=casefold)
+            if ids is None:
+                ids = [cid for cid, ch in self.store.chunks.items() if self._passes_filters(ch, filters)]
+        if date_range is not None:
+            in_range = self.store.time_index.between(*date_range)
+            if ids is None:
+                return set(in_range)
+            small, large = sorted((ids, in_range), key=len)
+            large_set = set(large)
+            return {cid for cid in small if cid in large_set}
+        return None if ids is None else set(ids)
+
+    def retrieve(self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5, deadline: Optional[Deadline] = None) -> List[RetrievalResult]:
+        with span("retrieval.keyword"):
+            qtokens = self._tokenize(query)
+            with self.store.lock:
+                hits = self.store.text_index.search(qtokens, k=k, candidates=self._candidate_ids(filters))
+                return [RetrievalResult(chunk=self.store.chunks[cid], score=score) for cid, score in hits]
 
 
 class EmbeddingRetriever:
     """
     Vector-store based retriever using provided Embeddings and VectorStore.
     Requires chunks to be indexed into the vector store ahead of time.
+    Date ranges are not a vector-store filter, so they are applied to an over-fetched result; the
+    search is widened by `date_filter_overfetch` until k chunks pass or the store has no more.
     """
 
-    def __init__(self, store: UpsertStore, embeddings: Embeddings, vector_store: InMemoryVectorStore):
+    def __init__(self, store: UpsertStore, embeddings: Embeddings, vector_store: InMemoryVectorStore, *, date_filter_overfetch: int = 4):
         self.store = store
         self.embeddings = embeddings
         self.vs = vector_store
+        self.date_filter_overfetch = max(1, date_filter_overfetch)
 
-    def retrieve(self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5) -> List[RetrievalResult]:
-        qv = self.embeddings.embed([query])[0]
-        results = self.vs.similarity_search(qv, k=k, filter=filters or {})
+    def retrieve(self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5, deadline: Optional[Deadline] = None) -> List[RetrievalResult]:
+        with span("retrieval.embed_query"):
+            qv = self.embeddings.embed([query])[0]
+        filters, date_range = split_date_filters(filters)
+        if date_range is None:
+            with span("retrieval.vector_search"):
+                return self._resolve(self.vs.similarity_search(qv, k=k, filter=filters), k, None)
+        with self.store.lock:
+            allowed = set(self.store.time_index.between(*date_range))
+        if not allowed:
+            return []
+        fetch_k = k * self.date_filter_overfetch
+        while True:
+            with span("retrieval.vector_search"):
+                results = self.vs.similarity_search(qv, k=fetch_k, filter=filters)
+            out = self._resolve(results, k, allowed)
+            # Fewer results than asked for: the store has nothing more to offer
+            if len(out) >= k or len(results) < fetch_k:
+                return out
+            fetch_k *= max(2, self.date_filter_overfetch)
+
+    def _resolve(self, results: List[Tuple[VSItem, float]], k: int, allowed: Optional[Set[str]]) -> List[RetrievalResult]:
         out: List[RetrievalResult] = []
-        for itm, score in results:
-            ch = self.store.chunks.get(itm.id)
-            if ch is None:
-                # Fall back: try to find by chunk_id in metadata
-                cid = itm.metadata.get("chunk_id")
-                if cid:
-                    ch = self.store.chunks.get(cid)
-            if ch is not None:
-                out.append(RetrievalResult(chunk=ch, score=float(score)))
+        with self.store.lock:
+            for itm, score in results:
+                if len(out) >= k:
+                    break
+                ch = self.store.chunks.get(itm.id)
+                if ch is None:
+                    # Fall back: try to find by chunk_id in metadata
+                    cid = itm.metadata.get("chunk_id")
+                    if cid:
+                        ch = self.store.chunks.get(cid)
+                if ch is not None and (allowed is None or ch.id in allowed):
+                    out.append(RetrievalResult(chunk=ch, score=float(score)))
         return out
 
 
@@ -99,7 +217,8 @@ def index_store_chunks(store: UpsertStore, embeddings: Embeddings, vector_store:
     """
     Embed all chunks in UpsertStore and upsert into vector store. Returns count indexed.
     """
-    chunks = list(store.chunks.values())
+    with store.lock:
+        chunks = list(store.chunks.values())
     if not chunks:
         return 0
     texts = [c.text for c in chunks]
@@ -110,55 +229,416 @@ def index_store_chunks(store: UpsertStore, embeddings: Embeddings, vector_store:
     return len(chunks)
 
 
-class FreshnessWeightedRetriever:
+@dataclass
+class IndexDelta:
+    upserted: int
+    removed: int
+    generation: int
+    retagged: int = 0  # metadata-only changes applied without re-embedding
+
+
+class IncrementalIndexer:
+    """
+    Keeps a vector store in step with an UpsertStore using its change log.
+    Each `sync()` embeds only chunks added or changed since the last indexed generation
+    and deletes vectors of chunks that were removed or replaced. Chunks whose text is unchanged
+    only get their metadata replaced when the vector store supports `update_metadata`.
+    Concurrent syncs are serialized; embedding runs outside the store and vector-store locks,
+    so queries keep being served.
+    """
+
+    def __init__(
+        self,
+        store: UpsertStore,
+        embeddings: Embeddings,
+        vector_store: InMemoryVectorStore,
+        *,
+        batch_size: int = 256,
+    ) -> None:
+        self.store = store
+        self.embeddings = embeddings
+        self.vs = vector_store
+        self.batch_size = max(1, batch_size)
+        self.indexed_generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> bool:
+        return self.store.generation > self.indexed_generation
+
+    def sync(self) -> IndexDelta:
+        with self._lock:
+            # Read the generation and its changes together so a concurrent ingest is never half-counted
+            with self.store.lock:
+                target = self.store.generation
+                if target <= self.indexed_generation:
+                    return IndexDelta(upserted=0, removed=0, generation=self.indexed_generation)
+                upserted, removed = self.store.changes_since(self.indexed_generation)
+                retag = [c for c in upserted if not self.store.text_changed_after(c.id, self.indexed_generation)]
+            if removed:
+                self.vs.delete(removed)
+            update_metadata = getattr(self.vs, "update_metadata", None)
+            retagged = 0
+            if retag and update_metadata is not None:
+                missing = set(update_metadata([c.id for c in retag], [dict(c.metadata) | {"chunk_id": c.id} for c in retag]))
+                retagged = len(retag) - len(missing)
+                done = {c.id for c in retag} - missing
+                upserted = [c for c in upserted if c.id not in done]
+            for i in range(0, len(upserted), self.batch_size):
+                batch = upserted[i : i + self.batch_size]
+                vecs = self.embeddings.embed([c.text for c in batch])
+                metas = [dict(c.metadata) | {"chunk_id": c.id} for c in batch]
+                self.vs.upsert([c.id for c in batch], vecs, metas)
+            self.indexed_generation = target
+            return IndexDelta(upserted=len(upserted), removed=len(removed), generation=target, retagged=retagged)
+
+
+_BRANCH_WORKERS = 8
+_BRANCH_POOL: Optional[ThreadPoolExecutor] = None
+# One slot per pool worker, held until the branch finishes (even after its caller gave up on it)
+_BRANCH_SLOTS = threading.BoundedSemaphore(_BRANCH_WORKERS)
+
+
+def _branch_pool() -> ThreadPoolExecutor:
+    global _BRANCH_POOL
+    if _BRANCH_POOL is None:
+        _BRANCH_POOL = ThreadPoolExecutor(max_workers=_BRANCH_WORKERS, thread_name_prefix="retrieval-branch")
+    return _BRANCH_POOL
+
+
+def _submit_branch(fn: Callable[..., List[RetrievalResult]], *args, **kwargs) -> Optional[Future]:
+    """
+    Run `fn` on the branch pool in a copy of the caller's context, or return None when every
+    worker is taken (e.g. by timed-out branches still running), so it never queues behind them.
+    """
+    if not _BRANCH_SLOTS.acquire(blocking=False):
+        return None
+    try:
+        fut = _branch_pool().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    except BaseException:
+        _BRANCH_SLOTS.release()
+        raise
+    fut.add_done_callback(lambda _: _BRANCH_SLOTS.release())
+    return fut
+
+
+class HybridRetriever:
+    """
+    Runs keyword and vector retrievers concurrently and fuses their rankings.
+    - fusion="rrf": score = sum(weight / (rrf_k + rank)) over the branches that returned the chunk.
+    - fusion="weighted": per-branch min-max normalized scores, summed with the branch weights.
+    - Each branch gets its own latency budget; a branch that times out or fails is dropped and the
+      query is answered from the remaining branch. `retrieve_with_drops` returns the dropped branch
+      names per call; `retrieve` logs them, annotates the request and records
+      "dropped_branch:<name>" on its Deadline, so the partial result is not cached.
+    - Branches share a bounded pool. A timed-out branch keeps its worker until it finishes; when
+      no worker is free, a branch runs in the calling thread instead (without its latency budget).
+    """
+
+    def __init__(
+        self,
+        keyword: Retriever,
+        vector: Retriever,
+        *,
+        fusion: str = "rrf",
+        rrf_k: int = 60,
+        keyword_weight: float = 1.0,
+        vector_weight: float = 1.0,
+        keyword_timeout_ms: Optional[float] = None,
+        vector_timeout_ms: Optional[float] = None,
+        fetch_multiplier: int = 2,
+    ) -> None:
+        if fusion not in {"rrf", "weighted"}:
+            raise ValueError("fusion must be 'rrf' or 'weighted'")
+        self.branches: Dict[str, Tuple[Retriever, float, Optional[float]]] = {
+            "keyword": (keyword, keyword_weight, keyword_timeout_ms),
+            "vector": (vector, vector_weight, vector_timeout_ms),
+        }
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.fetch_multiplier = max(1, fetch_multiplier)
+
+    def _fuse(self, ranked: Dict[str, List[RetrievalResult]], k: int) -> List[RetrievalResult]:
+        fused: Dict[str, float] = {}
+        chunks: Dict[str, Chunk] = {}
+        for name, results in ranked.items():
+            weight = self.branches[name][1]
+            if self.fusion == "rrf":
+                contrib = [weight / (self.rrf_k + rank) for rank in range(1, len(results) + 1)]
+            else:
+                scores = [r.score for r in results]
+                lo, hi = (min(scores), max(scores)) if scores else (0.0, 0.0)
+                spread = hi - lo
+                contrib = [weight * ((s - lo) / spread if spread else 1.0) for s in scores]
+            for r, c in zip(results, contrib):
+                cid = r.chunk.id
+                chunks.setdefault(cid, r.chunk)
+                fused[cid] = fused.get(cid, 0.0) + c
+        top = heapq.nlargest(k, fused.items(), key=lambda kv: kv[1])
+        return [RetrievalResult(chunk=chunks[cid], score=score) for cid, score in top]
+
+    def retrieve(self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5, deadline: Optional[Deadline] = None) -> List[RetrievalResult]:
+        results, dropped = self.retrieve_with_drops(query, filters=filters, k=k, deadline=deadline)
+        if dropped:
+            annotate(dropped_branches=dropped)
+            if deadline is not None:
+                for name in dropped:
+                    deadline.record(f"dropped_branch:{name}")
+        return results
+
+    def retrieve_with_drops(
+        self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5, deadline: Optional[Deadline] = None
+    ) -> Tuple[List[RetrievalResult], List[str]]:
+        """(fused results, names of the branches dropped for this call)."""
+        fetch_k = k * self.fetch_multiplier
+        started = time.perf_counter()
+        futures = {
+            name: _submit_branch(retrieve_within, retriever, query, filters=filters, k=fetch_k, deadline=deadline)
+            for name, (retriever, _, _) in self.branches.items()
+        }
+        ranked: Dict[str, List[RetrievalResult]] = {}
+        dropped: List[str] = []
+        log = get_logger("retrieval.hybrid")
+        for name, fut in futures.items():
+            if fut is not None:
+                continue
+            # Pool saturated: run here rather than wait for a worker
+            try:
+                ranked[name] = retrieve_within(self.branches[name][0], query, filters=filters, k=fetch_k, deadline=deadline)
+            except Exception as exc:
+                dropped.append(name)
+                log.warning("branch dropped", extra={"extra": {"branch": name, "reason": type(exc).__name__}})
+        for name, fut in futures.items():
+            if fut is None:
+                continue
+            budget = self.branches[name][2]
+            remaining = None if budget is None else max(0.0, budget / 1000.0 - (time.perf_counter() - started))
+            if deadline is not None:
+                # Branch budgets never outlive the request budget
+                remaining = deadline.timeout(remaining)
+            try:
+                ranked[name] = fut.result(timeout=remaining)
+            except FutureTimeout:
+                fut.cancel()
+                dropped.append(name)
+                log.warning("branch dropped", extra={"extra": {"branch": name, "reason": "timeout"}})
+            except Exception as exc:
+                dropped.append(name)
+                log.warning("branch dropped", extra={"extra": {"branch": name, "reason": type(exc).__name__}})
+        with span("retrieval.fusion"):
+            return self._fuse({name: ranked[name] for name in self.branches if name in ranked}, k), dropped
+
+
+class RetrievalCache:
+    """
+    Shared LRU/TTL storage for CachingRetriever results.
+    `generation()` should change whenever the underlying data changes (e.g. store and vector-store
+    generations); the cache is cleared automatically the first time a new generation is seen.
+    """
+
+    def __init__(self, generation: Callable[[], Hashable], *, max_entries: int = 1024, ttl_s: Optional[float] = 300.0) -> None:
+        self.generation = generation
+        self._lru: LRUCache[List[RetrievalResult]] = LRUCache(max_entries, ttl_s=ttl_s)
+        self._seen: Hashable = generation()
+        self._lock = threading.Lock()
+        self.invalidations = 0
+
+    def _current(self) -> Hashable:
+        gen = self.generation()
+        if gen != self._seen:
+            with self._lock:
+                if gen != self._seen:
+                    self._lru.clear()
+                    self._seen = gen
+                    self.invalidations += 1
+        return gen
+
+    def get(self, key: Hashable) -> Tuple[Optional[List[RetrievalResult]], Hashable]:
+        gen = self._current()
+        return self._lru.get(key), gen
+
+    def put(self, key: Hashable, results: List[RetrievalResult], gen: Hashable) -> None:
+        # Results computed while the data changed are not cached
+        if self._current() == gen:
+            self._lru.set(key, list(results))
+
+    def stats(self) -> Dict[str, float]:
+        return self._lru.stats() | {"invalidations": self.invalidations}
+
+
+class CachingRetriever:
+    """Serves repeated (normalized query, filters, k) lookups from a RetrievalCache."""
+
+    def __init__(self, base: Retriever, cache: RetrievalCache) -> None:
+        self.base = base
+        self.cache = cache
+
+    @staticmethod
+    def _key(query: str, filters: Dict[str, str] | None, k: int) -> Hashable:
+        # Case/whitespace only: every retriever here lower-cases and splits on whitespace
+        return (" ".join(query.lower().split()), tuple(sorted((filters or {}).items())), k)
+
+    def retrieve(self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5, deadline: Optional[Deadline] = None) -> List[RetrievalResult]:
+        key = self._key(query, filters, k)
+        with span("retrieval.cache_lookup"):
+            cached, gen = self.cache.get(key)
+        annotate(retrieval_cache="miss" if cached is None else "hit")
+        if cached is not None:
+            return list(cached)
+        degraded_before = len(deadline.degradations) if deadline is not None else 0
+        results = retrieve_within(self.base, query, filters=filters, k=k, deadline=deadline)
+        # Results cut short by the request budget are not reused for unhurried requests
+        if deadline is None or len(deadline.degradations) == degraded_before:
+            self.cache.put(key, results, gen)
+        return results
+
+
+# Kept from the original wrapper so decayed scores are unchanged
+_E = 2.718281828
+
+
+class ScoreTerm(Protocol):
+    """One scoring signal applied to a candidate set inside ScoringPipeline."""
+
+    # Base-retriever over-fetch this term historically needed as a standalone wrapper
+    fetch_multiplier: int
+    # Optional terms (reranking) are skipped when the request budget runs low
+    optional: bool
+
+    def apply(self, chunks: Sequence[Chunk], scores: np.ndarray) -> np.ndarray:  # pragma: no cover (interface)
+        ...
+
+
+class FreshnessDecay:
+    """
+    score' = score * exp(-lambda * age_days), applied to the whole candidate set at once.
+    - With `store`, ages come from its precomputed epoch timestamps instead of parsing ingested_at.
+    - With `bucket_days`, factors are looked up in a precomputed table of age buckets
+      (capped at `max_age_days`) instead of calling exp per candidate.
+    """
+
+    fetch_multiplier = 4
+    optional = False
+
+    def __init__(
+        self,
+        decay_lambda_per_day: float = 0.05,
+        *,
+        store: Optional[UpsertStore] = None,
+        bucket_days: Optional[float] = None,
+        max_age_days: float = 365.0,
+    ) -> None:
+        self.lmbda = decay_lambda_per_day
+        self.store = store
+        self.bucket_days = bucket_days
+        self._table: Optional[np.ndarray] = None
+        if bucket_days:
+            n = int(max_age_days / bucket_days) + 1
+            self._table = np.power(_E, -self.lmbda * np.arange(n) * bucket_days)
+
+    def _timestamps(self, chunks: Sequence[Chunk]) -> np.ndarray:
+        if self.store is None:
+            return np.fromiter((ingested_epoch(ch.metadata) for ch in chunks), dtype=np.float64, count=len(chunks))
+        with self.store.lock:
+            ts = self.store.time_index.values([ch.id for ch in chunks])
+        # Chunks unknown to the store (or without a timestamp) fall back to their metadata
+        for i in np.flatnonzero(np.isnan(ts)):
+            ts[i] = ingested_epoch(chunks[i].metadata)
+        return ts
+
+    def apply(self, chunks: Sequence[Chunk], scores: np.ndarray) -> np.ndarray:
+        ages = np.maximum((time.time() - self._timestamps(chunks)) / 86400.0, 0.0)
+        ages[np.isnan(ages)] = 0.0
+        if self._table is not None and self.bucket_days:
+            idx = np.minimum((ages / self.bucket_days).astype(np.int64), len(self._table) - 1)
+            return scores * self._table[idx]
+        return scores * np.power(_E, -self.lmbda * ages)
+
+
+class AuthorityBoost:
+    """score' = score + boost for chunks carrying 'authority' metadata."""
+
+    fetch_multiplier = 2
+    optional = True
+
+    def __init__(self, authority_boost: float = 0.1) -> None:
+        self.boost = authority_boost
+
+    def apply(self, chunks: Sequence[Chunk], scores: np.ndarray) -> np.ndarray:
+        mask = np.fromiter((bool(ch.metadata.get("authority")) for ch in chunks), dtype=bool, count=len(chunks))
+        return scores + mask * self.boost
+
+
+class ScoringPipeline:
+    """
+    Applies score terms to one candidate pass over the base retriever, then selects top-k once.
+    - The candidate pool is `k * candidate_multiplier`; by default the product of the terms'
+      multipliers, i.e. the same base fetch the equivalent stacked wrappers would make.
+    - Terms run in order over shared score arrays. After each term the pool is cut to
+      `k * (product of the remaining terms' multipliers)`, the same intermediate top-k the stacked
+      wrappers make, so [FreshnessDecay, AuthorityBoost] ranks exactly like
+      RerankerWrapper(FreshnessWeightedRetriever(base)) without re-fetching between terms.
+    - Under a low request budget, optional terms are skipped along with the over-fetch they need.
+    """
+
+    def __init__(self, base: Retriever, terms: Sequence[ScoreTerm], *, candidate_multiplier: Optional[int] = None) -> None:
+        self.base = base
+        self.terms = list(terms)
+        self._fixed_multiplier = candidate_multiplier
+        self.candidate_multiplier = self._multiplier(self.terms)
+
+    def _multiplier(self, terms: Sequence[ScoreTerm]) -> int:
+        if self._fixed_multiplier is not None:
+            return max(1, self._fixed_multiplier)
+        return self._fetch_product(terms)
+
+    @staticmethod
+    def _fetch_product(terms: Sequence[ScoreTerm]) -> int:
+        multiplier = 1
+        for term in terms:
+            multiplier *= term.fetch_multiplier
+        return max(1, multiplier)
+
+    def retrieve(self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5, deadline: Optional[Deadline] = None) -> List[RetrievalResult]:
+        terms, multiplier = self.terms, self.candidate_multiplier
+        if deadline is not None and any(getattr(t, "optional", False) for t in terms) and deadline.degrade("skipped_rerank"):
+            terms = [t for t in terms if not getattr(t, "optional", False)]
+            multiplier = self._multiplier(terms)
+        candidates = retrieve_within(self.base, query, filters=filters, k=k * multiplier, deadline=deadline)
+        RETRIEVAL_CANDIDATES.observe(len(candidates), pool="scoring")
+        annotate(candidates=len(candidates))
+        if not candidates:
+            return []
+        with span("retrieval.scoring"):
+            chunks = [r.chunk for r in candidates]
+            scores = np.fromiter((r.score for r in candidates), dtype=np.float64, count=len(candidates))
+            for i, term in enumerate(terms):
+                scores = term.apply(chunks, scores)
+                keep = k * self._fetch_product(terms[i + 1 :])
+                if i + 1 < len(terms) and keep < len(chunks):
+                    idx = top_k_indices(scores, keep)
+                    chunks, scores = [chunks[j] for j in idx], scores[idx]
+            return [RetrievalResult(chunk=chunks[i], score=float(scores[i])) for i in top_k_indices(scores, k)]
+
+
+class FreshnessWeightedRetriever(ScoringPipeline):
     """
     Wrapper that applies exponential decay on scores based on chunk ingested_at.
     score' = score * exp(-lambda * age_days).
     """
 
     def __init__(self, base: Retriever, *, decay_lambda_per_day: float = 0.05) -> None:
-        self.base = base
+        store = getattr(base, "store", None)
+        super().__init__(base, [FreshnessDecay(decay_lambda_per_day, store=store)])
         self.lmbda = decay_lambda_per_day
 
-    @staticmethod
-    def _age_days(ch: Chunk) -> float:
-        ts = ch.metadata.get("ingested_at")
-        if not ts:
-            return 0.0
-        try:
-            dt = datetime.fromisoformat(ts)
-        except Exception:
-            return 0.0
-        now = datetime.now(dt.tzinfo) if dt.tzinfo else datetime.now()
-        delta = now - dt
-        return max(delta.days + delta.seconds / 86400.0, 0.0)
-
-    def retrieve(self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5) -> List[RetrievalResult]:
-        base_res = self.base.retrieve(query, filters=filters, k=k * 4)
-        rescored: List[RetrievalResult] = []
-        for r in base_res:
-            age = self._age_days(r.chunk)
-            factor = pow(2.718281828, -self.lmbda * age)
-            rescored.append(RetrievalResult(chunk=r.chunk, score=r.score * factor))
-        rescored.sort(key=lambda r: r.score, reverse=True)
-        return rescored[:k]
-
-
-class RerankerWrapper:
+
+class RerankerWrapper(ScoringPipeline):
     """
     Simple reranker stub that boosts chunks with 'authority' metadata.
     score'' = score' + boost if authority present.
     """
 
     def __init__(self, base: Retriever, *, authority_boost: float = 0.1) -> None:
-        self.base = base
+        super().__init__(base, [AuthorityBoost(authority_boost)])
         self.boost = authority_boost
-
-    def retrieve(self, query: str, *, filters: Dict[str, str] | None = None, k: int = 5) -> List[RetrievalResult]:
-        res = self.base.retrieve(query, filters=filters, k=k * 2)
-        reranked: List[RetrievalResult] = []
-        for r in res:
-            b = self.boost if r.chunk.metadata.get("authority") else 0.0
-            reranked.append(RetrievalResult(chunk=r.chunk, score=r.score + b))
-        reranked.sort(key=lambda r: r.score, reverse=True)
-        return reranked[:k]
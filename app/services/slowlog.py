@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import logging
+import logging.handlers
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from app.services.observability import JsonFormatter
+
+
+class SlowQueryLog:
+    """
+    Keeps structured records of queries slower than `threshold_ms`.
+    - The newest `keep` records stay in memory for the admin endpoint.
+    - With `path`, each record is also appended as one JSON line to a size-capped rotating file
+      (`max_bytes` per file, `backups` rotated files), so slow patterns can be replayed offline.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float,
+        *,
+        path: Optional[str] = None,
+        max_bytes: int = 5_000_000,
+        backups: int = 3,
+        keep: int = 100,
+    ) -> None:
+        if threshold_ms <= 0:
+            raise ValueError("threshold_ms must be > 0")
+        self.threshold_ms = threshold_ms
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=max(1, keep))
+        self._lock = threading.Lock()
+        self._file: Optional[logging.Handler] = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            self._file.setFormatter(JsonFormatter())
+
+    def maybe_record(self, record: Dict[str, Any]) -> bool:
+        """Store `record` if its `elapsed_ms` is over the threshold; returns whether it was stored."""
+        if record.get("elapsed_ms", 0) < self.threshold_ms:
+            return False
+        with self._lock:
+            self._recent.append(record)
+        if self._file is not None:
+            entry = logging.makeLogRecord({"name": "slow_query", "levelno": logging.WARNING, "levelname": "WARNING", "msg": "slow query", "extra": record})
+            self._file.handle(entry)
+        return True
+
+    def recent(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Newest first."""
+        with self._lock:
+            records = list(reversed(self._recent))
+        return records if limit is None else records[: max(0, limit)]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+def slow_query_log_from_env() -> Optional[SlowQueryLog]:
+    """SLOW_QUERY_MS > 0 enables the log; SLOW_QUERY_LOG_PATH adds the rotating file."""
+    threshold_ms = float(os.getenv("SLOW_QUERY_MS", "0"))
+    if threshold_ms <= 0:
+        return None
+    return SlowQueryLog(
+        threshold_ms,
+        path=os.getenv("SLOW_QUERY_LOG_PATH") or None,
+        max_bytes=int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", "5000000")),
+        backups=int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "3")),
+        keep=int(os.getenv("SLOW_QUERY_KEEP", "100")),
+    )
@@ -1,18 +1,26 @@
 from __future__ import annotations
 
-import math
 from dataclasses import dataclass
 from typing import Dict, List, Tuple, Optional, Any
 import os
+import threading
+import time
 
+import numpy as np
 
-def _cosine(a: List[float], b: List[float]) -> float:
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    dot = sum(x * y for x, y in zip(a, b))
-    na = math.sqrt(sum(x * x for x in a)) or 1.0
-    nb = math.sqrt(sum(y * y for y in b)) or 1.0
-    return dot / (na * nb)
+from app.services.indexes import MetadataIndex
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (ties broken by position)."""
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    order = np.lexsort((part, -scores[part]))
+    return part[order]
 
 
 @dataclass
@@ -23,30 +31,369 @@ class VSItem:
 
 
 class InMemoryVectorStore:
-    """Simple in-memory vector store with cosine similarity."""
+    """
+    In-memory vector store with cosine similarity over a contiguous float32 matrix.
+    - Rows are L2-normalized on upsert, so search is a single matrix-vector dot product.
+    - Each id keeps its row across upserts; the original norm is kept to rebuild raw vectors.
+    - Top-k uses argpartition and only sorts the selected rows.
+    - Metadata filters are answered from an inverted index, so only matching rows are scored.
+    - `generation` increases on every upsert/delete (used to invalidate result caches).
+    - Upserts, deletes and searches hold one lock, so a search running in a worker thread never
+      reads rows that a concurrent delete is moving.
+    """
+
+    def __init__(self, *, initial_capacity: int = 1024) -> None:
+        self.dim: Optional[int] = None
+        self._capacity = max(1, initial_capacity)
+        self._mat: Optional[np.ndarray] = None
+        self._norms = np.zeros(self._capacity, dtype=np.float32)
+        self._ids: List[str] = []
+        self._metas: List[Dict[str, str]] = []
+        self._rows: Dict[str, int] = {}
+        self._meta_index: MetadataIndex[int] = MetadataIndex()
+        self.generation = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
 
-    def __init__(self) -> None:
-        self.items: Dict[str, VSItem] = {}
+    @property
+    def items(self) -> Dict[str, VSItem]:
+        """Materialize all stored items (debugging/compat; not used on the search path)."""
+        with self._lock:
+            return {_id: self._item(row) for row, _id in enumerate(self._ids)}
+
+    def _ensure_capacity(self, n: int) -> None:
+        if self._mat is None or n <= self._capacity:
+            return
+        cap = self._capacity
+        while cap < n:
+            cap *= 2
+        mat = np.zeros((cap, self._mat.shape[1]), dtype=np.float32)
+        mat[: len(self._ids)] = self._mat[: len(self._ids)]
+        norms = np.zeros(cap, dtype=np.float32)
+        norms[: len(self._ids)] = self._norms[: len(self._ids)]
+        self._mat, self._norms, self._capacity = mat, norms, cap
+
+    def _item(self, row: int) -> VSItem:
+        assert self._mat is not None
+        vec = (self._mat[row] * self._norms[row]).tolist()
+        return VSItem(id=self._ids[row], vector=vec, metadata=self._metas[row])
 
     def upsert(self, ids: List[str], vectors: List[List[float]], metadatas: List[Dict[str, str]]) -> None:
-        for _id, vec, meta in zip(ids, vectors, metadatas):
-            self.items[_id] = VSItem(id=_id, vector=vec, metadata=meta)
+        if not ids:
+            return
+        with self._lock:
+            batch = np.array(vectors, dtype=np.float32)
+            if batch.ndim != 2:
+                raise ValueError("vectors must be a non-empty list of equal-length lists")
+            if self.dim is None:
+                self.dim = int(batch.shape[1])
+                self._mat = np.zeros((self._capacity, self.dim), dtype=np.float32)
+            elif batch.shape[1] != self.dim:
+                raise ValueError(f"vector dim {batch.shape[1]} does not match store dim {self.dim}")
+            norms = np.linalg.norm(batch, axis=1)
+            norms[norms == 0.0] = 1.0
+            batch /= norms[:, None]
+            self._ensure_capacity(len(self._ids) + len(ids))
+            assert self._mat is not None
+            written: List[int] = []
+            for _id, vec, norm, meta in zip(ids, batch, norms, metadatas):
+                row = self._rows.get(_id)
+                if row is None:
+                    row = len(self._ids)
+                    self._rows[_id] = row
+                    self._ids.append(_id)
+                    self._metas.append(meta)
+                    self._meta_index.add(row, meta)
+                else:
+                    self._meta_index.replace(row, self._metas[row], meta)
+                    self._metas[row] = meta
+                self._mat[row] = vec
+                self._norms[row] = norm
+                written.append(row)
+            self._index_rows(written)
+            self.generation += 1
 
-    def similarity_search(self, query: List[float], k: int = 5, filter: Dict[str, str] | None = None) -> List[Tuple[VSItem, float]]:
-        results: List[Tuple[VSItem, float]] = []
-        for it in self.items.values():
-            if filter:
-                ok = True
-                for fk, fv in filter.items():
-                    if it.metadata.get(fk) != fv:
-                        ok = False
-                        break
-                if not ok:
+    def delete(self, ids: List[str]) -> int:
+        """Remove ids; the last row is moved into each freed slot to keep the matrix contiguous."""
+        with self._lock:
+            removed = 0
+            for _id in ids:
+                row = self._rows.pop(_id, None)
+                if row is None:
                     continue
-            s = _cosine(query, it.vector)
-            results.append((it, s))
-        results.sort(key=lambda t: t[1], reverse=True)
-        return results[:k]
+                assert self._mat is not None
+                self._meta_index.remove(row, self._metas[row])
+                self._unindex_row(row)
+                last = len(self._ids) - 1
+                if row != last:
+                    last_id, last_meta = self._ids[last], self._metas[last]
+                    self._mat[row] = self._mat[last]
+                    self._norms[row] = self._norms[last]
+                    self._ids[row], self._metas[row] = last_id, last_meta
+                    self._rows[last_id] = row
+                    self._meta_index.remove(last, last_meta)
+                    self._meta_index.add(row, last_meta)
+                    self._move_row(last, row)
+                self._ids.pop()
+                self._metas.pop()
+                removed += 1
+            if removed:
+                self.generation += 1
+            return removed
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, str]]) -> List[str]:
+        """Replace metadata of stored ids, keeping their vectors; returns the ids not in the store."""
+        missing: List[str] = []
+        with self._lock:
+            for _id, meta in zip(ids, metadatas):
+                row = self._rows.get(_id)
+                if row is None:
+                    missing.append(_id)
+                    continue
+                self._meta_index.replace(row, self._metas[row], meta)
+                self._metas[row] = meta
+            if len(missing) < len(ids):
+                self.generation += 1
+        return missing
+
+    def _index_rows(self, rows: List[int]) -> None:
+        """Hook for index-backed subclasses; called with rows written by upsert."""
+        return None
+
+    def _unindex_row(self, row: int) -> None:
+        """Hook for index-backed subclasses; called before a row is deleted."""
+        return None
+
+    def _move_row(self, src: int, dst: int) -> None:
+        """Hook for index-backed subclasses; called when delete moves row `src` into `dst`."""
+        return None
+
+    def _candidate_rows(self, filter: Dict[str, str] | None) -> Optional[np.ndarray]:
+        """Rows passing the exact-match metadata filter, or None when unfiltered."""
+        if not filter:
+            return None
+        rows = self._meta_index.candidates(filter)
+        if rows is None:
+            rows = [
+                row
+                for row, meta in enumerate(self._metas)
+                if all(meta.get(fk) == fv for fk, fv in filter.items())
+            ]
+        return np.sort(np.asarray(rows, dtype=np.int64))
+
+    def _search_rows(self, q: np.ndarray, filter: Dict[str, str] | None, **opts: Any) -> Optional[np.ndarray]:
+        """Rows to score for a normalized query; the base store scans every candidate."""
+        return self._candidate_rows(filter)
+
+    def _top_k(self, scores: np.ndarray, k: int) -> np.ndarray:
+        return top_k_indices(scores, k)
+
+    def similarity_search(self, query: List[float], k: int = 5, filter: Dict[str, str] | None = None) -> List[Tuple[VSItem, float]]:
+        return self._search(query, k, filter)
+
+    def _search(self, query: List[float], k: int, filter: Dict[str, str] | None, **opts: Any) -> List[Tuple[VSItem, float]]:
+        with self._lock:
+            if k <= 0 or not self._ids or self._mat is None:
+                return []
+            q = np.asarray(query, dtype=np.float32)
+            if q.ndim != 1 or q.shape[0] != self.dim:
+                rows = self._candidate_rows(filter)
+                n = len(self._ids) if rows is None else rows.size
+                scores = np.zeros(n, dtype=np.float32)
+            else:
+                q = q / (float(np.linalg.norm(q)) or 1.0)
+                rows = self._search_rows(q, filter, **opts)
+                scores = (self._mat[: len(self._ids)] if rows is None else self._mat[rows]) @ q
+            if scores.size == 0:
+                return []
+            top = self._top_k(scores, k)
+            out: List[Tuple[VSItem, float]] = []
+            for i in top:
+                row = int(i) if rows is None else int(rows[i])
+                out.append((self._item(row), float(scores[i])))
+            return out
+
+
+class IVFVectorStore(InMemoryVectorStore):
+    """
+    Approximate (IVF) variant of InMemoryVectorStore.
+    - Rows are clustered around `nlist` coarse centroids (spherical k-means) once the store
+      holds `train_threshold` rows; before that every search is exact.
+    - A query scores only the rows in its `nprobe` closest lists. Raise `nprobe` for recall,
+      lower it for latency; `nprobe >= nlist` is an exact scan.
+    - Upserts after training are assigned to their nearest centroid incrementally.
+      Call `train()` again after large growth to rebalance the lists.
+    """
+
+    def __init__(
+        self,
+        *,
+        nlist: int = 256,
+        nprobe: int = 8,
+        train_threshold: Optional[int] = None,
+        kmeans_iters: int = 10,
+        seed: int = 1337,
+        initial_capacity: int = 1024,
+    ) -> None:
+        super().__init__(initial_capacity=initial_capacity)
+        if nlist <= 0 or nprobe <= 0:
+            raise ValueError("nlist and nprobe must be > 0")
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold if train_threshold is not None else nlist * 39
+        self.kmeans_iters = kmeans_iters
+        self.seed = seed
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.full(self._capacity, -1, dtype=np.int64)
+        self._lists: List[List[int]] = []
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def _ensure_capacity(self, n: int) -> None:
+        super()._ensure_capacity(n)
+        if self._capacity > self._assign.shape[0]:
+            assign = np.full(self._capacity, -1, dtype=np.int64)
+            assign[: self._assign.shape[0]] = self._assign
+            self._assign = assign
+
+    def _nearest(self, vecs: np.ndarray) -> np.ndarray:
+        assert self._centroids is not None
+        out = np.empty(vecs.shape[0], dtype=np.int64)
+        step = 4096  # bound the (rows x nlist) score block
+        for i in range(0, vecs.shape[0], step):
+            out[i : i + step] = np.argmax(vecs[i : i + step] @ self._centroids.T, axis=1)
+        return out
+
+    def train(self) -> None:
+        """(Re)build centroids with spherical k-means and reassign every row."""
+        with self._lock:
+            n = len(self._ids)
+            if n == 0 or self._mat is None:
+                return
+            data = self._mat[:n]
+            nlist = min(self.nlist, n)
+            rng = np.random.default_rng(self.seed)
+            sample = data[rng.choice(n, size=min(n, nlist * 64), replace=False)]
+            centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+            for _ in range(self.kmeans_iters):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                counts = np.bincount(labels, minlength=nlist)
+                empty = counts == 0
+                if empty.any():
+                    sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]
+                norms = np.linalg.norm(sums, axis=1)
+                norms[norms == 0.0] = 1.0
+                centroids = sums / norms[:, None]
+            self._centroids = centroids.astype(np.float32)
+            labels = self._nearest(data)
+            self._assign[:n] = labels
+            order = np.argsort(labels, kind="stable")
+            bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+            self._lists = [order[bounds[c] : bounds[c + 1]].tolist() for c in range(nlist)]
+
+    def _index_rows(self, rows: List[int]) -> None:
+        if not self.trained:
+            if len(self._ids) >= self.train_threshold:
+                self.train()
+            return
+        assert self._mat is not None
+        labels = self._nearest(self._mat[rows])
+        for row, c in zip(rows, labels.tolist()):
+            prev = int(self._assign[row])
+            if prev == c:
+                continue
+            if prev >= 0:
+                self._lists[prev].remove(row)
+            self._lists[c].append(row)
+            self._assign[row] = c
+
+    def similarity_search(
+        self,
+        query: List[float],
+        k: int = 5,
+        filter: Dict[str, str] | None = None,
+        *,
+        nprobe: Optional[int] = None,
+    ) -> List[Tuple[VSItem, float]]:
+        """Approximate search; `nprobe` overrides the store default for this call."""
+        return self._search(query, k, filter, nprobe=nprobe or self.nprobe)
+
+    def _unindex_row(self, row: int) -> None:
+        c = int(self._assign[row])
+        if c >= 0:
+            self._lists[c].remove(row)
+            self._assign[row] = -1
+
+    def _move_row(self, src: int, dst: int) -> None:
+        c = int(self._assign[src])
+        if c >= 0:
+            lst = self._lists[c]
+            lst[lst.index(src)] = dst
+        self._assign[dst] = c
+        self._assign[src] = -1
+
+    def _search_rows(self, q: np.ndarray, filter: Dict[str, str] | None, **opts: Any) -> Optional[np.ndarray]:
+        rows = self._candidate_rows(filter)
+        nprobe = opts.get("nprobe") or self.nprobe
+        if self._centroids is None or nprobe >= len(self._lists):
+            return rows
+        # A filtered set no larger than the probed lists is cheaper to scan exactly
+        expected = nprobe * len(self._ids) / len(self._lists)
+        if rows is not None and rows.size <= expected:
+            return rows
+        cscores = self._centroids @ q
+        probe = np.argpartition(-cscores, nprobe - 1)[:nprobe]
+        probed = np.fromiter(
+            (r for c in probe.tolist() for r in self._lists[c]), dtype=np.int64
+        )
+        if rows is not None:
+            probed = np.intersect1d(probed, rows, assume_unique=True)
+        return probed
+
+
+def ann_recall_report(
+    store: IVFVectorStore,
+    queries: List[List[float]],
+    *,
+    k: int = 10,
+    filter: Dict[str, str] | None = None,
+) -> Dict[str, float]:
+    """
+    Compare IVF search against an exact scan of the same store.
+    Returns mean recall@k and mean per-query latency (ms) of both paths.
+    """
+    if not queries:
+        return {"queries": 0, "k": k, "recall_at_k": 0.0, "ann_ms": 0.0, "exact_ms": 0.0}
+    recall_sum = 0.0
+    ann_s = 0.0
+    exact_s = 0.0
+    for q in queries:
+        t0 = time.perf_counter()
+        approx = store.similarity_search(q, k=k, filter=filter)
+        t1 = time.perf_counter()
+        exact = store.similarity_search(q, k=k, filter=filter, nprobe=store.nlist)
+        t2 = time.perf_counter()
+        ann_s += t1 - t0
+        exact_s += t2 - t1
+        truth = {it.id for it, _ in exact}
+        if truth:
+            recall_sum += len(truth & {it.id for it, _ in approx}) / len(truth)
+        else:
+            recall_sum += 1.0
+    n = len(queries)
+    return {
+        "queries": n,
+        "k": k,
+        "recall_at_k": round(recall_sum / n, 4),
+        "ann_ms": round(ann_s * 1000 / n, 3),
+        "exact_ms": round(exact_s * 1000 / n, 3),
+    }
 
 
 class OpenSearchVectorStore:
@@ -61,11 +408,19 @@ class OpenSearchVectorStore:
         self.client = client
         self.index = index_name
         self.dim = dim
+        self.generation = 0
 
     def upsert(self, ids: List[str], vectors: List[List[float]], metadatas: List[Dict[str, str]]) -> None:
         for _id, vec, meta in zip(ids, vectors, metadatas):
             doc = {"vector": vec, "metadata": meta}
             self.client.index(index=self.index, id=_id, document=doc)
+        self.generation += 1
+
+    def delete(self, ids: List[str]) -> int:
+        for _id in ids:
+            self.client.delete(index=self.index, id=_id)
+        self.generation += 1
+        return len(ids)
 
     def similarity_search(self, query: List[float], k: int = 5, filter: Dict[str, str] | None = None) -> List[Tuple[VSItem, float]]:
         # Build a mockable body. Real KNN would use kNN query, but we keep generic for tests.
@@ -103,6 +458,11 @@ def vector_store_from_env(client: Optional[Any] = None, *, index: str = "rag-chu
         if client is None:
             raise ValueError("OpenSearch client must be provided when VECTOR_PROVIDER=opensearch")
         return OpenSearchVectorStore(client=client, index_name=index, dim=dim)
+    if provider == "ivf":
+        return IVFVectorStore(
+            nlist=int(os.getenv("VECTOR_IVF_NLIST", "256")),
+            nprobe=int(os.getenv("VECTOR_IVF_NPROBE", "8")),
+        )
     if provider == "milvus":
         if client is None:
             raise ValueError("Milvus client must be provided when VECTOR_PROVIDER=milvus")
@@ -120,10 +480,17 @@ class MilvusVectorStore:
         self.client = client
         self.collection = collection
         self.dim = dim
+        self.generation = 0
 
     def upsert(self, ids: List[str], vectors: List[List[float]], metadatas: List[Dict[str, str]]) -> None:
         # Delegate to injected client; tests can assert call shape
         self.client.upsert(self.collection, ids, vectors, metadatas)
+        self.generation += 1
+
+    def delete(self, ids: List[str]) -> int:
+        self.client.delete(self.collection, ids)
+        self.generation += 1
+        return len(ids)
 
     def similarity_search(self, query: List[float], k: int = 5, filter: Dict[str, str] | None = None) -> List[Tuple[VSItem, float]]:
         res = self.client.search(self.collection, query, k=k, filter=filter)
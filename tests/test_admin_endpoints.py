@@ -76,3 +76,76 @@ def test_templates_crud_and_rollback():
     # Bad set content
     resp = client.post("/v1/admin/templates/prompt", json={"content": "  "})
     assert resp.status_code == 400
+
+
+def test_profiling_hook_is_admin_gated_and_keeps_bounded_ring(monkeypatch, tmp_path):
+    import pstats
+
+    from app.api import routes
+    from app.services.profiling import ProfileRing
+
+    monkeypatch.setenv("FEATURE_ORCHESTRATOR", "1")
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(routes, "_PROFILES", ProfileRing(str(tmp_path), keep=2))
+    body = {"text": "how to water tomato"}
+
+    # Without (or with a wrong) admin token the flag is ignored
+    resp = client.post("/v1/query?profile=1", json=body, headers={"X-Admin-Token": "nope"})
+    assert resp.status_code == 200 and "X-Profile-Id" not in resp.headers
+    assert list(tmp_path.iterdir()) == []
+
+    ids = []
+    for _ in range(3):
+        resp = client.post("/v1/query", json=body, headers={"X-Admin-Token": "s3cret", "X-Profile": "1"})
+        assert resp.status_code == 200
+        assert resp.headers["X-Profile-Id"] == resp.headers["X-Trace-Id"]
+        ids.append(resp.headers["X-Profile-Id"])
+    kept = routes._PROFILES.list()
+    assert len(kept) == 2 and kept[-1].endswith(f"{ids[-1]}.prof")
+    stats = pstats.Stats(kept[-1])
+    assert any(func[2] == "run" for func in stats.stats)  # QueryOrchestrator.run was profiled
+
+
+def test_slow_query_log_captures_snapshot_and_admin_endpoint(monkeypatch, tmp_path):
+    import json
+    import time
+
+    from app.api import routes
+    from app.services.llm import FakeAdapter
+    from app.services.slowlog import SlowQueryLog
+
+    class SlowLLM(FakeAdapter):
+        def generate(self, prompt, **kwargs):
+            time.sleep(0.02)
+            return super().generate(prompt, **kwargs)
+
+        def stream_generate(self, prompt, **kwargs):
+            time.sleep(0.02)
+            yield from super().stream_generate(prompt, **kwargs)
+
+    path = tmp_path / "slow.jsonl"
+    monkeypatch.setenv("FEATURE_ORCHESTRATOR", "1")
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(routes, "_LLM", SlowLLM(response="Water at the root zone"))
+    monkeypatch.setattr(routes, "_SLOW_QUERIES", SlowQueryLog(10, path=str(path), keep=5))
+
+    body = {"text": "how to water tomato", "location": {"pincode": "400001"}}
+    trace_id = client.post("/v1/query", json=body).headers["X-Trace-Id"]
+    client.post("/v1/query/stream", json=body).read()
+
+    assert client.get("/v1/admin/slow-queries").status_code == 403
+    resp = client.get("/v1/admin/slow-queries", headers={"X-Admin-Token": "s3cret"})
+    assert resp.status_code == 200
+    stream_rec, query_rec = resp.json()["queries"][:2]
+    assert stream_rec["route"] == "/v1/query/stream"
+    assert query_rec["route"] == "/v1/query" and query_rec["trace_id"] == trace_id
+    assert query_rec["elapsed_ms"] >= 10
+    assert query_rec["retriever"] == "InMemoryRetriever" and query_rec["k"] == 4
+    assert query_rec["prompt_tokens_est"] > 0 and "retrieved" in query_rec
+    assert {"retrieval", "llm"} <= set(query_rec["stages"])
+    assert query_rec["request"]["text"] == "how to water tomato"
+    assert query_rec["request"]["location"]["pincode"] == "[REDACTED]"
+
+    lines = [json.loads(l) for l in path.read_text().splitlines()]
+    assert [l["route"] for l in lines] == ["/v1/query", "/v1/query/stream"]
+    assert lines[0]["message"] == "slow query" and lines[0]["trace_id"] == trace_id
@@ -23,3 +23,83 @@ def test_embedding_retriever_end_to_end():
     res_f = retriever.retrieve("harvesting", filters={"crop": "wheat"}, k=2)
     # With filter, even weak matches must obey metadata
     assert all(r.chunk.metadata.get("crop") == "wheat" for r in res_f)
+
+
+class CountingEmbeddings(SimpleTokenizerEmbeddings):
+    def __init__(self, dim: int = 64) -> None:
+        super().__init__(dim=dim)
+        self.embedded = 0
+
+    def embed(self, texts):
+        self.embedded += len(texts)
+        return super().embed(texts)
+
+
+def test_incremental_indexer_embeds_only_changes():
+    from app.services.retrieval import IncrementalIndexer
+
+    store = UpsertStore()
+    ingest_text(store, "Tomato needs regular irrigation and mulching.", region="mh", crop="tomato")
+    emb = CountingEmbeddings()
+    vs = InMemoryVectorStore()
+    indexer = IncrementalIndexer(store, emb, vs)
+
+    d1 = indexer.sync()
+    assert (d1.upserted, d1.removed) == (1, 0) and len(vs) == 1
+
+    ingest_text(store, "Wheat prefers cool weather and timely sowing.", region="pb", crop="wheat")
+    d2 = indexer.sync()
+    assert (d2.upserted, d2.removed) == (1, 0) and emb.embedded == 2
+    assert indexer.sync().upserted == 0 and emb.embedded == 2
+
+    # Re-chunking the same document replaces its chunks; stale vectors are deleted
+    text = "Onion storage: keep bulbs dry. " * 10
+    ingest_text(store, text, region="mh", crop="onion", max_chars=100, overlap=10)
+    assert indexer.sync().upserted == 4
+    ingest_text(store, text, region="mh", crop="onion", max_chars=400, overlap=10)
+    d3 = indexer.sync()
+    assert (d3.upserted, d3.removed) == (1, 3)
+    assert len(vs) == len(store.chunks)
+    assert set(vs.items) == set(store.chunks)
+
+
+def test_queries_stay_consistent_while_the_index_is_updated():
+    import sys
+    import threading
+
+    from app.services.retrieval import IncrementalIndexer, InMemoryRetriever
+
+    store = UpsertStore()
+    emb = SimpleTokenizerEmbeddings(dim=64)
+    vs = InMemoryVectorStore(initial_capacity=4)
+    indexer = IncrementalIndexer(store, emb, vs)
+    keyword, vector = InMemoryRetriever(store), EmbeddingRetriever(store, emb, vs)
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                for r in keyword.retrieve("tomato irrigation", filters={"crop": "tomato"}, k=3) + vector.retrieve("tomato irrigation", k=3):
+                    assert r.chunk.metadata["crop"] == "tomato"
+            except Exception as e:  # pragma: no cover (only on a race)
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    switch = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # interleave threads as often as possible
+    for t in readers:
+        t.start()
+    try:
+        for i in range(150):
+            # Re-chunking drops and moves rows in both the store indexes and the vector matrix
+            ingest_text(store, f"Tomato irrigation note {i}. " * (1 + i % 7), crop="tomato", source_url=f"http://n{i % 5}", max_chars=40, overlap=5)
+            indexer.sync()
+    finally:
+        stop.set()
+        for t in readers:
+            t.join()
+        sys.setswitchinterval(switch)
+    assert errors == []
+    assert len(vs) == len(store.chunks)
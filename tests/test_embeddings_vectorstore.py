@@ -1,3 +1,4 @@
+import pytest
 from app.services.embeddings import SimpleTokenizerEmbeddings
 from app.services.vectorstore import InMemoryVectorStore
 
@@ -23,3 +24,244 @@ def test_embeddings_and_vectorstore_similarity():
     # Filter should narrow to a specific crop
     results_filtered = vs.similarity_search(qv, k=2, filter={"crop": "wheat"})
     assert results_filtered and results_filtered[0][0].metadata["crop"] == "wheat"
+
+
+def test_vectorstore_upsert_keeps_rows_and_topk_matches_bruteforce():
+    import math
+    import random
+
+    rnd = random.Random(7)
+    vs = InMemoryVectorStore(initial_capacity=4)
+    vecs = [[rnd.uniform(-1, 1) for _ in range(8)] for _ in range(50)]
+    ids = [f"id{i}" for i in range(len(vecs))]
+    vs.upsert(ids, vecs, [{"n": str(i % 3)} for i in range(len(vecs))])
+    # Re-upserting an id overwrites in place rather than adding a row
+    vs.upsert(["id3"], [[1.0] + [0.0] * 7], [{"n": "x"}])
+    assert len(vs) == 50
+    vecs[3] = [1.0] + [0.0] * 7
+
+    def cos(a, b):
+        dot = sum(x * y for x, y in zip(a, b))
+        return dot / (math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b)))
+
+    q = [rnd.uniform(-1, 1) for _ in range(8)]
+    expected = sorted(range(len(vecs)), key=lambda i: cos(q, vecs[i]), reverse=True)[:5]
+    got = vs.similarity_search(q, k=5)
+    assert [it.id for it, _ in got] == [ids[i] for i in expected]
+    assert abs(got[0][1] - cos(q, vecs[expected[0]])) < 1e-5
+    # Raw vectors are reconstructed from the normalized rows
+    assert abs(got[0][0].vector[0] - vecs[expected[0]][0]) < 1e-5
+
+    filtered = vs.similarity_search(q, k=50, filter={"n": "x"})
+    assert [it.id for it, _ in filtered] == ["id3"]
+
+
+def test_ivf_vectorstore_recall_and_incremental_upsert():
+    import random
+
+    from app.services.vectorstore import IVFVectorStore, ann_recall_report
+
+    rnd = random.Random(11)
+    # Clustered data so coarse centroids are meaningful
+    centers = [[rnd.gauss(0, 1) for _ in range(16)] for _ in range(8)]
+    vecs = [[c + rnd.gauss(0, 0.1) for c in centers[i % 8]] for i in range(400)]
+    vs = IVFVectorStore(nlist=8, nprobe=2, train_threshold=200)
+    vs.upsert([f"a{i}" for i in range(200)], vecs[:200], [{"crop": "tomato"}] * 200)
+    assert vs.trained
+    # Inserts after training go straight into the inverted lists
+    vs.upsert([f"a{i}" for i in range(200, 400)], vecs[200:], [{"crop": "wheat"}] * 200)
+    assert sum(len(lst) for lst in vs._lists) == 400
+
+    queries = [[c + rnd.gauss(0, 0.1) for c in centers[i % 8]] for i in range(20)]
+    report = ann_recall_report(vs, queries, k=5)
+    assert report["queries"] == 20
+    assert report["recall_at_k"] >= 0.9
+
+    res = vs.similarity_search(queries[0], k=3, filter={"crop": "wheat"})
+    assert res and all(it.metadata["crop"] == "wheat" for it, _ in res)
+
+
+def test_vector_store_from_env_ivf(monkeypatch):
+    from app.services.vectorstore import IVFVectorStore, vector_store_from_env
+
+    monkeypatch.setenv("VECTOR_PROVIDER", "ivf")
+    monkeypatch.setenv("VECTOR_IVF_NPROBE", "3")
+    vs = vector_store_from_env()
+    assert isinstance(vs, IVFVectorStore) and vs.nprobe == 3
+
+
+def test_vectorstore_delete_compacts_rows_and_indexes():
+    from app.services.vectorstore import IVFVectorStore
+
+    for vs in (InMemoryVectorStore(), IVFVectorStore(nlist=2, nprobe=1, train_threshold=4)):
+        vecs = [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [0.1, 0.9], [0.7, 0.7]]
+        vs.upsert([f"id{i}" for i in range(5)], vecs, [{"crop": "a" if i % 2 else "b"} for i in range(5)])
+        assert vs.delete(["id0", "missing"]) == 1
+        assert len(vs) == 4 and "id0" not in vs.items
+        res = vs.similarity_search([1.0, 0.0], k=4, filter={"crop": "b"})
+        assert sorted(it.id for it, _ in res) == ["id2", "id4"]
+        assert vs.similarity_search([1.0, 0.0], k=1)[0][0].id == "id1"
+
+
+def test_cached_embeddings_persist_and_evict(tmp_path):
+    from app.services.embeddings import CachedEmbeddings
+
+    path = str(tmp_path / "emb.sqlite")
+    base = SimpleTokenizerEmbeddings(dim=32)
+    cache = CachedEmbeddings(base, path=path, max_entries=3)
+    texts = ["tomato mulch", "wheat sowing", "tomato mulch"]
+    first = cache.embed(texts)
+    assert first == base.embed(texts)
+    assert cache.stats()["misses"] == 2
+
+    # A new instance over the same file serves hits without calling the model
+    reopened = CachedEmbeddings(base, path=path, max_entries=3)
+    assert reopened.embed(["wheat sowing"]) == base.embed(["wheat sowing"])
+    assert (reopened.hits, reopened.misses) == (1, 0)
+
+    # LRU: "tomato mulch" is least recently used and gets evicted first
+    reopened.embed(["onion storage", "rice transplanting"])
+    assert reopened.stats()["size"] == 3
+    reopened.embed(["tomato mulch"])
+    assert reopened.misses == 3
+
+    # Different embedding dims never share entries
+    other = CachedEmbeddings(SimpleTokenizerEmbeddings(dim=16), path=path)
+    other.embed(["wheat sowing"])
+    assert other.misses == 1
+
+
+def test_cached_embeddings_batch_hit_touches(tmp_path):
+    from app.services.embeddings import CachedEmbeddings
+
+    path = str(tmp_path / "emb.sqlite")
+    cache = CachedEmbeddings(SimpleTokenizerEmbeddings(dim=32), path=path, max_entries=3, touch_batch=2)
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    cache.embed(["tomato mulch", "wheat sowing"])
+    statements.clear()
+
+    # A hit is served with one SELECT: no UPDATE, no COUNT(*), no commit
+    cache.embed(["tomato mulch"])
+    assert len(statements) == 1 and statements[0].startswith("SELECT key, vec")
+    assert cache.stats()["size"] == 2
+
+    # Touches are written in one batch once `touch_batch` keys are pending
+    cache.embed(["wheat sowing"])
+    assert sum(s.startswith("UPDATE") for s in statements) == 2 and statements[-1] == "COMMIT"
+
+    # A pending touch is written before the eviction sweep, so "wheat sowing" is the LRU entry
+    cache.embed(["tomato mulch"])
+    cache.embed(["onion storage", "rice transplanting"])
+    assert cache.stats()["size"] == 3
+    cache.embed(["tomato mulch"])
+    assert cache.misses == 4
+    cache.embed(["wheat sowing"])
+    assert cache.misses == 5
+
+    cache.flush()
+    reopened = CachedEmbeddings(SimpleTokenizerEmbeddings(dim=32), path=path, max_entries=3)
+    assert reopened.stats()["size"] == 3
+
+
+def _reference_embed(texts, dim=256, seed=1337):
+    # Original per-character implementation; vectorized output must match bit-for-bit
+    import math
+
+    out = []
+    for t in texts:
+        vec = [0.0] * dim
+        for tok in t.lower().split():
+            h = 2166136261
+            for ch in tok:
+                h ^= ord(ch)
+                h *= 16777619
+                h &= 0xFFFFFFFF
+            vec[(h ^ seed) % dim] += 1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        out.append([v / norm for v in vec])
+    return out
+
+
+def test_simple_embeddings_bit_compatible_and_sparse():
+    texts = ["Tomato tomato leaf curl", "", "गेहूं की बुवाई समय पर करें", "rain " * 40 + "grain"]
+    emb = SimpleTokenizerEmbeddings(dim=64)
+    dense = emb.embed(texts)
+    assert dense == _reference_embed(texts, dim=64)
+
+    for (idx, vals), row in zip(emb.embed_sparse(texts), dense):
+        assert idx == sorted(i for i, v in enumerate(row) if v)
+        assert vals == [row[i] for i in idx]
+
+
+def test_embedding_batcher_coalesces_concurrent_calls():
+    import threading
+
+    from app.services.embeddings import EmbeddingBatcher
+
+    class Recording(SimpleTokenizerEmbeddings):
+        def __init__(self):
+            super().__init__(dim=32)
+            self.calls = []
+
+        def embed(self, texts):
+            self.calls.append(len(texts))
+            return super().embed(texts)
+
+    inner = Recording()
+    batcher = EmbeddingBatcher(inner, max_batch=8, max_wait_ms=50)
+    queries = [f"tomato query {i}" for i in range(8)]
+    results = {}
+    barrier = threading.Barrier(len(queries))
+
+    def worker(q):
+        barrier.wait()
+        results[q] = batcher.embed([q])[0]
+
+    threads = [threading.Thread(target=worker, args=(q,)) for q in queries]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    ref = SimpleTokenizerEmbeddings(dim=32)
+    assert all(results[q] == ref.embed([q])[0] for q in queries)
+    assert len(inner.calls) < len(queries)
+    stats = batcher.stats()
+    assert stats["texts"] == 8 and stats["max_batch_size"] > 1
+
+
+def test_embedding_batcher_survives_cancelled_and_failed_callers():
+    import asyncio
+
+    from app.services.embeddings import EmbeddingBatcher
+
+    class Flaky(SimpleTokenizerEmbeddings):
+        fail = False
+
+        def embed(self, texts):
+            if self.fail:
+                raise RuntimeError("backend down")
+            return super().embed(texts)
+
+    inner = Flaky(dim=16)
+    batcher = EmbeddingBatcher(inner, max_batch=8, max_wait_ms=30)
+
+    async def cancel_one():
+        task = asyncio.create_task(batcher.aembed(["abandoned query"]))
+        await asyncio.sleep(0.005)  # queued, batch window still open
+        task.cancel()
+        kept = await batcher.aembed(["kept query"])
+        return task, kept
+
+    task, kept = asyncio.run(cancel_one())
+    assert task.cancelled()
+    assert kept == inner.embed(["kept query"])
+
+    inner.fail = True
+    with pytest.raises(RuntimeError, match="backend down"):
+        batcher.embed(["q"])
+    inner.fail = False
+    # The worker is still alive and serving
+    assert batcher.submit(["after"]).result(timeout=2) == inner.embed(["after"])
+    assert batcher.stats()["texts"] == 2
@@ -41,3 +41,52 @@ def test_ingest_text_upsert_flow():
     assert all(ch.id in store.chunks for ch in chunks)
     assert all(ch.metadata.get("region") == "maharashtra" for ch in chunks)
     assert all("chunk_index" in ch.metadata for ch in chunks)
+
+
+def test_documents_from_one_source_coexist_unless_keyed():
+    store = UpsertStore()
+    ingest_text(store, "Pune tomato advisory: spray neem oil.", region="Pune", crop="tomato", source_url="https://imd.gov.in")
+    ingest_text(store, "Nashik onion advisory: delay irrigation.", region="Nashik", crop="onion", source_url="https://imd.gov.in")
+    assert len(store.docs) == 2
+    assert sorted(ch.metadata["crop"] for ch in store.chunks.values()) == ["onion", "tomato"]
+
+
+def test_doc_key_replaces_chunks_and_metadata_changes_skip_reembedding():
+    from app.services.embeddings import SimpleTokenizerEmbeddings
+    from app.services.retrieval import IncrementalIndexer
+    from app.services.vectorstore import InMemoryVectorStore
+
+    class Counting(SimpleTokenizerEmbeddings):
+        embedded = 0
+
+        def embed(self, texts):
+            Counting.embedded += len(texts)
+            return super().embed(texts)
+
+    store = UpsertStore()
+    vs = InMemoryVectorStore()
+    indexer = IncrementalIndexer(store, Counting(dim=32), vs)
+    doc, _ = ingest_text(store, "Whitefly alert for tomato.", crop="tomato", source_url="http://bulletin/1", doc_key="whitefly")
+    indexer.sync()
+
+    # An updated bulletin under the same key replaces the old one instead of lingering beside it
+    updated, _ = ingest_text(store, "Whitefly alert lifted for tomato.", crop="tomato", source_url="http://bulletin/1", doc_key="whitefly")
+    assert updated.id == doc.id and len(store.docs) == 1
+    assert [ch.text for ch in store.chunks.values()] == ["Whitefly alert lifted for tomato."]
+    delta = indexer.sync()
+    assert (delta.upserted, delta.removed, delta.retagged) == (1, 1, 0) and Counting.embedded == 2
+
+    # Same text, new metadata: vectors are kept and only the metadata is replaced
+    ingest_text(store, "Whitefly alert lifted for tomato.", crop="brinjal", source_url="http://bulletin/1", doc_key="whitefly")
+    delta = indexer.sync()
+    assert (delta.upserted, delta.removed, delta.retagged) == (0, 0, 1) and Counting.embedded == 2
+    assert [item.metadata["crop"] for item in vs.items.values()] == ["brinjal"]
+    assert vs.similarity_search(SimpleTokenizerEmbeddings(dim=32).embed(["whitefly"])[0], k=1, filter={"crop": "brinjal"})
+
+    # Unkeyed re-ingest of identical text (only ingested_at changes) is also retagged, not re-embedded
+    ingest_text(store, "Second notice.", source_url="http://bulletin/1")
+    indexer.sync()
+    ingest_text(store, "Second notice.", source_url="http://bulletin/1")
+    delta = indexer.sync()
+    assert (delta.upserted, delta.retagged) == (0, 1) and Counting.embedded == 3
+    assert len(store.docs) == 2
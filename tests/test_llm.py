@@ -19,3 +19,131 @@ def test_granite_adapter_stub_behavior_no_key_required():
     assert out.model == "granite-13b-chat"
     assert out.text.startswith("[granite-stub:")
     assert "tomato" in out.text or len(out.text) > 0
+
+
+def test_cached_adapter_keys_on_params_ttl_and_spill(tmp_path):
+    from app.services.llm import CachedLLMAdapter
+
+    class Counting(FakeAdapter):
+        calls = 0
+
+        def generate(self, prompt, **kw):
+            Counting.calls += 1
+            return super().generate(prompt, **kw)
+
+    now = [1000.0]
+    path = str(tmp_path / "llm.sqlite")
+    llm = CachedLLMAdapter(Counting(response="sow after rain"), ttl_s=60, spill_path=path, clock=lambda: now[0])
+    first = llm.generate("p", max_tokens=32)
+    again = llm.generate("p", max_tokens=32)
+    assert not first.cached and again.cached and again.text == first.text
+    llm.generate("p", max_tokens=64)  # different params -> different key
+    assert Counting.calls == 2
+
+    # Spilled entries survive a fresh process; per-entry TTL overrides the default
+    llm2 = CachedLLMAdapter(Counting(response="sow after rain"), ttl_s=60, spill_path=path, clock=lambda: now[0])
+    assert llm2.generate("p", max_tokens=32).cached
+    llm2.generate("q", ttl_s=5)
+    now[0] += 10
+    assert not llm2.generate("q").cached
+    assert Counting.calls == 4
+
+
+def test_cached_adapter_async_paths_keep_sqlite_off_the_loop(tmp_path):
+    import asyncio
+    import threading
+
+    from app.services.llm import CachedLLMAdapter
+
+    path = str(tmp_path / "llm.sqlite")
+    llm = CachedLLMAdapter(FakeAdapter(response="sow after rain"), ttl_s=60, spill_path=path)
+    threads = []
+    llm._conn.set_trace_callback(lambda _: threads.append(threading.get_ident()))
+
+    async def run():
+        loop_thread = threading.get_ident()
+        first = await llm.agenerate("p")
+        streamed = [part async for part in llm.astream_generate("s")]
+        # A fresh adapter over the same file serves both from the spill
+        fresh = CachedLLMAdapter(FakeAdapter(response="unused"), ttl_s=60, spill_path=path)
+        fresh._conn.set_trace_callback(lambda _: threads.append(threading.get_ident()))
+        again = await fresh.agenerate("p")
+        restreamed = [part async for part in fresh.astream_generate("s")]
+        return loop_thread, first, streamed, again, restreamed
+
+    loop_thread, first, streamed, again, restreamed = asyncio.run(run())
+    assert again.cached and again.text == first.text and restreamed == ["".join(streamed)]
+    assert threads and loop_thread not in threads
+
+
+def test_cached_adapter_single_flight():
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from app.services.llm import CachedLLMAdapter
+
+    class Slow(FakeAdapter):
+        calls = 0
+
+        def generate(self, prompt, **kw):
+            Slow.calls += 1
+            time.sleep(0.05)
+            return super().generate(prompt, **kw)
+
+    llm = CachedLLMAdapter(Slow(response="ok"))
+    with ThreadPoolExecutor(8) as pool:
+        outs = list(pool.map(lambda _: llm.generate("same prompt"), range(8)))
+    assert Slow.calls == 1
+    assert {o.text for o in outs} == {"ok"}
+    assert sum(o.cached for o in outs) == 7
+
+
+def test_cached_adapter_cancelled_follower_does_not_fail_leader():
+    import asyncio
+    from app.services.llm import CachedLLMAdapter
+
+    class Slow(FakeAdapter):
+        async def agenerate(self, prompt, **kw):
+            await asyncio.sleep(0.05)
+            return self.generate(prompt, max_tokens=kw.get("max_tokens", 256))
+
+    llm = CachedLLMAdapter(Slow(response="ok"))
+
+    async def go():
+        leader = asyncio.create_task(llm.agenerate("same prompt"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(llm.agenerate("same prompt"))
+        other = asyncio.create_task(llm.agenerate("same prompt"))
+        await asyncio.sleep(0.01)
+        follower.cancel()  # e.g. client disconnect
+        return await leader, await other, follower
+
+    lead, other, follower = asyncio.run(go())
+    assert lead.text == "ok" and not lead.cached
+    assert other.text == "ok" and other.cached
+    assert follower.cancelled() and llm.coalesced == 2
+
+
+def test_cached_adapter_cancelled_leader_hands_over_to_follower():
+    import asyncio
+    from app.services.llm import CachedLLMAdapter
+
+    class Slow(FakeAdapter):
+        async def agenerate(self, prompt, **kw):
+            await asyncio.sleep(0.05)
+            return self.generate(prompt, max_tokens=kw.get("max_tokens", 256))
+
+    llm = CachedLLMAdapter(Slow(response="ok"))
+
+    async def go():
+        leader = asyncio.create_task(llm.agenerate("same prompt"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(llm.agenerate("same prompt"))
+        await asyncio.sleep(0.01)
+        leader.cancel()  # the leader's client disconnects
+        return await follower, leader
+
+    resp, leader = asyncio.run(go())
+    assert leader.cancelled()
+    assert resp.text == "ok" and not resp.cached and llm.provider_calls == 2
+    # One miss per caller: the in-flight re-check does not count again
+    assert llm.stats()["misses"] == 2
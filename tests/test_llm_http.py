@@ -0,0 +1,159 @@
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services.llm import GraniteReplicateAdapter, GraniteWatsonXAdapter
+
+
+class _StubProvider(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    fail_next = 0
+    delay_s = 0.0
+    peers = []
+    bodies = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+        type(self).peers.append(self.client_address)
+        type(self).bodies.append(body)
+        if type(self).delay_s:
+            time.sleep(type(self).delay_s)
+        if type(self).fail_next > 0:
+            type(self).fail_next -= 1
+            return self._send(503, "{}")
+        if self.path.startswith("/ml/v1/text/generation_stream"):
+            events = "".join(f"data: {json.dumps({'results': [{'generated_text': t}]})}\n\n" for t in ["Mulch ", "retains ", "moisture"])
+            return self._send(200, events, "text/event-stream")
+        if self.path.startswith("/ml/v1/text/generation"):
+            result = {"generated_text": "Mulch retains moisture", "input_token_count": 7, "generated_token_count": 3}
+            return self._send(200, json.dumps({"results": [result]}))
+        if self.path.endswith("/predictions"):
+            if body.get("stream"):
+                stream_url = f"http://127.0.0.1:{self.server.server_port}/stream/1"
+                return self._send(201, json.dumps({"status": "starting", "urls": {"stream": stream_url}}))
+            return self._send(201, json.dumps({"status": "succeeded", "output": ["Sow ", "after ", "rain"]}))
+        self._send(404, "{}")
+
+    def do_GET(self):
+        if self.path.startswith("/stream/"):
+            events = "event: output\ndata: Sow \n\nevent: output\ndata: after rain\n\nevent: done\ndata: {}\n\n"
+            return self._send(200, events, "text/event-stream")
+        self._send(404, "{}")
+
+
+@contextmanager
+def stub_server():
+    _StubProvider.fail_next = 0
+    _StubProvider.delay_s = 0.0
+    _StubProvider.peers = []
+    _StubProvider.bodies = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubProvider)
+    server.block_on_close = False  # pooled clients keep connections open
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_watsonx_async_generate_reuses_pooled_connection_and_retries():
+    with stub_server() as url:
+        llm = GraniteWatsonXAdapter(model="ibm/granite-13b-chat-v2", base_url=url, project_id="p1", max_retries=2)
+        llm.pool.backoff_s = 0.01
+
+        async def go():
+            first = await llm.agenerate("how to keep soil moist", max_tokens=16, stop=["\n\n"])
+            second = await llm.agenerate("again", max_tokens=16)
+            _StubProvider.fail_next = 1  # transient 503 is retried
+            third = await llm.agenerate("again", max_tokens=16, timeout_s=2)
+            await llm.pool.aclose()
+            return first, second, third
+
+        first, second, third = asyncio.run(go())
+        assert first.text == "Mulch retains moisture"
+        assert (first.tokens_prompt, first.tokens_output) == (7, 3)
+        assert third.text == first.text and llm.pool.retries == 1
+        body = _StubProvider.bodies[0]
+        assert body["model_id"] == "ibm/granite-13b-chat-v2" and body["project_id"] == "p1"
+        assert body["parameters"]["max_new_tokens"] == 16 and body["parameters"]["stop_sequences"] == ["\n\n"]
+        # Keep-alive: every call went over the same connection
+        assert len(set(_StubProvider.peers)) == 1
+
+
+def test_watsonx_streaming_and_sync_paths():
+    with stub_server() as url:
+        llm = GraniteWatsonXAdapter(base_url=url)
+
+        async def collect():
+            return [part async for part in llm.astream_generate("q", max_tokens=8)]
+
+        assert asyncio.run(collect()) == ["Mulch ", "retains ", "moisture"]
+
+        async def collect_stopped():
+            return "".join([part async for part in llm.astream_generate("q", stop=["s moi"])])
+
+        assert asyncio.run(collect_stopped()) == "Mulch retain"
+        assert llm.generate("q").text == "Mulch retains moisture"
+        assert "".join(llm.stream_generate("q")) == "Mulch retains moisture"
+
+
+def test_replicate_generate_and_stream():
+    with stub_server() as url:
+        llm = GraniteReplicateAdapter(model="ibm-granite/granite-3.0-8b-instruct", base_url=url)
+
+        async def go():
+            out = await llm.agenerate("when to sow", max_tokens=8, stop=["###"])
+            parts = [p async for p in llm.astream_generate("when to sow")]
+            return out, parts
+
+        out, parts = asyncio.run(go())
+        assert out.text == "Sow after rain"
+        assert _StubProvider.bodies[0]["input"]["stop_sequences"] == "###"
+        assert "".join(parts) == "Sow after rain"
+
+
+def test_exhausted_retries_surface_llm_error():
+    with stub_server() as url:
+        llm = GraniteWatsonXAdapter(base_url=url, max_retries=1)
+        llm.pool.backoff_s = 0.01
+        _StubProvider.fail_next = 5
+        with pytest.raises(RuntimeError, match="llm_error:http_503"):
+            asyncio.run(llm.agenerate("q"))
+        assert len(_StubProvider.bodies) == 2
+
+
+def test_retries_share_one_deadline():
+    with stub_server() as url:
+        llm = GraniteWatsonXAdapter(base_url=url, max_retries=5)
+        llm.pool.backoff_s = 0.01
+        _StubProvider.fail_next = 10
+        _StubProvider.delay_s = 0.3
+
+        async def timed():
+            t0 = time.perf_counter()
+            with pytest.raises(RuntimeError, match="llm_error:timeout"):
+                await llm.agenerate("q", timeout_s=0.5)
+            return time.perf_counter() - t0
+
+        # A slow 503 then a retry cut off by what is left of the 0.5s budget, not 6 full attempts
+        elapsed = asyncio.run(timed())
+        assert elapsed < 0.8
+        assert len(_StubProvider.bodies) == 2
@@ -52,3 +52,11 @@ def test_simulated_credit_error_in_stream():
         with pytest.raises(RuntimeError) as exc:
             list(llm.stream_generate("x"))
         assert "insufficient_credit" in str(exc.value)
+
+
+def test_base_granite_adapter_rejects_base_url():
+    from app.services.llm import GraniteWatsonXAdapter
+
+    with pytest.raises(ValueError):
+        GraniteAdapter(base_url="http://localhost:1")
+    assert GraniteWatsonXAdapter(base_url="http://localhost:1").pool is not None
@@ -39,3 +39,38 @@ def test_provider_variants_streaming_behave():
     out_rep = _collect(rep.stream_generate("hello", max_tokens=8))
     assert out_wx.startswith("[granite-stub:")
     assert out_rep.startswith("[granite-stub:")
+
+
+def test_stop_sequence_spanning_chunks_is_held_back():
+    from app.services.llm import limit_stream
+
+    chunks = ["Water at ", "dawn. ST", "OP ignored", " tail"]
+    assert "".join(limit_stream(chunks, stop=["STOP"])) == "Water at dawn. "
+    # A partial match that turns out not to be a stop is released intact
+    assert "".join(limit_stream(["mulch S", "TOnes"], stop=["STOP"])) == "mulch STOnes"
+    # Overlapping stops: a longer stop that began earlier wins over a shorter one found first
+    assert "".join(limit_stream(["abc", "cb"], stop=["abcc", "c"])) == ""
+    assert "".join(limit_stream(["abc", "d"], stop=["abcc", "c"])) == "ab"
+    assert "".join(limit_stream(["Rain\n\nQ", "uestion"], stop=["\n\nQuestion", "\n"])) == "Rain"
+    # Length budget applies incrementally and stops pulling from the source
+    pulled = []
+
+    def source():
+        for c in ["abcd", "efgh", "ijkl"]:
+            pulled.append(c)
+            yield c
+
+    assert "".join(limit_stream(source(), max_chars=6)) == "abcdef"
+    assert pulled == ["abcd", "efgh"]
+
+
+def test_granite_stub_streams_tokens_incrementally_with_stats():
+    llm = GraniteAdapter(model="granite-13b-chat")
+    stream = llm.stream_generate("drip irrigation saves water", max_tokens=64)
+    first = next(stream)
+    assert first == "[granite-stub:granite-13b-chat] "
+    assert stream.ttft_ms is not None and stream.tokens_per_s is None
+    rest = "".join(stream)
+    assert first + rest == llm.generate("drip irrigation saves water", max_tokens=64).text
+    stats = stream.stats()
+    assert stats["chunks"] == 5 and stats["tokens"] == 5
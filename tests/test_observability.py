@@ -5,7 +5,15 @@ from contextlib import contextmanager
 from fastapi.testclient import TestClient
 
 from app.main import app
-from app.services.observability import JsonFormatter, get_logger, set_trace_id, redact_payload
+from app.services.observability import (
+    JsonFormatter,
+    get_logger,
+    set_trace_id,
+    redact_payload,
+    span,
+    stage_timings_var,
+    start_stage_timings,
+)
 
 
 client = TestClient(app)
@@ -57,3 +65,174 @@ def test_query_includes_trace_headers():
         assert r.status_code == 200
         assert "X-Trace-Id" in r.headers
         assert "X-Elapsed-Ms" in r.headers
+
+    with env(FEATURE_ORCHESTRATOR="1"):
+        r = client.post("/v1/query/stream", json={"text": "hello"})
+        assert r.status_code == 200
+        assert "X-Trace-Id" in r.headers
+        # Headers are sent before retrieval/generation, so no elapsed time is claimed there
+        assert "X-Elapsed-Ms" not in r.headers
+
+
+def test_spans_accumulate_per_stage_and_are_noops_without_timings():
+    import contextvars
+
+    def outside():
+        with span("ignored"):
+            pass
+        return stage_timings_var.get()
+
+    assert contextvars.copy_context().run(outside) is None
+
+    def inside():
+        timings = start_stage_timings()
+        for _ in range(2):
+            with span("retrieval"):
+                with span("retrieval.keyword"):
+                    pass
+        return timings.as_dict()
+
+    stages = contextvars.copy_context().run(inside)
+    assert set(stages) == {"retrieval", "retrieval.keyword"}
+    assert stages["retrieval"] >= stages["retrieval.keyword"] >= 0
+
+
+def test_query_stage_timings_in_diagnostics_behind_flag():
+    import logging
+
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    log = get_logger("api.query")
+    log.addHandler(handler)
+    try:
+        with env(FEATURE_ORCHESTRATOR="1", DIAGNOSTICS_STAGE_TIMINGS=None):
+            r = client.post("/v1/query", json={"text": "how to water tomato"})
+    finally:
+        log.removeHandler(handler)
+    assert r.json()["diagnostics"]["stages"] is None
+    assert {"retrieval", "prompt", "llm"} <= set(records[-1].extra["stages"])
+
+    with env(FEATURE_ORCHESTRATOR="1", DIAGNOSTICS_STAGE_TIMINGS="1"):
+        r = client.post("/v1/query", json={"text": "how to water tomato"})
+        stages = r.json()["diagnostics"]["stages"]
+        assert {"retrieval", "retrieval.keyword", "prompt", "llm"} <= set(stages)
+        assert all(ms >= 0 for ms in stages.values())
+
+
+def test_metrics_registry_renders_prometheus_text():
+    from app.services.metrics import MetricsRegistry
+
+    reg = MetricsRegistry()
+    hits = reg.counter("demo_total", "Demo counter", ["route"])
+    hits.inc(route='/v1/"q"')
+    hits.inc(2, route='/v1/"q"')
+    lat = reg.histogram("demo_seconds", "Demo latency", buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        lat.observe(v)
+    text = reg.render()
+    assert '# TYPE demo_total counter' in text
+    assert 'demo_total{route="/v1/\\"q\\""} 3' in text
+    assert 'demo_seconds_bucket{le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{le="1"} 2' in text
+    assert 'demo_seconds_bucket{le="+Inf"} 3' in text
+    assert "demo_seconds_count 3" in text
+    assert reg.counter("demo_total", "Demo counter", ["route"]) is hits
+
+
+def test_metrics_multiprocess_merge(tmp_path):
+    from app.services.metrics import MetricsRegistry
+
+    def worker():
+        reg = MetricsRegistry(multiproc_dir=str(tmp_path))
+        reg.counter("jobs_total", "Jobs").inc(2)
+        reg.gauge("inflight", "In flight").set(3)
+        reg.histogram("lat_seconds", "Latency", buckets=(1.0,)).observe(0.5)
+        return reg
+
+    other, this = worker(), worker()
+    other.flush()
+    # Pretend the snapshot came from another worker that has since exited
+    dead_pid = 2**22 + 12345
+    os.replace(tmp_path / f"metrics_{os.getpid()}.json", tmp_path / f"metrics_{dead_pid}.json")
+
+    text = this.render()
+    assert "jobs_total 4" in text
+    assert 'lat_seconds_bucket{le="+Inf"} 2' in text
+    assert "inflight 3" in text  # the exited worker's gauge is not summed
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted([f"metrics_{dead_pid}.json", f"metrics_{os.getpid()}.json"])
+
+
+def test_metrics_endpoint_exposes_route_latency_and_stages():
+    with env(FEATURE_ORCHESTRATOR="1"):
+        client.post("/v1/query", json={"text": "how to water tomato"})
+    r = client.get("/v1/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/v1/query",status="200",le="+Inf"}' in r.text
+    assert 'orchestrator_stage_duration_seconds_count{stage="retrieval"}' in r.text
+    assert 'retrieval_candidates_count{pool="retrieved"}' in r.text
+    assert "# TYPE cache_hits_total counter" in r.text
+
+
+def test_queue_handler_formats_off_thread_with_trace_id_and_counts_drops():
+    import io
+    import logging
+    import logging.handlers
+    import queue
+
+    from app.services.observability import DroppingQueueHandler
+
+    out = io.StringIO()
+    writer = logging.StreamHandler(out)
+    writer.setFormatter(JsonFormatter())
+    q = queue.Queue(maxsize=2)
+    handler = DroppingQueueHandler(q)
+    log = logging.getLogger("test.queue.handoff")
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+    set_trace_id("tid-queued")
+    log.info("first", extra={"extra": {"n": 1}})
+    log.info("second")
+    log.info("dropped")  # queue full, nothing is draining it yet
+    assert handler.dropped == 1
+
+    set_trace_id("tid-later")  # the writer must not pick up the current context
+    listener = logging.handlers.QueueListener(q, writer)
+    listener.start()
+    listener.stop()
+    lines = [json.loads(l) for l in out.getvalue().splitlines()]
+    assert [l["message"] for l in lines] == ["first", "second"]
+    assert all(l["trace_id"] == "tid-queued" for l in lines)
+    assert lines[0]["n"] == 1
+
+
+def test_get_logger_async_mode_and_sampling():
+    import logging
+
+    from app.services.observability import DroppingQueueHandler, SamplingFilter, flush_logs
+
+    with env(LOG_ASYNC="1", LOG_SAMPLE_RATES="test.sampled=0.0, other=0.5"):
+        log = get_logger("test.sampled")
+    assert isinstance(log.handlers[0], DroppingQueueHandler)
+    assert any(isinstance(f, SamplingFilter) for f in log.filters)
+
+    seen = []
+    probe = logging.Handler()
+    probe.emit = seen.append
+    log.addHandler(probe)
+    try:
+        set_trace_id("tid-sampled")
+        log.info("routine success")
+        log.error("failure")
+        flush_logs()
+    finally:
+        log.removeHandler(probe)
+    assert [r.getMessage() for r in seen] == ["failure"]
+
+    keep = SamplingFilter(0.5)
+    record = logging.LogRecord("x", logging.INFO, __file__, 1, "m", None, None)
+    decisions = {keep.filter(record) for _ in range(5)}
+    assert len(decisions) == 1  # same trace id, same decision
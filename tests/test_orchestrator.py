@@ -28,3 +28,180 @@ def test_orchestrator_flow_builds_prompt_and_returns_answer():
     assert "doc_id" in out.citations[0]
     assert "chunk_index" in out.citations[0]
     assert "User Question:" in out.prompt
+
+
+def test_semantic_answer_cache_reuses_near_duplicates_within_scope():
+    from app.services.caching import SemanticCache
+    from app.services.embeddings import SimpleTokenizerEmbeddings
+
+    class CountingAdapter(FakeAdapter):
+        calls = 0
+
+        def generate(self, prompt, **kw):
+            CountingAdapter.calls += 1
+            return super().generate(prompt, **kw)
+
+    now = [0.0]
+    store = UpsertStore()
+    ingest_text(store, "Tomato irrigation: mulch helps retain soil moisture.", region="maharashtra", crop="tomato", max_chars=200)
+    cache = SemanticCache(SimpleTokenizerEmbeddings(dim=256), threshold=0.85, clock=lambda: now[0])
+    orch = QueryOrchestrator(InMemoryRetriever(store), CountingAdapter(response="mulch the beds"), answer_cache=cache)
+
+    first = orch.run("best irrigation for tomato", language="en", filters={"crop": "tomato"})
+    again = orch.run("best irrigation for tomato please", language="en", filters={"crop": "tomato"})
+    assert CountingAdapter.calls == 1
+    assert first.cache is None and again.cache == "semantic"
+    assert again.answer == first.answer
+
+    # Safety checks apply to the incoming question, not the cached one
+    unsafe = orch.run("best irrigation for tomato acid", language="en", filters={"crop": "tomato"})
+    assert unsafe.cache == "semantic" and unsafe.answer.startswith("WARNING")
+
+    # Different crop scope misses
+    orch.run("best irrigation for tomato", language="en", filters={"crop": "onion"})
+    assert CountingAdapter.calls == 2
+
+    # General agronomy answers live for a day
+    now[0] += 86401
+    orch.run("best irrigation for tomato", language="en", filters={"crop": "tomato"})
+    assert CountingAdapter.calls == 3
+
+
+def test_async_semantic_cache_embeds_off_the_event_loop():
+    import asyncio
+    import threading
+
+    from app.services.caching import SemanticCache
+    from app.services.embeddings import SimpleTokenizerEmbeddings
+
+    class ThreadRecordingEmbeddings(SimpleTokenizerEmbeddings):
+        threads = []
+
+        def embed(self, texts):
+            ThreadRecordingEmbeddings.threads.append(threading.get_ident())
+            return super().embed(texts)
+
+    store = UpsertStore()
+    ingest_text(store, "Tomato irrigation: mulch helps retain soil moisture.", crop="tomato", max_chars=200)
+    cache = SemanticCache(ThreadRecordingEmbeddings(dim=256), threshold=0.85)
+    orch = QueryOrchestrator(InMemoryRetriever(store), FakeAdapter(response="mulch the beds"), answer_cache=cache)
+
+    async def ask():
+        loop_thread = threading.get_ident()
+        first = await orch.arun("best irrigation for tomato", language="en", filters={"crop": "tomato"})
+        again = await orch.arun("best irrigation for tomato please", language="en", filters={"crop": "tomato"})
+        return loop_thread, first, again
+
+    loop_thread, first, again = asyncio.run(ask())
+    assert first.cache is None and again.cache == "semantic"
+    assert ThreadRecordingEmbeddings.threads and loop_thread not in ThreadRecordingEmbeddings.threads
+
+
+def test_semantic_cache_buffer_grows_and_drops_rows():
+    from app.services.caching import SemanticCache
+    from app.services.embeddings import SimpleTokenizerEmbeddings
+
+    cache = SemanticCache(SimpleTokenizerEmbeddings(dim=1024), threshold=0.99, max_entries=30)
+    questions = [f"question number {i} about crop{i}" for i in range(40)]
+    for i, q in enumerate(questions):
+        cache.set(q, "scope", i)
+    assert len(cache) == 30
+    # The oldest entries were evicted; the rest are still found at their own rows
+    assert cache.get(questions[5], "scope") is None
+    assert all(cache.get(q, "scope") == i for i, q in enumerate(questions) if i >= 10)
+
+
+def test_async_run_fans_out_stages_and_drops_timed_out_signals():
+    import asyncio
+    import time
+
+    store = UpsertStore()
+    ingest_text(store, "Tomato irrigation: mulch helps retain soil moisture.", region="maharashtra", crop="tomato", max_chars=200)
+
+    class SlowRetriever(InMemoryRetriever):
+        def retrieve(self, *a, **kw):
+            time.sleep(0.2)
+            return super().retrieve(*a, **kw)
+
+    class SlowWeather:
+        def __init__(self, delay):
+            self.delay = delay
+
+        def current_and_forecast(self, location):
+            time.sleep(self.delay)
+            return {"location": location, "forecast": "rain tomorrow"}
+
+    llm = FakeAdapter(response="mulch the beds")
+    orch = QueryOrchestrator(SlowRetriever(store), llm)
+    orch._weather = SlowWeather(0.2)
+    t0 = time.perf_counter()
+    out = asyncio.run(orch.arun("tomato irrigation", language="en", filters={"region": "maharashtra"}))
+    assert time.perf_counter() - t0 < 0.35  # weather and retrieval overlap
+    assert out.warnings == [] and "rain tomorrow" in out.prompt and out.citations
+
+    orch = QueryOrchestrator(SlowRetriever(store), llm, stage_timeouts={"weather": 0.05})
+    orch._weather = SlowWeather(0.6)
+
+    async def timed():
+        # Timed inside the loop: asyncio.run() itself waits for the abandoned worker thread on exit
+        t0 = time.perf_counter()
+        out = await orch.arun("tomato irrigation", language="en", filters={"region": "maharashtra"})
+        return out, time.perf_counter() - t0
+
+    out, elapsed = asyncio.run(timed())
+    assert elapsed < 0.45
+    assert out.warnings == ["stage_timeout:weather"]
+    assert "rain tomorrow" not in out.prompt and out.answer == "mulch the beds" and out.citations
+
+
+def test_deadline_degrades_stages_as_budget_runs_down():
+    from app.services.budget import Deadline
+
+    store = UpsertStore()
+    for i in range(6):
+        ingest_text(store, f"Tomato irrigation tip {i}: mulch and drip lines.", region="maharashtra", crop="tomato", source_url=f"http://tips/{i}", max_chars=200)
+    llm = FakeAdapter(response=" ".join(["word"] * 200))
+    orch = QueryOrchestrator(InMemoryRetriever(store), llm)
+
+    plenty = Deadline(3.0, clock=lambda: 0.0)
+    out = orch.run("tomato irrigation", language="en", k=4, max_generate_tokens=100, deadline=plenty)
+    assert out.degradations == [] and len(out.citations) == 4
+
+    now = [0.0]
+    late = Deadline(3.0, clock=lambda: now[0])
+    now[0] = 2.0  # a third of the budget left when the request reaches the orchestrator
+    out = orch.run("tomato irrigation", language="en", k=4, max_generate_tokens=100, deadline=late)
+    assert out.degradations == ["reduced_k", "reduced_context", "reduced_generate_tokens"]
+    assert len(out.citations) == 2
+    assert len(out.answer) <= 50 * 4
+
+
+def test_hung_connectors_do_not_starve_the_default_executor():
+    import asyncio
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from app.services import orchestrator as orch_mod
+
+    store = UpsertStore()
+    ingest_text(store, "Tomato irrigation: mulch the beds.", region="maharashtra", crop="tomato", source_url="http://advisory")
+    release = threading.Event()
+
+    class HungWeather:
+        def current_and_forecast(self, location):
+            release.wait(5)
+            return {"forecast": "late"}
+
+    orch = QueryOrchestrator(InMemoryRetriever(store), FakeAdapter(response="mulch"), stage_timeouts={"weather": 0.02})
+    orch._weather = HungWeather()
+
+    async def go():
+        # A tiny default executor: abandoned connector calls would fill it and stall retrieval
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+        outs = [await orch.arun("tomato irrigation", language="en", filters={"region": "maharashtra"}) for _ in range(orch_mod._CONNECTOR_WORKERS + 1)]
+        release.set()
+        return outs
+
+    outs = asyncio.run(go())
+    assert all(out.citations and out.answer == "mulch" for out in outs)
+    assert outs[0].warnings == ["stage_timeout:weather"]
+    assert outs[-1].warnings == ["stage_saturated:weather"]
@@ -1,3 +1,5 @@
+import asyncio
+import json
 import os
 from contextlib import contextmanager
 
@@ -56,3 +58,58 @@ def test_safety_intercept_prefixes_warning():
     orch = QueryOrchestrator(retriever, llm)
     out = orch.run("Can I mix pesticide with bleach for better results?", language="en")
     assert out.answer.startswith("WARNING:")
+
+
+def _parse_sse(body: str):
+    events = []
+    for frame in body.split("\n\n"):
+        lines = [l for l in frame.splitlines() if l and not l.startswith(":")]
+        if lines:
+            fields = dict(l.split(": ", 1) for l in lines)
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_sse_endpoint_emits_typed_events_in_order(monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    monkeypatch.setenv("FEATURE_ORCHESTRATOR", "1")
+    client = TestClient(app)
+    with client.stream("POST", "/v1/query/sse", json={"text": "Is kerosene safe to mix pesticide?"}) as resp:
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        events = _parse_sse(resp.read().decode())
+    kinds = [e for e, _ in events]
+    assert kinds[0] == "citations" and kinds[-1] == "done"
+    assert set(kinds[1:-1]) == {"token"}
+    assert events[1][1]["text"].startswith("WARNING:")
+    assert "latency_ms" in events[-1][1]["diagnostics"]
+
+
+def test_sse_frames_heartbeat_and_cancels_producer_on_disconnect():
+    from app.api.sse import HEARTBEAT, sse_frames
+
+    state = {"closed": False, "disconnected": False}
+
+    async def slow_tokens():
+        try:
+            yield "token", {"text": "a"}
+            await asyncio.sleep(10)
+            yield "token", {"text": "never"}
+        finally:
+            state["closed"] = True
+
+    async def is_disconnected():
+        return state["disconnected"]
+
+    async def go():
+        frames = sse_frames(slow_tokens(), heartbeat_s=0.01, is_disconnected=is_disconnected)
+        got = [await frames.__anext__(), await frames.__anext__()]
+        state["disconnected"] = True
+        got += [f async for f in frames]
+        return got
+
+    frames = asyncio.run(go())
+    assert frames[0].startswith("event: token") and frames[1] == HEARTBEAT
+    assert state["closed"], "upstream stream must be closed once the client goes away"
@@ -31,20 +31,115 @@ def _reload_app():
 
 
 def test_rate_limit_headers_and_429():
-    with env(RATE_LIMIT_ENABLED="1", RATE_LIMIT_WINDOW_SEC="5", RATE_LIMIT_MAX_REQUESTS="2"):
-        app = _reload_app()
-        client = TestClient(app)
-        r1 = client.get("/v1/healthz")
-        r2 = client.get("/v1/healthz")
-        r3 = client.get("/v1/healthz")
-        assert r1.status_code == 200
-        assert r2.status_code == 200
-        assert r3.status_code == 429
-        # Headers present
-        for r in (r1, r2, r3):
-            assert "X-RateLimit-Limit" in r.headers
-            assert "X-RateLimit-Remaining" in r.headers
-            assert "X-RateLimit-Reset" in r.headers
+    try:
+        with env(RATE_LIMIT_ENABLED="1", RATE_LIMIT_WINDOW_SEC="5", RATE_LIMIT_MAX_REQUESTS="2"):
+            app = _reload_app()
+            client = TestClient(app)
+            r1 = client.get("/v1/healthz")
+            r2 = client.get("/v1/healthz")
+            r3 = client.get("/v1/healthz")
+            assert r1.status_code == 200
+            assert r2.status_code == 200
+            assert r3.status_code == 429
+            # Headers present
+            for r in (r1, r2, r3):
+                assert "X-RateLimit-Limit" in r.headers
+                assert "X-RateLimit-Remaining" in r.headers
+                assert "X-RateLimit-Reset" in r.headers
+            assert [r.headers["X-RateLimit-Remaining"] for r in (r1, r2, r3)] == ["1", "0", "0"]
+            assert int(r3.headers["Retry-After"]) >= 1
+    finally:
+        # Limiter config is read once at import: restore the default app for later tests
+        _reload_app()
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_gcra_refills_gradually_and_evicts_idle_keys():
+    from app.services.ratelimit import RateLimitConfig, RateLimiter
+
+    clock = _Clock()
+    limiter = RateLimiter(RateLimitConfig(enabled=True, max_requests=4, window_s=8.0), clock=clock)
+    assert [limiter.check("a").allowed for _ in range(5)] == [True, True, True, True, False]
+    clock.now += 2.0  # one emission interval: exactly one more request
+    assert limiter.check("a").allowed and not limiter.check("a").allowed
+    limiter.check("b")
+    assert len(limiter) == 2
+    clock.now += 9.0  # both buckets full again: idle keys are dropped on the next check
+    decision = limiter.check("c")
+    assert decision.allowed and decision.remaining == 3
+    assert len(limiter) == 1
+
+    bounded = RateLimiter(RateLimitConfig(enabled=True, max_keys=2), clock=clock)
+    for key in ("k1", "k2", "k3", "k4"):
+        bounded.check(key)
+    assert len(bounded) == 2 and bounded.evictions == 2
+
+
+def test_rate_limit_keys_and_hot_reload(tmp_path):
+    import json
+    from types import SimpleNamespace
+
+    import pytest
+
+    from app.services.ratelimit import KEY_FUNCS, RateLimitConfig, RateLimiter
+
+    def request(**headers):
+        return SimpleNamespace(client=SimpleNamespace(host="10.0.0.1"), headers=headers)
+
+    assert KEY_FUNCS["ip"](request()) == "10.0.0.1"
+    assert KEY_FUNCS["api_key"](request()) == "ip:10.0.0.1"
+    by_key = KEY_FUNCS["api_key"](request(**{"X-API-Key": "secret"}))
+    assert by_key.startswith("key:") and "secret" not in by_key
+    assert KEY_FUNCS["phone"](request(**{"X-Phone-Number": "+91 98765 43210"})) == KEY_FUNCS["phone"](
+        request(**{"X-Phone-Number": "919876543210"})
+    )
+    with pytest.raises(ValueError):
+        RateLimitConfig(key="cookie")
+
+    path = tmp_path / "ratelimit.json"
+    clock = _Clock()
+    limiter = RateLimiter(RateLimitConfig(enabled=False), config_path=str(path), reload_interval_s=1.0, clock=clock)
+    assert not limiter.config.enabled  # no file yet: env config
+    path.write_text(json.dumps({"enabled": True, "max_requests": 1, "window_sec": 10, "key": "api_key"}))
+    assert not limiter.maybe_reload()  # checked at most once per interval
+    clock.now += 1.0
+    assert limiter.maybe_reload()
+    assert limiter.config.enabled and limiter.config.max_requests == 1 and limiter.config.key == "api_key"
+    assert limiter.key_for(request()) == "ip:10.0.0.1"
+
+    path.write_text("{not json")
+    os.utime(path, (1, 1))
+    clock.now += 1.0
+    assert not limiter.maybe_reload() and limiter.config.max_requests == 1  # last good config kept
+
+
+def test_rotating_header_keys_are_capped_per_ip():
+    from types import SimpleNamespace
+
+    from app.services.ratelimit import RateLimitConfig, RateLimiter
+
+    def request(ip, key=None):
+        return SimpleNamespace(client=SimpleNamespace(host=ip), headers={"X-API-Key": key} if key else {})
+
+    clock = _Clock()
+    limiter = RateLimiter(RateLimitConfig(enabled=True, max_requests=2, window_s=10.0, key="api_key", ip_max_requests=5), clock=clock)
+    # Each header value gets its own bucket...
+    assert [limiter.check_request(request("10.0.0.1", "a")).allowed for _ in range(3)] == [True, True, False]
+    # ...but a fresh value per request stops at the IP cap, without adding keys past it
+    rotating = [limiter.check_request(request("10.0.0.1", f"k{i}")) for i in range(5)]
+    assert [d.allowed for d in rotating] == [True, True, False, False, False]
+    assert rotating[-1].limit == 5 and len(limiter) == 4  # ipcap bucket + "a", "k0", "k1"
+    # Other IPs and header-less callers (already keyed by IP) are unaffected
+    assert limiter.check_request(request("10.0.0.2", "k9")).allowed
+    assert limiter.check_request(request("10.0.0.3")).allowed
+    assert RateLimitConfig(max_requests=6).ip_cap == 60
 
 
 def test_token_budget_affects_output_tokens():
@@ -18,3 +18,42 @@ def test_inmemory_retriever_keyword_scoring_and_filters():
     # Query with non-matching region should produce none
     res2 = r.retrieve("tomato pests", filters={"region": "punjab"}, k=3)
     assert len(res2) == 0 or all("tomato" not in rr.chunk.text.lower() for rr in res2)
+
+
+def test_metadata_index_serves_filters_and_region_tag():
+    store = UpsertStore()
+    ingest_text(store, "Tomato leaf curl: remove infected plants.", region="Maharashtra", crop="tomato", source_url="http://a")
+    ingest_text(store, "Tomato blight: spray copper fungicide.", region="punjab", crop="tomato", source_url="http://b")
+    ingest_text(store, "Wheat rust: use resistant varieties.", region="punjab", crop="wheat", source_url="http://c")
+
+    ids = store.meta_index.candidates({"region": "punjab", "crop": "tomato"})
+    assert ids is not None and len(ids) == 1
+    assert store.chunks[ids[0]].text.startswith("Tomato blight")
+
+    r = InMemoryRetriever(store)
+    res = r.retrieve("tomato", filters={"region_tag": "MAHARASHTRA"}, k=5)
+    assert [rr.chunk.metadata["region"] for rr in res] == ["maharashtra"]
+    assert r.retrieve("tomato", filters={"crop": "onion"}, k=5) == []
+
+
+def test_bm25_matches_whole_tokens_and_ranks_by_relevance():
+    from app.services.indexes import BM25Index
+
+    store = UpsertStore()
+    ingest_text(store, "Store grain in dry bins after harvest.", region="mh", crop="wheat", source_url="http://g")
+    ingest_text(store, "Heavy rain expected; delay spraying until rain stops.", region="mh", crop="tomato", source_url="http://r")
+    ingest_text(store, "Light rain is good for sowing.", region="mh", crop="wheat", source_url="http://s")
+
+    r = InMemoryRetriever(store)
+    res = r.retrieve("rain", k=5)
+    assert len(res) == 2
+    assert all("grain" not in rr.chunk.text for rr in res)
+    assert res[0].chunk.metadata["crop"] == "tomato"  # higher term frequency
+    assert res[0].score > res[1].score > 0
+
+    # Replacing a key drops its old postings
+    idx: BM25Index[str] = BM25Index()
+    idx.add("a", "rain rain")
+    idx.add("a", "sunny day")
+    assert idx.search(["rain"]) == []
+    assert [key for key, _ in idx.search(["sunny"])] == ["a"]
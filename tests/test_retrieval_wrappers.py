@@ -31,3 +31,258 @@ def test_reranker_boosts_authority():
     rr = RerankerWrapper(base, authority_boost=100.0)
     res = rr.retrieve("certified seeds", k=1)
     assert res and res[0].chunk.metadata.get("authority") == "ICAR"
+
+
+class _StaticRetriever:
+    def __init__(self, results, delay: float = 0.0, fail: bool = False):
+        self.results = results
+        self.delay = delay
+        self.fail = fail
+
+    def retrieve(self, query, *, filters=None, k=5):
+        import time
+
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("branch down")
+        return self.results[:k]
+
+
+def test_hybrid_rrf_dedupes_and_drops_slow_branch():
+    from app.services.retrieval import HybridRetriever, RetrievalResult
+
+    store = UpsertStore()
+    _, a = ingest_text(store, "Imidacloprid dose for whitefly on tomato.", source_url="http://a")
+    _, b = ingest_text(store, "Leaves curling and yellowing on tomato plants.", source_url="http://b")
+    _, c = ingest_text(store, "Neem oil spray for sucking pests.", source_url="http://c")
+    kw = [RetrievalResult(a[0], 9.0), RetrievalResult(c[0], 2.0)]
+    vec = [RetrievalResult(b[0], 0.9), RetrievalResult(a[0], 0.8)]
+
+    hy = HybridRetriever(_StaticRetriever(kw), _StaticRetriever(vec))
+    res, dropped = hy.retrieve_with_drops("whitefly tomato", k=3)
+    # Chunk in both lists wins and appears once
+    assert [r.chunk.id for r in res][0] == a[0].id
+    assert len({r.chunk.id for r in res}) == len(res) == 3
+    assert dropped == []
+
+    slow = HybridRetriever(_StaticRetriever(kw), _StaticRetriever(vec, delay=0.5), vector_timeout_ms=50)
+    res, dropped = slow.retrieve_with_drops("whitefly tomato", k=3)
+    assert dropped == ["vector"]
+    assert [r.chunk.id for r in res] == [a[0].id, c[0].id]
+
+    failing = HybridRetriever(_StaticRetriever(kw, fail=True), _StaticRetriever(vec), fusion="weighted")
+    res, dropped = failing.retrieve_with_drops("whitefly tomato", k=2)
+    assert dropped == ["keyword"]
+    assert [r.chunk.id for r in res] == [b[0].id, a[0].id]
+
+    # retrieve() reports drops on the request's Deadline, so the partial result is not reused
+    from app.services.budget import Deadline
+
+    deadline = Deadline(10.0)
+    assert [r.chunk.id for r in failing.retrieve("whitefly tomato", k=2, deadline=deadline)] == [b[0].id, a[0].id]
+    assert deadline.degradations == ["dropped_branch:keyword"]
+
+
+def test_hybrid_runs_branches_inline_when_pool_is_held_by_timed_out_branches():
+    import time
+
+    from app.services.retrieval import _BRANCH_WORKERS, HybridRetriever, RetrievalResult
+
+    store = UpsertStore()
+    _, a = ingest_text(store, "Imidacloprid dose for whitefly on tomato.", source_url="http://a")
+    results = [RetrievalResult(a[0], 1.0)]
+    stuck = _StaticRetriever(results, delay=0.3)
+    time.sleep(0.5)  # branches abandoned by earlier tests release their workers
+    # Every worker is left running an abandoned branch
+    for _ in range(_BRANCH_WORKERS // 2):
+        _, dropped = HybridRetriever(stuck, stuck, keyword_timeout_ms=1, vector_timeout_ms=1).retrieve_with_drops("q", k=1)
+        assert dropped == ["keyword", "vector"]
+
+    t0 = time.perf_counter()
+    res, dropped = HybridRetriever(_StaticRetriever(results), _StaticRetriever(results)).retrieve_with_drops("q", k=1)
+    assert time.perf_counter() - t0 < 0.15  # not queued behind the stuck workers
+    assert dropped == [] and [r.chunk.id for r in res] == [a[0].id]
+    time.sleep(0.3)  # let the abandoned branches finish before other tests use the pool
+
+
+def test_scoring_pipeline_matches_stacked_wrappers():
+    from app.services.retrieval import AuthorityBoost, FreshnessDecay, ScoringPipeline
+
+    store = UpsertStore()
+    now = datetime.now(UTC)
+    for i in range(6):
+        ingest_text(
+            store,
+            f"Drip irrigation schedule for tomato, bulletin {i}." + " tomato" * (i % 3),
+            region="mh",
+            crop="tomato",
+            authority="ICAR" if i % 2 else None,
+            source_url=f"http://b{i}",
+            effective_date=now - timedelta(days=3 * i),
+        )
+    base = InMemoryRetriever(store)
+    stacked = RerankerWrapper(FreshnessWeightedRetriever(base, decay_lambda_per_day=0.2), authority_boost=0.3)
+    fused = ScoringPipeline(base, [FreshnessDecay(0.2), AuthorityBoost(0.3)])
+    assert fused.candidate_multiplier == 8
+
+    a = stacked.retrieve("tomato irrigation", k=3)
+    b = fused.retrieve("tomato irrigation", k=3)
+    assert [r.chunk.id for r in a] == [r.chunk.id for r in b]
+    assert all(abs(x.score - y.score) < 1e-9 for x, y in zip(a, b))
+
+
+def test_scoring_pipeline_keeps_intermediate_cut_of_stacked_wrappers():
+    from app.services.retrieval import AuthorityBoost, FreshnessDecay, RetrievalResult, ScoringPipeline
+
+    store = UpsertStore()
+    now = datetime.now(UTC)
+    _, fresh_a = ingest_text(store, "Mulch tomato beds.", source_url="http://a", effective_date=now)
+    _, fresh_b = ingest_text(store, "Stake tomato plants.", source_url="http://b", effective_date=now)
+    _, old = ingest_text(store, "Tomato advisory.", authority="ICAR", source_url="http://c", effective_date=now - timedelta(days=5))
+    base = _StaticRetriever([RetrievalResult(fresh_a[0], 0.4), RetrievalResult(fresh_b[0], 0.35), RetrievalResult(old[0], 0.5)])
+
+    # Freshness keeps the top k*2 before the boost, so the decayed ICAR chunk never reaches it
+    stacked = RerankerWrapper(FreshnessWeightedRetriever(base, decay_lambda_per_day=0.2), authority_boost=0.9)
+    fused = ScoringPipeline(base, [FreshnessDecay(0.2), AuthorityBoost(0.9)])
+    a = stacked.retrieve("tomato", k=1)
+    b = fused.retrieve("tomato", k=1)
+    assert [r.chunk.id for r in a] == [r.chunk.id for r in b] == [fresh_a[0].id]
+    assert abs(a[0].score - b[0].score) < 1e-9
+
+
+def test_freshness_uses_store_timestamps_and_date_range_filters():
+    from app.services.embeddings import SimpleTokenizerEmbeddings
+    from app.services.retrieval import EmbeddingRetriever, FreshnessDecay, ScoringPipeline, index_store_chunks
+    from app.services.vectorstore import InMemoryVectorStore
+
+    store = UpsertStore()
+    now = datetime.now(UTC)
+    _, old = ingest_text(store, "Whitefly control on tomato.", source_url="http://old", effective_date=now - timedelta(days=30))
+    _, new = ingest_text(store, "Whitefly control on tomato plants.", source_url="http://new", effective_date=now - timedelta(days=2))
+    assert abs(store.time_index.get(old[0].id) - (now - timedelta(days=30)).timestamp()) < 1e-3
+
+    base = InMemoryRetriever(store)
+    exact = ScoringPipeline(base, [FreshnessDecay(0.1, store=store)]).retrieve("whitefly tomato", k=2)
+    bucketed = ScoringPipeline(base, [FreshnessDecay(0.1, store=store, bucket_days=1.0)]).retrieve("whitefly tomato", k=2)
+    assert [r.chunk.id for r in exact] == [r.chunk.id for r in bucketed] == [new[0].id, old[0].id]
+    # Day buckets floor the age, so bucketed factors are never smaller
+    assert all(b.score >= e.score for e, b in zip(exact, bucketed))
+
+    recent = base.retrieve("whitefly", filters={"ingested_within_days": "14"}, k=5)
+    assert [r.chunk.id for r in recent] == [new[0].id]
+    window = base.retrieve("whitefly", filters={"ingested_before": (now - timedelta(days=14)).isoformat()}, k=5)
+    assert [r.chunk.id for r in window] == [old[0].id]
+
+    emb = SimpleTokenizerEmbeddings(dim=64)
+    vs = InMemoryVectorStore()
+    index_store_chunks(store, emb, vs)
+    er = EmbeddingRetriever(store, emb, vs)
+    assert [r.chunk.id for r in er.retrieve("whitefly", filters={"ingested_within_days": "14"}, k=5)] == [new[0].id]
+
+
+def test_date_filters_read_naive_times_as_utc_and_return_k_results():
+    from app.services.embeddings import SimpleTokenizerEmbeddings
+    from app.services.ingestion import ingested_epoch
+    from app.services.retrieval import EmbeddingRetriever, index_store_chunks, split_date_filters
+    from app.services.vectorstore import InMemoryVectorStore
+
+    # A naive ingested_at and a naive filter bound mean the same instant
+    naive = "2024-06-01T00:00:00"
+    _, (start, _) = split_date_filters({"ingested_after": naive})
+    assert ingested_epoch({"ingested_at": naive}) == start == datetime(2024, 6, 1, tzinfo=UTC).timestamp()
+
+    store = UpsertStore()
+    now = datetime.now(UTC)
+    # Many recent near-duplicates outrank the two old chunks, far past the k*4 over-fetch
+    for i in range(30):
+        ingest_text(store, f"Whitefly control on tomato, note {i}.", source_url=f"http://new{i}", effective_date=now)
+    for i in range(2):
+        ingest_text(store, f"Whitefly on tomato, archive {i}.", source_url=f"http://old{i}", effective_date=now - timedelta(days=60))
+    emb = SimpleTokenizerEmbeddings(dim=256)
+    vs = InMemoryVectorStore()
+    index_store_chunks(store, emb, vs)
+    er = EmbeddingRetriever(store, emb, vs)
+    old = er.retrieve("whitefly control on tomato note", filters={"ingested_before": (now - timedelta(days=30)).isoformat()}, k=2)
+    assert len(old) == 2 and all("archive" in r.chunk.text for r in old)
+    assert er.retrieve("whitefly", filters={"ingested_after": (now + timedelta(days=1)).isoformat()}, k=2) == []
+
+
+def test_caching_retriever_hits_and_invalidates_on_store_change():
+    from app.services.caching import LRUCache
+    from app.services.retrieval import CachingRetriever, RetrievalCache
+
+    class Counting:
+        def __init__(self, base):
+            self.base = base
+            self.calls = 0
+
+        def retrieve(self, query, *, filters=None, k=5):
+            self.calls += 1
+            return self.base.retrieve(query, filters=filters, k=k)
+
+    store = UpsertStore()
+    ingest_text(store, "Tomato leaf curl treatment: control whitefly.", region="mh", source_url="http://a")
+    base = Counting(InMemoryRetriever(store))
+    cache = RetrievalCache(lambda: store.generation, max_entries=8)
+    cr = CachingRetriever(base, cache)
+
+    first = cr.retrieve("Tomato leaf curl treatment", k=3)
+    again = cr.retrieve("  tomato LEAF curl   treatment ", k=3)
+    assert [r.chunk.id for r in first] == [r.chunk.id for r in again]
+    assert base.calls == 1
+    cr.retrieve("tomato leaf curl treatment", filters={"region": "mh"}, k=3)
+    assert base.calls == 2
+
+    ingest_text(store, "Leaf curl virus spreads via whitefly.", region="mh", source_url="http://b")
+    fresh = cr.retrieve("tomato leaf curl treatment", k=3)
+    assert base.calls == 3 and len(fresh) == 2
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["invalidations"] == 1
+
+    # TTL expiry and LRU bound of the underlying cache
+    now = [0.0]
+    lru = LRUCache(2, ttl_s=10, clock=lambda: now[0])
+    lru.set("a", 1)
+    lru.set("b", 2, ttl_s=None)
+    lru.set("c", 3)
+    assert lru.get("a") is None and lru.get("b") == 2
+    now[0] = 11.0
+    assert lru.get("c") is None and lru.get("b") == 2
+
+
+def test_scoring_pipeline_skips_rerank_under_low_budget():
+    from app.services.budget import Deadline
+    from app.services.retrieval import AuthorityBoost, FreshnessDecay, ScoringPipeline
+
+    store = UpsertStore()
+    ingest_text(store, "Use certified seeds from trusted dealers.", source_url="http://plain", max_chars=200)
+    ingest_text(store, "Certified seeds only; check the tag.", authority="ICAR", source_url="http://icar", max_chars=200)
+
+    class Recording(InMemoryRetriever):
+        ks = []
+
+        def retrieve(self, query, *, filters=None, k=5):
+            Recording.ks.append(k)
+            return super().retrieve(query, filters=filters, k=k)
+
+    pipe = ScoringPipeline(Recording(store), [FreshnessDecay(store=store), AuthorityBoost(100.0)])
+    boosted = pipe.retrieve("certified seeds", k=1, deadline=Deadline(3.0, clock=lambda: 0.0))
+    assert boosted[0].score > 50
+
+    now = [0.0]
+    hurried = Deadline(3.0, clock=lambda: now[0])
+    now[0] = 1.5
+    plain = pipe.retrieve("certified seeds", k=1, deadline=hurried)
+    assert plain[0].score < 50
+    assert hurried.degradations == ["skipped_rerank"]
+    assert Recording.ks == [8, 4]  # optional term's over-fetch is dropped too
+
+
+def test_retriever_chain_names_every_wrapper():
+    from app.services.retrieval import CachingRetriever, RetrievalCache, retriever_chain
+
+    store = UpsertStore()
+    reranked = RerankerWrapper(FreshnessWeightedRetriever(InMemoryRetriever(store)))
+    cached = CachingRetriever(reranked, RetrievalCache(lambda: store.generation))
+    assert retriever_chain(InMemoryRetriever(store)) == "InMemoryRetriever"
+    assert retriever_chain(cached) == "CachingRetriever>RerankerWrapper>FreshnessWeightedRetriever>InMemoryRetriever"